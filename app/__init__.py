@@ -2,6 +2,7 @@ from flask import Flask, redirect, url_for
 from flask_login import current_user
 from .extensions import db, migrate, login_manager
 from . import commands
+from .services import sidebar_cache, job_queue
 
 # Import models to ensure they are registered with SQLAlchemy
 from .models.user import User
@@ -19,6 +20,10 @@ from .models.material_request import MaterialRequest, MaterialRequestItem
 from .models.material_return import MaterialReturn, MaterialReturnItem
 from .models.payment_order import PaymentOrder
 from .models.boq_item import BOQItem
+from .models.project_financials import ProjectFinancials
+from .models.boq_import_job import BOQImportJob
+from .models.background_job import BackgroundJob
+from .models.sheet_sync import SheetSyncState, SheetSyncRow
 
 def create_app():
     app = Flask(__name__, template_folder='../templates', static_folder='../static')
@@ -35,19 +40,18 @@ def create_app():
     def load_user(user_id):
         return User.query.get(int(user_id))
 
+    sidebar_cache.init_app(app)
+    job_queue.init_app(app)
+
     @app.context_processor
     def inject_sidebar_data():
         sidebar_projects = []
         sidebar_contractors = []
         if current_user.is_authenticated:
-            if current_user.role in ['admin', 'sub-admin']:
-                sidebar_projects = Project.query.filter_by(is_archived=False).order_by(Project.name).all()
-                sidebar_contractors = Contractor.query.order_by(Contractor.name).all()
-            else:
-                sidebar_projects = Project.query.join(User.projects).filter(User.id == current_user.id, Project.is_archived==False).order_by(Project.name).all()
-                if sidebar_projects:
-                    project_ids = [p.id for p in sidebar_projects]
-                    sidebar_contractors = Contractor.query.join(Invoice).filter(Invoice.project_id.in_(project_ids)).distinct().order_by(Contractor.name).all()
+            # Served from the sidebar cache; invalidated on writes to the underlying tables
+            sidebar_data = sidebar_cache.get_sidebar_data(current_user)
+            sidebar_projects = sidebar_data['projects']
+            sidebar_contractors = sidebar_data['contractors']
         return dict(
             sidebar_projects=sidebar_projects,
             sidebar_contractors=sidebar_contractors
@@ -66,6 +70,7 @@ def create_app():
     from .routes.forms_routes import forms_bp
     from .routes.payment_order_routes import payment_orders_bp
     from .routes.boq_routes import boq_bp  # NEW
+    from .routes.job_routes import jobs_bp
 
     app.register_blueprint(project_bp)
     app.register_blueprint(item_bp)
@@ -79,6 +84,7 @@ def create_app():
     app.register_blueprint(forms_bp)
     app.register_blueprint(payment_orders_bp)
     app.register_blueprint(boq_bp)  # NEW
+    app.register_blueprint(jobs_bp)
     
     @app.route('/')
     def index():
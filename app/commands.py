@@ -1,7 +1,19 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from types import SimpleNamespace
+
 import click
+from flask import current_app
 from flask.cli import with_appcontext
 from .models.user import User
+from .models.item import invoiced_quantity_drift, rebuild_invoiced_quantities
+from .models.project_financials import ProjectFinancials
 from .extensions import db
+from .services import boq_import_service, job_queue
+from .utils import excel_utils
 
 @click.command(name='create-admin')
 @with_appcontext
@@ -20,6 +32,144 @@ def create_admin(username):
     db.session.commit()
     click.echo(f"User '{username}' has been promoted to Admin.")
 
+@click.command(name='rebuild-rollups')
+@with_appcontext
+def rebuild_rollups():
+    """
+    Rebuilds the project_financials rollup table and the invoiced_quantity
+    counters of items and cost details from scratch.
+    Usage: flask rebuild-rollups
+    """
+    rebuild_invoiced_quantities(db.session.connection())
+    ProjectFinancials.rebuild()
+    click.echo(f"Rebuilt financial rollups for {ProjectFinancials.query.count()} projects.")
+
+@click.command(name='check-invoiced-quantities')
+@with_appcontext
+def check_invoiced_quantities():
+    """
+    Compares the invoiced_quantity counters with the sums of the invoice lines.
+    Exits with status 1 when any counter has drifted (fix with: flask rebuild-rollups).
+    Usage: flask check-invoiced-quantities
+    """
+    drift = invoiced_quantity_drift(db.session.connection())
+    for table_name, row_id, stored, actual in drift:
+        click.echo(f"{table_name} {row_id}: counter {stored} != invoiced {actual}")
+    if drift:
+        raise SystemExit(1)
+    click.echo("All invoiced_quantity counters match the invoice lines.")
+
+# Runs one import in a fresh interpreter so each engine gets its own peak RSS.
+# excel_utils is loaded by path so the app package (Flask, SQLAlchemy) is not imported.
+_EXCEL_BENCHMARK_SCRIPT = """
+import importlib.util, json, sys, time
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def peak_rss_mb():
+    # VmHWM starts fresh at exec; ru_maxrss on Linux keeps the parent's peak
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+spec = importlib.util.spec_from_file_location('excel_utils', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+baseline = peak_rss_mb()
+start = time.perf_counter()
+with open(sys.argv[3], 'rb') as f:
+    items = module.import_boq_from_excel(f, engine=sys.argv[2])
+print(json.dumps({'rows': len(items), 'seconds': time.perf_counter() - start,
+                  'baseline_rss_mb': baseline, 'peak_rss_mb': peak_rss_mb()}))
+"""
+
+@click.command(name='benchmark-excel-import')
+@click.option('--rows', default=20000, show_default=True, help='Rows in the generated BOQ workbook.')
+@click.option('--file', 'path', type=click.Path(exists=True, dir_okay=False), help='Use an existing BOQ workbook instead.')
+def benchmark_excel_import(rows, path):
+    """
+    Compares the Excel import engines (wall time and peak RSS) on a BOQ workbook.
+    Usage: flask benchmark-excel-import --rows 20000
+    """
+    generated = None
+    if not path:
+        sample = (
+            SimpleNamespace(item_number=str(i + 1), description=f"بند رقم {i + 1}", unit='م3',
+                            quantity=float(i % 50 + 1), executed_quantity=0.0, unit_price=125.5,
+                            total_price=(i % 50 + 1) * 125.5, completion_percentage=0.0, category='خرسانة')
+            for i in range(rows)
+        )
+        output = excel_utils.export_boq_to_excel(sample)
+        generated = tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False)
+        with generated:
+            generated.write(output.read())
+        output.close()
+        path = generated.name
+
+    try:
+        click.echo(f"{'engine':<10} {'rows':>8} {'seconds':>9} {'baseline MB':>12} {'peak RSS MB':>12}")
+        for engine in excel_utils.EXCEL_IMPORT_ENGINES:
+            completed = subprocess.run(
+                [sys.executable, '-c', _EXCEL_BENCHMARK_SCRIPT, excel_utils.__file__, engine, path],
+                capture_output=True, text=True
+            )
+            if completed.returncode != 0:
+                click.echo(f"{engine:<10} failed: {completed.stderr.strip().splitlines()[-1:]}")
+                continue
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            baseline = f"{result['baseline_rss_mb']:.1f}" if result['baseline_rss_mb'] is not None else 'n/a'
+            peak = f"{result['peak_rss_mb']:.1f}" if result['peak_rss_mb'] is not None else 'n/a'
+            click.echo(f"{engine:<10} {result['rows']:>8} {result['seconds']:>9.2f} {baseline:>12} {peak:>12}")
+    finally:
+        if generated:
+            os.unlink(generated.name)
+
+@click.command(name='run-worker')
+@with_appcontext
+@click.option('--threads', default=None, type=int, help='Worker threads (default: JOBS_WORKER_THREADS).')
+@click.option('--poll-interval', default=None, type=float, help='Seconds between polls of an idle worker.')
+@click.option('--burst', is_flag=True, help='Exit as soon as the queue is empty.')
+def run_worker(threads, poll_interval, burst):
+    """
+    Runs background jobs (Sheets export/import, BOQ Excel import/export, PDFs).
+    Usage: flask run-worker --threads 2
+    Start it next to gunicorn (the Dockerfile does); with JOBS_EXECUTION=worker, the default,
+    the web processes only enqueue.
+    """
+    app = current_app._get_current_object()
+    threads = threads or app.config.get('JOBS_WORKER_THREADS', 1)
+    click.echo(f"Background worker started with {threads} thread(s). Press Ctrl+C to stop.")
+    job_queue.run_workers(app, threads=threads, poll_interval=poll_interval, burst=burst)
+
+@click.command(name='purge-jobs')
+@with_appcontext
+@click.option('--days', default=7, show_default=True, help='Delete finished jobs older than this.')
+def purge_jobs(days):
+    """
+    Deletes finished background jobs and their stored result files, and drops the
+    uploaded files of BOQ import jobs left unfinished for as long.
+    Usage: flask purge-jobs --days 7
+    """
+    deleted = job_queue.purge_finished_jobs(days)
+    click.echo(f"Deleted {deleted} finished background jobs.")
+    cleared = boq_import_service.purge_stale_files(days)
+    click.echo(f"Dropped the stored file of {cleared} BOQ import jobs.")
+
 def init_app(app):
     """Register CLI commands with the Flask app."""
-    app.cli.add_command(create_admin)
\ No newline at end of file
+    app.cli.add_command(create_admin)
+    app.cli.add_command(rebuild_rollups)
+    app.cli.add_command(check_invoiced_quantities)
+    app.cli.add_command(benchmark_excel_import)
+    app.cli.add_command(run_worker)
+    app.cli.add_command(purge_jobs)
\ No newline at end of file
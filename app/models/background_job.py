@@ -0,0 +1,86 @@
+from app.extensions import db
+from datetime import datetime
+
+
+class BackgroundJob(db.Model):
+    """
+    Queued background work (مهمة في الخلفية): Google Sheets export/import, BOQ
+    Excel import/export and PDF generation.
+
+    Routes enqueue a row and return immediately; a worker (flask run-worker, or
+    the in-process worker threads) claims queued rows and runs the registered
+    task. Generated files are written to the results directory (see
+    job_queue.results_dir); the job keeps their name until it is purged.
+    """
+    __tablename__ = 'background_job'
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+
+    STATUS_LABELS = {
+        STATUS_QUEUED: 'في الانتظار',
+        STATUS_RUNNING: 'قيد التنفيذ',
+        STATUS_SUCCEEDED: 'مكتملة',
+        STATUS_FAILED: 'فشلت',
+    }
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  # Registered task name, e.g. 'sheets.export_items'
+    title = db.Column(db.String(255), nullable=False)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+    status = db.Column(db.String(20), nullable=False, default=STATUS_QUEUED)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    worker_id = db.Column(db.String(100), nullable=True)
+
+    result_message = db.Column(db.Text, nullable=True)
+    result_details = db.Column(db.JSON, nullable=True)
+    result_filename = db.Column(db.String(255), nullable=True)
+    result_mimetype = db.Column(db.String(100), nullable=True)
+    result_path = db.Column(db.String(255), nullable=True)  # File name inside the results directory
+    error_message = db.Column(db.Text, nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)  # Refreshed by the worker while the task runs
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    user = db.relationship('User')
+
+    __table_args__ = (
+        # Workers claim the oldest queued job
+        db.Index('idx_background_job_status', 'status', 'id'),
+        db.Index('idx_background_job_user', 'user_id', 'id'),
+    )
+
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_SUCCEEDED, self.STATUS_FAILED)
+
+    @property
+    def has_file(self):
+        return self.status == self.STATUS_SUCCEEDED and bool(self.result_path)
+
+    @property
+    def status_label(self):
+        return self.STATUS_LABELS.get(self.status, self.status)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'title': self.title,
+            'status': self.status,
+            'status_label': self.status_label,
+            'result_message': self.result_message,
+            'result_filename': self.result_filename,
+            'error_message': self.error_message,
+            'is_finished': self.is_finished,
+            'has_file': self.has_file,
+        }
+
+    def __repr__(self):
+        return f'<BackgroundJob {self.id} {self.kind} {self.status}>'
@@ -0,0 +1,69 @@
+from app.extensions import db
+from datetime import datetime
+
+
+class BOQImportJob(db.Model):
+    """
+    Chunked, resumable BOQ Excel import (مهمة استيراد جدول الكميات).
+
+    The uploaded file is kept with the job until it is completed, so the import
+    can be continued after a failure or a worker timeout. Every chunk of rows is committed together with
+    the checkpoint (processed_rows), so a resumed job never inserts a row twice.
+    """
+    __tablename__ = 'boq_import_job'
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+    filename = db.Column(db.String(255), nullable=False)
+    file_hash = db.Column(db.String(64), nullable=False)  # SHA-256 of the uploaded file
+    file_data = db.deferred(db.Column(db.LargeBinary, nullable=True))  # Dropped once completed
+    engine = db.Column(db.String(20), nullable=True)
+
+    status = db.Column(db.String(20), nullable=False, default=STATUS_PENDING)
+    total_rows = db.Column(db.Integer, nullable=True)  # Valid rows found in the file
+    processed_rows = db.Column(db.Integer, nullable=False, default=0)  # Checkpoint: rows already committed
+    invalid_cells = db.Column(db.JSON, nullable=True)  # {column: [Excel row numbers]}
+    error_message = db.Column(db.Text, nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    project = db.relationship('Project')
+    user = db.relationship('User')
+
+    __table_args__ = (
+        db.Index('idx_boq_import_job_checkpoint', 'project_id', 'file_hash'),
+    )
+
+    @property
+    def is_finished(self):
+        return self.status == self.STATUS_COMPLETED
+
+    @property
+    def progress_percent(self):
+        if not self.total_rows:
+            return 100.0 if self.is_finished else 0.0
+        return round(self.processed_rows * 100.0 / self.total_rows, 1)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'filename': self.filename,
+            'total_rows': self.total_rows,
+            'processed_rows': self.processed_rows,
+            'progress_percent': self.progress_percent,
+            'invalid_cells': self.invalid_cells or {},
+            'error_message': self.error_message,
+        }
+
+    def __repr__(self):
+        return f'<BOQImportJob {self.id} {self.status} {self.processed_rows}/{self.total_rows}>'
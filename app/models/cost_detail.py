@@ -18,6 +18,9 @@ class CostDetail(db.Model):
     item_id = db.Column(db.Integer, db.ForeignKey('item.id'), nullable=False)
     contractor_id = db.Column(db.Integer, db.ForeignKey('contractor.id'), nullable=True)
 
+    # Running total of the quantity invoiced on this detail (see the ledger hook in item.py)
+    invoiced_quantity = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+
     item = db.relationship('Item', back_populates='cost_details')
     contractor = db.relationship('Contractor', back_populates='cost_details')
 
@@ -1,15 +1,21 @@
 from app.extensions import db
-from sqlalchemy import func, select # <<< تم إضافة select
+from sqlalchemy import bindparam, event, func, inspect, select # <<< تم إضافة select
 from app import constants
-from sqlalchemy.orm import relationship, column_property # <<< تم إضافة column_property
+from sqlalchemy.orm import Session, relationship, column_property, validates # <<< تم إضافة column_property
+from app.utils import natural_sort_key
 
 # Make sure to import related models at the top
 from .invoice_item import InvoiceItem
 from .payment import Payment
 
+# Byte-wise collation on PostgreSQL so locale rules never reorder the padded sort keys
+SORT_KEY_TYPE = db.String(255).with_variant(db.String(255, collation='C'), 'postgresql')
+
 class Invoice(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     invoice_number = db.Column(db.String(100), nullable=False, unique=True)
+    # Natural-sort key derived from invoice_number (kept in sync by the validator below)
+    invoice_number_sort_key = db.Column(SORT_KEY_TYPE, nullable=True)
     invoice_date = db.Column(db.Date, nullable=False)
     due_date = db.Column(db.Date)
     status = db.Column(db.String(50), nullable=False, default=constants.INVOICE_STATUS_NEW)
@@ -28,6 +34,15 @@ class Invoice(db.Model):
     items = relationship('InvoiceItem', back_populates='invoice', cascade="all, delete-orphan")
     payments = relationship('Payment', back_populates='invoice', cascade="all, delete-orphan")
 
+    __table_args__ = (
+        db.Index('idx_invoice_project_sort_key', 'project_id', 'invoice_number_sort_key'),
+    )
+
+    @validates('invoice_number')
+    def _sync_invoice_number_sort_key(self, key, value):
+        self.invoice_number_sort_key = natural_sort_key(value)
+        return value
+
     # --- START: Performance Refactoring using column_property ---
     # حساب الإجمالي الكلي لبنود الفاتورة بكفاءة عالية (في استعلام القائمة)
     total_amount = column_property(
@@ -58,19 +73,96 @@ class Invoice(db.Model):
         # Using a small tolerance for float comparison
         return self.remaining_amount < 0.01
 
-    def update_status(self):
-        if self.status == constants.INVOICE_STATUS_CANCELLED:
-            return
-        total = self.total_amount
-        paid = self.paid_amount
+    @staticmethod
+    def status_for(status, total, paid):
+        """The status an invoice should have for its current status, total and paid amount."""
+        if status == constants.INVOICE_STATUS_CANCELLED:
+            return status
         if paid <= 0:
             # Keep the current status if it's New, Under Review, or Approved
-            if self.status not in [constants.INVOICE_STATUS_NEW, constants.INVOICE_STATUS_UNDER_REVIEW, constants.INVOICE_STATUS_APPROVED]:
-                self.status = constants.INVOICE_STATUS_APPROVED
-        elif paid >= total:
-            self.status = constants.INVOICE_STATUS_FULLY_PAID
-        else:
-            self.status = constants.INVOICE_STATUS_PARTIALLY_PAID
+            if status not in [constants.INVOICE_STATUS_NEW, constants.INVOICE_STATUS_UNDER_REVIEW, constants.INVOICE_STATUS_APPROVED]:
+                return constants.INVOICE_STATUS_APPROVED
+            return status
+        if paid >= total:
+            return constants.INVOICE_STATUS_FULLY_PAID
+        return constants.INVOICE_STATUS_PARTIALLY_PAID
+
+    def update_status(self):
+        self.status = self.status_for(self.status, self.total_amount, self.paid_amount)
 
     def __repr__(self):
-        return f'<Invoice {self.invoice_number} for Project {self.project_id}>'
\ No newline at end of file
+        return f'<Invoice {self.invoice_number} for Project {self.project_id}>'
+
+
+# --- START: Batched invoice status refresh ---
+# Invoices whose payments or lines changed in the current transaction wait in
+# session.info until commit, when all their statuses are recomputed at once.
+_PENDING_STATUS_KEY = 'invoice_status_pending'
+
+
+@event.listens_for(Session, 'after_flush')
+def receive_after_flush_collect_invoices(session, flush_context):
+    pending = session.info.setdefault(_PENDING_STATUS_KEY, set())
+    changed = [obj for obj in session.new | session.deleted]
+    changed += [obj for obj in session.dirty if session.is_modified(obj, include_collections=False)]
+    for obj in changed:
+        if isinstance(obj, (Payment, InvoiceItem)):
+            history = inspect(obj).attrs.invoice_id.history
+            pending.update(invoice_id for invoice_id in (obj.invoice_id, *history.deleted) if invoice_id is not None)
+
+
+@event.listens_for(Session, 'before_commit')
+def receive_before_commit_refresh_invoice_statuses(session):
+    """Recomputes the statuses of the collected invoices with one grouped query."""
+    session.flush()
+    invoice_ids = session.info.pop(_PENDING_STATUS_KEY, None)
+    if not invoice_ids:
+        return
+    refresh_statuses(session, invoice_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def receive_after_rollback_forget_invoices(session):
+    session.info.pop(_PENDING_STATUS_KEY, None)
+
+
+def refresh_statuses(session, invoice_ids):
+    """Writes the status of every given invoice whose totals call for a new one."""
+    invoice_ids = sorted(invoice_ids)
+    totals = (
+        select(InvoiceItem.invoice_id, func.sum(InvoiceItem.total_price).label('amount'))
+        .where(InvoiceItem.invoice_id.in_(invoice_ids))
+        .group_by(InvoiceItem.invoice_id)
+        .subquery()
+    )
+    payments = (
+        select(Payment.invoice_id, func.sum(Payment.amount).label('amount'))
+        .where(Payment.invoice_id.in_(invoice_ids))
+        .group_by(Payment.invoice_id)
+        .subquery()
+    )
+    rows = session.execute(
+        select(Invoice.id, Invoice.status, func.coalesce(totals.c.amount, 0.0), func.coalesce(payments.c.amount, 0.0))
+        .outerjoin(totals, totals.c.invoice_id == Invoice.id)
+        .outerjoin(payments, payments.c.invoice_id == Invoice.id)
+        .where(Invoice.id.in_(invoice_ids))
+    ).all()
+
+    changes = []
+    for invoice_id, status, total, paid in rows:
+        new_status = Invoice.status_for(status, total, paid)
+        if new_status != status:
+            changes.append({'invoice_id': invoice_id, 'new_status': new_status})
+    if not changes:
+        return
+
+    table = Invoice.__table__
+    session.connection().execute(
+        table.update().where(table.c.id == bindparam('invoice_id')).values(status=bindparam('new_status')),
+        changes
+    )
+    for change in changes:
+        loaded = session.identity_map.get(inspect(Invoice).identity_key_from_primary_key((change['invoice_id'],)))
+        if loaded is not None:
+            session.expire(loaded, ['status'])
+# --- END: Batched invoice status refresh ---
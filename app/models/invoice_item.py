@@ -1,17 +1,20 @@
 from app.extensions import db
-from sqlalchemy import func
+from sqlalchemy import func, select
+from sqlalchemy.orm import column_property
 from .payment_distribution import PaymentDistribution
 
 class InvoiceItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     description = db.Column(db.Text, nullable=False)
-    quantity = db.Column(db.Float, nullable=False)
+    # active_history: the invoiced_quantity ledger (item.py) needs the previous value of an edit,
+    # even when the attribute was expired (e.g. after a commit) before being assigned
+    quantity = column_property(db.Column(db.Float, nullable=False), active_history=True)
     unit_price = db.Column(db.Float, nullable=False)
     total_price = db.Column(db.Float, nullable=False)
 
     invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'), nullable=False)
-    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), nullable=False)
-    cost_detail_id = db.Column(db.Integer, db.ForeignKey('cost_detail.id'), nullable=True)
+    item_id = column_property(db.Column(db.Integer, db.ForeignKey('item.id'), nullable=False), active_history=True)
+    cost_detail_id = column_property(db.Column(db.Integer, db.ForeignKey('cost_detail.id'), nullable=True), active_history=True)
 
     # Relationships
     invoice = db.relationship('Invoice', back_populates='items')
@@ -28,21 +31,23 @@ class InvoiceItem(db.Model):
     distributions = db.relationship('PaymentDistribution', back_populates='invoice_item', cascade="all, delete-orphan")
     # --- END: NEW RELATIONSHIP ---
 
-    @property
-    def paid_amount(self):
-        """Calculates the total amount paid specifically for this invoice item."""
-        if not self.id:
-            return 0.0
-        return db.session.query(
-            func.sum(PaymentDistribution.amount)
-        ).filter(
-            PaymentDistribution.invoice_item_id == self.id
-        ).scalar() or 0.0
+    # --- START: Performance Refactoring using column_property ---
+    # إجمالي المدفوع على البند: يُحمّل لكل بنود المستخلص في نفس الاستعلام
+    # عند استخدام undefer(InvoiceItem.paid_amount) بدلاً من استعلام لكل بند
+    paid_amount = column_property(
+        select(func.coalesce(func.sum(PaymentDistribution.amount), 0.0))
+        .where(PaymentDistribution.invoice_item_id == id)
+        .correlate_except(PaymentDistribution)
+        .scalar_subquery(),
+        deferred=True
+    )
+    # --- END: Performance Refactoring ---
 
     @property
     def remaining_amount(self):
         """Calculates the remaining amount for this invoice item."""
-        return self.total_price - self.paid_amount
+        # paid_amount is None for an item that has not been flushed yet
+        return self.total_price - (self.paid_amount or 0.0)
 
     def __init__(self, quantity, item=None, cost_detail=None):
         if item:
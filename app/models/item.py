@@ -1,18 +1,21 @@
 from app.extensions import db
-from sqlalchemy import func, or_, select
-from sqlalchemy.orm import column_property
+from sqlalchemy import event, func, inspect, or_, select
+from sqlalchemy.orm import Session, column_property, validates
 from sqlalchemy.ext.hybrid import hybrid_property
 from .payment import Payment
 from .invoice_item import InvoiceItem
-from .invoice import Invoice
+from .invoice import Invoice, SORT_KEY_TYPE
 from .cost_detail import CostDetail
 from .payment_distribution import PaymentDistribution
 from app import constants
+from app.utils import natural_sort_key
 
 class Item(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
     item_number = db.Column(db.String(255), nullable=False)
+    # Natural-sort key derived from item_number (kept in sync by the validator below)
+    item_number_sort_key = db.Column(SORT_KEY_TYPE, nullable=True)
     description = db.Column(db.Text, nullable=False)
     unit = db.Column(db.String(50))
     contract_quantity = db.Column(db.Float)
@@ -27,6 +30,10 @@ class Item(db.Model):
 
     contractor_id = db.Column(db.Integer, db.ForeignKey('contractor.id'), nullable=True)
 
+    # Running total of the quantity invoiced on main-item lines (InvoiceItem without cost_detail_id),
+    # maintained by the InvoiceItem mapper events at the end of this module
+    invoiced_quantity = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+
     project = db.relationship('Project', back_populates='items')
     contractor = db.relationship('Contractor', back_populates='items')
     cost_details = db.relationship('CostDetail', back_populates='item', cascade="all, delete-orphan")
@@ -35,7 +42,13 @@ class Item(db.Model):
     __table_args__ = (
         db.Index('idx_item_project_id', 'project_id'),
         db.Index('idx_item_contractor_id', 'contractor_id'),
+        db.Index('idx_item_project_sort_key', 'project_id', 'item_number_sort_key', 'id'),
     )
+
+    @validates('item_number')
+    def _sync_item_number_sort_key(self, key, value):
+        self.item_number_sort_key = natural_sort_key(value)
+        return value
     
     # --- START: FULL PERFORMANCE & WARNING FIXES ---
 
@@ -94,4 +107,116 @@ class Item(db.Model):
         return self.description
 
     def __repr__(self):
-        return f'<Item {self.item_number} - {self.description}>'
\ No newline at end of file
+        return f'<Item {self.item_number} - {self.description}>'
+
+
+# --- START: Invoiced quantity ledger ---
+def _invoiced_target(invoice_item, previous=False):
+    """
+    The counter an invoice line adds its quantity to: the cost detail's for
+    detail lines, the main item's otherwise. With previous=True, uses the values
+    before this flush (to take back what the line counted before an edit).
+    """
+    def value(attr_name):
+        if previous:
+            history = inspect(invoice_item).attrs[attr_name].history
+            if history.deleted:
+                return history.deleted[0]
+        return getattr(invoice_item, attr_name)
+
+    if value('cost_detail_id') is not None:
+        return CostDetail, value('cost_detail_id'), value('quantity') or 0.0
+    return Item, value('item_id'), value('quantity') or 0.0
+
+
+_STALE_COUNTERS_KEY = 'invoiced_quantity_stale'
+
+
+def _apply_invoiced_delta(connection, target, sign):
+    """invoiced_quantity = invoiced_quantity +/- quantity on the line's counter row."""
+    model, target_id, quantity = target
+    if target_id is None or not quantity:
+        return
+    table = model.__table__
+    connection.execute(
+        table.update()
+        .where(table.c.id == target_id)
+        .values(invoiced_quantity=table.c.invoiced_quantity + sign * quantity)
+    )
+    return model, target_id
+
+
+def _mark_stale(invoice_item, *keys):
+    session = inspect(invoice_item).session
+    if session is not None:
+        session.info.setdefault(_STALE_COUNTERS_KEY, set()).update(key for key in keys if key)
+
+
+# Mapper events rather than a scan of session.new/deleted: they also fire for lines
+# deleted through the delete-orphan cascade (invoice.items.remove(line)).
+@event.listens_for(InvoiceItem, 'after_insert')
+def receive_after_insert_count_invoiced(mapper, connection, target):
+    _mark_stale(target, _apply_invoiced_delta(connection, _invoiced_target(target), 1))
+
+
+@event.listens_for(InvoiceItem, 'after_update')
+def receive_after_update_count_invoiced(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[name].history.has_changes() for name in ('quantity', 'item_id', 'cost_detail_id')):
+        return
+    _mark_stale(
+        target,
+        _apply_invoiced_delta(connection, _invoiced_target(target, previous=True), -1),
+        _apply_invoiced_delta(connection, _invoiced_target(target), 1)
+    )
+
+
+@event.listens_for(InvoiceItem, 'before_delete')
+def receive_before_delete_count_invoiced(mapper, connection, target):
+    # before_delete: the row still exists if expired attributes have to be loaded
+    _mark_stale(target, _apply_invoiced_delta(connection, _invoiced_target(target, previous=True), -1))
+
+
+@event.listens_for(Session, 'after_flush')
+def receive_after_flush_expire_invoiced_quantities(session, flush_context):
+    """Loaded items and cost details would otherwise keep the pre-update counter."""
+    for model, target_id in session.info.pop(_STALE_COUNTERS_KEY, ()):
+        loaded = session.identity_map.get(inspect(model).identity_key_from_primary_key((target_id,)))
+        if loaded is not None:
+            session.expire(loaded, ['invoiced_quantity'])
+
+
+def _invoiced_sums():
+    """(table, correlated SUM of its invoice lines) for each counter table."""
+    item_table, detail_table, line_table = Item.__table__, CostDetail.__table__, InvoiceItem.__table__
+    return (
+        (item_table, select(func.coalesce(func.sum(line_table.c.quantity), 0.0))
+            .where(line_table.c.item_id == item_table.c.id, line_table.c.cost_detail_id.is_(None))
+            .scalar_subquery()),
+        (detail_table, select(func.coalesce(func.sum(line_table.c.quantity), 0.0))
+            .where(line_table.c.cost_detail_id == detail_table.c.id)
+            .scalar_subquery()),
+    )
+
+
+def rebuild_invoiced_quantities(connection):
+    """Recomputes every invoiced_quantity counter from the invoice lines."""
+    for table, sums in _invoiced_sums():
+        connection.execute(table.update().values(invoiced_quantity=sums))
+
+
+def invoiced_quantity_drift(connection):
+    """
+    [(table name, id, stored counter, sum of the invoice lines)] for every counter
+    that does not match what rebuild_invoiced_quantities() would compute.
+    """
+    drift = []
+    for table, sums in _invoiced_sums():
+        rows = connection.execute(
+            select(table.c.id, table.c.invoiced_quantity, sums)
+            .where(func.abs(table.c.invoiced_quantity - sums) > 0.0001)
+            .order_by(table.c.id)
+        )
+        drift.extend((table.name, row_id, stored, actual) for row_id, stored, actual in rows)
+    return drift
+# --- END: Invoiced quantity ledger ---
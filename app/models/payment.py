@@ -1,5 +1,4 @@
 from app.extensions import db
-from sqlalchemy import event, inspect
 
 class Payment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -18,26 +17,4 @@ class Payment(db.Model):
     )
 
     def __repr__(self):
-        return f'<Payment {self.amount}>'
-
-# --- START: THE FINAL FIX ---
-@event.listens_for(Payment, 'after_insert')
-@event.listens_for(Payment, 'after_update')
-@event.listens_for(Payment, 'after_delete')
-def receive_after_payment_change(mapper, connection, target):
-    """
-    Updates the parent invoice's status after a payment is changed.
-    This function now checks if the session is already working to prevent flushing errors.
-    """
-    if not target.invoice:
-        return
-
-    # Get the session from the target object
-    session = inspect(target).session
-
-    # Check if the session is already in the process of flushing using the correct attribute
-    if not session._flushing:
-        target.invoice.update_status()
-        session.flush()
-# --- END: THE FINAL FIX ---
-
+        return f'<Payment {self.amount}>'
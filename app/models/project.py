@@ -34,9 +34,18 @@ class Project(db.Model):
     items = db.relationship('Item', back_populates='project', cascade="all, delete-orphan")
     invoices = db.relationship('Invoice', back_populates='project', lazy='dynamic', cascade="all, delete-orphan")
 
-    @hybrid_property
-    def total_contract_cost(self):
-        return sum(item.contract_total_cost for item in self.items if item.contract_total_cost is not None)
+    # Materialized rollup row (see ProjectFinancials); maintained by flush hooks, read-only here
+    financials = db.relationship('ProjectFinancials', uselist=False, viewonly=True)
+
+    # Sum of contract_quantity * contract_unit_cost computed at DB level, so list views
+    # can undefer it in bulk instead of hydrating every Item
+    total_contract_cost = column_property(
+        select(func.coalesce(func.sum(Item.contract_quantity * Item.contract_unit_cost), 0.0))
+        .where(Item.project_id == id)
+        .correlate_except(Item)
+        .scalar_subquery(),
+        deferred=True
+    )
 
     # --- START: Performance Refactoring: total_actual_cost ---
     # Calculate Project.total_actual_cost efficiently at DB level using column_property
@@ -0,0 +1,166 @@
+from app.extensions import db
+from datetime import datetime
+from sqlalchemy import event, func, select, inspect, true
+from sqlalchemy.orm import Session
+from .project import Project
+from .item import Item
+from .cost_detail import CostDetail
+from .invoice import Invoice
+from .invoice_item import InvoiceItem
+from .payment import Payment
+
+
+class ProjectFinancials(db.Model):
+    """
+    Materialized per-project financial rollup (ملخص مالي مجمع لكل مشروع).
+
+    One row per project, refreshed by the flush hook below whenever an Item,
+    CostDetail, InvoiceItem or Payment of the project changes, so the projects
+    list and the summary page read a single indexed row per project instead of
+    aggregating over every item. Rebuild with: flask rebuild-rollups
+    """
+    __tablename__ = 'project_financials'
+
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), primary_key=True)
+    total_contract_cost = db.Column(db.Float, nullable=False, default=0.0)
+    total_actual_cost = db.Column(db.Float, nullable=False, default=0.0)
+    total_invoiced_amount = db.Column(db.Float, nullable=False, default=0.0)
+    total_paid_amount = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def total_savings(self):
+        return self.total_contract_cost - self.total_actual_cost
+
+    @property
+    def total_remaining_amount(self):
+        return self.total_actual_cost - self.total_paid_amount
+
+    @staticmethod
+    def aggregate_columns():
+        """Correlated per-project aggregates, keyed by rollup column name."""
+        return {
+            # Same SQL expressions as the Project column_properties
+            'total_contract_cost': Project.total_contract_cost.expression,
+            'total_actual_cost': Project.total_actual_cost.expression,
+            'total_invoiced_amount': select(func.coalesce(func.sum(InvoiceItem.total_price), 0.0))
+                .join(Invoice, Invoice.id == InvoiceItem.invoice_id)
+                .where(Invoice.project_id == Project.id)
+                .correlate(Project)
+                .scalar_subquery(),
+            'total_paid_amount': Project.total_paid_amount.expression,
+        }
+
+    @classmethod
+    def refresh(cls, connection, project_ids=None):
+        """
+        Recomputes the rollup rows of the given projects (all projects when
+        project_ids is None) with one INSERT ... SELECT upsert.
+        """
+        if project_ids is not None:
+            project_ids = sorted(set(pid for pid in project_ids if pid is not None))
+            if not project_ids:
+                return
+            # Serialize concurrent refreshes of the same project (no-op on SQLite)
+            connection.execute(
+                select(Project.id).where(Project.id.in_(project_ids)).order_by(Project.id).with_for_update()
+            ).all()
+
+        aggregates = cls.aggregate_columns()
+        source = select(Project.id, *aggregates.values(), func.now())
+        if project_ids is not None:
+            source = source.where(Project.id.in_(project_ids))
+        else:
+            # SQLite needs a WHERE clause to parse INSERT ... SELECT ... ON CONFLICT
+            source = source.where(true())
+        column_names = ['project_id', *aggregates.keys(), 'updated_at']
+
+        dialect = connection.dialect.name
+        if dialect in ('postgresql', 'sqlite'):
+            if dialect == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            stmt = insert(cls.__table__).from_select(column_names, source)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[cls.__table__.c.project_id],
+                set_={name: stmt.excluded[name] for name in column_names[1:]}
+            )
+            connection.execute(stmt)
+        else:
+            delete_stmt = cls.__table__.delete()
+            if project_ids is not None:
+                delete_stmt = delete_stmt.where(cls.__table__.c.project_id.in_(project_ids))
+            connection.execute(delete_stmt)
+            connection.execute(cls.__table__.insert().from_select(column_names, source))
+
+    @classmethod
+    def rebuild(cls):
+        """Rebuilds the rollup for every project."""
+        connection = db.session.connection()
+        connection.execute(cls.__table__.delete())
+        cls.refresh(connection)
+        db.session.commit()
+
+    def __repr__(self):
+        return f'<ProjectFinancials for Project {self.project_id}>'
+
+
+# --- START: Incremental rollup maintenance ---
+def _history_values(obj, attr_name):
+    """Current and previous values of a column attribute (to catch moves between parents)."""
+    value = getattr(obj, attr_name)
+    history = inspect(obj).attrs[attr_name].history
+    return {value, *history.deleted} - {None}
+
+
+@event.listens_for(Session, 'after_flush')
+def receive_after_flush_refresh_rollups(session, flush_context):
+    """
+    Collects the projects touched by this flush and refreshes only their rollup rows.
+    Parents deleted in the same flush are resolved from the flushed objects themselves.
+    """
+    project_ids = set()
+    item_ids = set()
+    invoice_ids = set()
+    item_projects = {}
+    invoice_projects = {}
+
+    changed = [obj for obj in session.new | session.deleted]
+    changed += [obj for obj in session.dirty if session.is_modified(obj, include_collections=False)]
+
+    for obj in changed:
+        if isinstance(obj, Project):
+            if obj not in session.deleted:
+                project_ids.add(obj.id)
+        elif isinstance(obj, Item):
+            project_ids |= _history_values(obj, 'project_id')
+            item_projects[obj.id] = obj.project_id
+        elif isinstance(obj, CostDetail):
+            item_ids |= _history_values(obj, 'item_id')
+        elif isinstance(obj, Invoice):
+            project_ids |= _history_values(obj, 'project_id')
+            invoice_projects[obj.id] = obj.project_id
+        elif isinstance(obj, (InvoiceItem, Payment)):
+            invoice_ids |= _history_values(obj, 'invoice_id')
+
+    if not (project_ids or item_ids or invoice_ids):
+        return
+
+    connection = session.connection()
+    unresolved_items = item_ids - set(item_projects)
+    if unresolved_items:
+        item_projects.update(connection.execute(
+            select(Item.id, Item.project_id).where(Item.id.in_(unresolved_items))
+        ).all())
+    unresolved_invoices = invoice_ids - set(invoice_projects)
+    if unresolved_invoices:
+        invoice_projects.update(connection.execute(
+            select(Invoice.id, Invoice.project_id).where(Invoice.id.in_(unresolved_invoices))
+        ).all())
+
+    project_ids |= {item_projects.get(item_id) for item_id in item_ids}
+    project_ids |= {invoice_projects.get(invoice_id) for invoice_id in invoice_ids}
+
+    ProjectFinancials.refresh(connection, project_ids)
+# --- END: Incremental rollup maintenance ---
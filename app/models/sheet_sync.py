@@ -0,0 +1,40 @@
+from app.extensions import db
+from datetime import datetime
+
+
+class SheetSyncState(db.Model):
+    """
+    Incremental Google Sheets sync of a project's items (حالة مزامنة البنود).
+
+    Points at the one sheet kept in sync for the project and records the
+    watermark of the last successful sync. The per-item rows are in SheetSyncRow.
+    """
+    __tablename__ = 'sheet_sync_state'
+
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), primary_key=True)
+    spreadsheet_id = db.Column(db.String(255), nullable=False)
+    sheet_id = db.Column(db.Integer, nullable=False)
+    sheet_title = db.Column(db.String(255), nullable=False)
+    row_count = db.Column(db.Integer, nullable=False, default=1)  # Grid rows in use, header included
+    last_synced_at = db.Column(db.DateTime, nullable=True)  # Watermark of the last successful sync
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<SheetSyncState Project {self.project_id} -> {self.sheet_title}>'
+
+
+class SheetSyncRow(db.Model):
+    """
+    Row-to-item mapping of a synced sheet, with a fingerprint of the values last
+    written, so a sync only sends the rows whose values changed.
+    """
+    __tablename__ = 'sheet_sync_row'
+
+    # No foreign key on item_id: the rows of deleted items must stay visible to the sync so it can clear them
+    project_id = db.Column(db.Integer, db.ForeignKey('sheet_sync_state.project_id', ondelete='CASCADE'), primary_key=True)
+    item_id = db.Column(db.Integer, primary_key=True)
+    row_index = db.Column(db.Integer, nullable=False)  # 0-based grid row
+    row_hash = db.Column(db.String(32), nullable=False)
+
+    def __repr__(self):
+        return f'<SheetSyncRow Item {self.item_id} -> row {self.row_index}>'
@@ -1,10 +1,12 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file
+from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, current_app, jsonify, abort
 from flask_login import login_required, current_user
 from app.extensions import db
 from app.models.boq_item import BOQItem
 from app.models.project import Project
+from app.models.boq_import_job import BOQImportJob
+from app.services import boq_import_service, job_queue
 # ✅ الإصلاح: تم إلغاء التعليق وضمان أن الدوال متاحة
-from app.utils.excel_utils import export_boq_to_excel, import_boq_from_excel 
+from app.utils.excel_utils import export_boq_to_excel, format_import_report
 from datetime import datetime
 from io import BytesIO
 
@@ -176,21 +178,19 @@ def export_excel():
     project_id = request.args.get('project_id', type=int)
     
     if project_id:
-        items = BOQItem.query.filter_by(project_id=project_id).all()
-        project = Project.query.get(project_id)
-        filename = f'boq_{project.name}.xlsx'
+        project = Project.query.get_or_404(project_id)
+        title = f'تصدير جدول كميات المشروع {project.name} إلى Excel'
     else:
-        items = BOQItem.query.all()
-        filename = 'boq_all.xlsx'
+        title = 'تصدير جميع جداول الكميات إلى Excel'
     
-    output = export_boq_to_excel(items)
-    
-    return send_file(
-        output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        as_attachment=True,
-        download_name=filename
-    )
+    # The workbook is built by a background job; the user downloads it from the job page
+    job = job_queue.enqueue('boq.export_excel', title, current_user.id, project_id=project_id)
+    # Run inline (serverless): the workbook comes back with this response
+    response = job_queue.inline_file_response(job)
+    if response is not None:
+        return response
+    flash('جاري تجهيز ملف Excel، يمكنك تحميله من صفحة المهمة عند اكتماله', 'info')
+    return redirect(url_for('jobs.show', job_id=job.id))
 
 
 @boq_bp.route('/import/excel', methods=['GET', 'POST'])
@@ -211,34 +211,84 @@ def import_excel():
             flash('يجب أن يكون الملف بصيغة Excel', 'danger')
             return redirect(request.url)
         
-        try:
-            project_id = request.form.get('project_id', type=int)
-            items_data = import_boq_from_excel(file)
-            
-            # Create BOQ items
-            for item_data in items_data:
-                # حساب القيمة الإجمالية أثناء الاستيراد (مُضافة للإصلاح)
-                total_price = item_data.get('quantity', 0) * item_data.get('unit_price', 0)
-                
-                boq_item = BOQItem(
-                    project_id=project_id,
-                    total_price=total_price,
-                    **item_data
-                )
-                db.session.add(boq_item)
-            
-            db.session.commit()
-            flash(f'تم استيراد {len(items_data)} بند بنجاح', 'success')
-            return redirect(url_for('boq.index', project_id=project_id))
-            
-        except Exception as e:
-            db.session.rollback()
-            flash(f'حدث خطأ في الاستيراد: {str(e)}', 'danger')
+        project_id = request.form.get('project_id', type=int)
+        project = Project.query.get(project_id) if project_id else None
+        if not project:
+            flash('الرجاء اختيار المشروع', 'danger')
+            return redirect(request.url)
+        
+        # The form may pick the engine per import; otherwise the configured default is used
+        engine = request.form.get('engine') or current_app.config.get('EXCEL_IMPORT_ENGINE')
+        job, resumed = boq_import_service.create_or_resume_job(
+            project.id, current_user.id, file.filename, file.read(), engine=engine
+        )
+        db.session.commit()
+        if resumed:
+            flash(f'تم العثور على استيراد سابق لنفس الملف، سيتم الاستكمال من الصف {job.processed_rows + 1}', 'info')
+        if job_queue.runs_in_background():
+            _enqueue_import_job(job)
+        return redirect(url_for('boq.import_job', job_id=job.id))
     
     projects = Project.query.all()
     return render_template('boq/import.html', projects=projects)
 
 
+def _enqueue_import_job(job):
+    """Hands the remaining chunks of an import job to a background worker."""
+    job_queue.enqueue('boq.import', f'استيراد جدول الكميات من الملف {job.filename}', current_user.id,
+                      import_job_id=job.id)
+
+
+def _get_import_job_or_404(job_id):
+    job = BOQImportJob.query.get_or_404(job_id)
+    if job.user_id != current_user.id and current_user.role not in ['admin', 'sub-admin']:
+        abort(403)
+    return job
+
+
+def _import_job_data(job):
+    data = job.to_dict()
+    if job.invalid_cells:
+        data['report_message'] = format_import_report(job.invalid_cells)
+    if job.is_finished:
+        data['redirect_url'] = url_for('boq.index', project_id=job.project_id)
+    return data
+
+
+@boq_bp.route('/import/jobs/<int:job_id>')
+@login_required
+def import_job(job_id):
+    """Import progress page (polls until the job is completed)"""
+    job = _get_import_job_or_404(job_id)
+    return render_template('boq/import_job.html', job=job, background=job_queue.runs_in_background())
+
+
+@boq_bp.route('/import/jobs/<int:job_id>/progress')
+@login_required
+def import_job_progress(job_id):
+    """Current progress of an import job"""
+    job = _get_import_job_or_404(job_id)
+    return jsonify(_import_job_data(job))
+
+
+@boq_bp.route('/import/jobs/<int:job_id>/run', methods=['POST'])
+@login_required
+def run_import_job(job_id):
+    """
+    Imports the next chunks of the job within the configured time budget, or,
+    when a background worker runs the import, re-queues a failed job.
+    """
+    job = _get_import_job_or_404(job_id)
+    if not job_queue.runs_in_background():
+        job = boq_import_service.run_job(job)
+    elif job.status == BOQImportJob.STATUS_FAILED:
+        job.status = BOQImportJob.STATUS_PENDING
+        job.error_message = None
+        db.session.commit()
+        _enqueue_import_job(job)
+    return jsonify(_import_job_data(job))
+
+
 @boq_bp.route('/download-template')
 @login_required
 def download_template():
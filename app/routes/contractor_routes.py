@@ -3,12 +3,14 @@ from app.models.contractor import Contractor
 from app.models.project import Project
 # from app.models.user import User # <<< تم الحذف (غير مستخدمة في المنطق الحالي)
 from app.models.invoice import Invoice
+from app.models.invoice_item import InvoiceItem
 from app.models.item import Item 
 from app.extensions import db
 from flask_login import login_required, current_user
 # from sqlalchemy import or_ # <<< تم الحذف (غير مستخدمة في المنطق الحالي)
 from app.utils import sanitize_input
 from app.forms import ContractorForm 
+from sqlalchemy.orm import undefer, selectinload
 
 contractor_bp = Blueprint("contractor", __name__, url_prefix='/contractors')
 
@@ -116,7 +118,12 @@ def show_contractor(contractor_id):
         search_term = f"%{search_filter}%"
         invoices_query = invoices_query.filter(Invoice.invoice_number.ilike(search_term))
     
-    invoices = invoices_query.order_by(Invoice.invoice_date.desc()).all()
+    # Totals and each invoice's lines (with paid amounts) are loaded up front, not per row in the template
+    invoices = invoices_query.options(
+        undefer(Invoice.total_amount),
+        undefer(Invoice.paid_amount),
+        selectinload(Invoice.items).undefer(InvoiceItem.paid_amount)
+    ).order_by(Invoice.invoice_date.desc()).all()
     
     total_due = sum(inv.total_amount for inv in invoices if inv.status != 'ملغي')
     total_paid = sum(inv.paid_amount for inv in invoices if inv.status != 'ملغي')
@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, jsonify, current_app
 from flask_login import login_required, current_user
 from app.extensions import db
 from app.models.material_request import MaterialRequest, MaterialRequestItem
@@ -11,7 +11,7 @@ from app.utils.excel_utils import (
     import_material_request_from_excel, import_material_return_from_excel,
     download_material_request_template, download_material_return_template
 )
-from app.utils.pdf_utils import generate_material_request_pdf, generate_material_return_pdf
+from app.services import job_queue
 from datetime import datetime
 
 forms_bp = Blueprint('forms', __name__, url_prefix='/forms')
@@ -275,17 +275,18 @@ def export_material_request_excel(id):
 @forms_bp.route('/material-requests/<int:id>/export/pdf')
 @login_required
 def export_material_request_pdf(id):
-    """Export material request to PDF"""
+    """Export material request to PDF (generated by a background job)"""
     material_request = MaterialRequest.query.get_or_404(id)
     
-    output = generate_material_request_pdf(material_request)
-    
-    return send_file(
-        output,
-        mimetype='application/pdf',
-        as_attachment=True,
-        download_name=f'material_request_{material_request.request_number}.pdf'
+    job = job_queue.enqueue(
+        'forms.material_request_pdf', f'ملف PDF لطلب المواد {material_request.request_number}',
+        current_user.id, material_request_id=material_request.id
     )
+    response = job_queue.inline_file_response(job)
+    if response is not None:
+        return response
+    flash('جاري تجهيز ملف PDF، يمكنك تحميله من صفحة المهمة عند اكتماله', 'info')
+    return redirect(url_for('jobs.show', job_id=job.id))
 
 
 @forms_bp.route('/material-requests/templates/download')
@@ -315,8 +316,10 @@ def import_material_request():
         return jsonify({'error': 'لم يتم اختيار ملف'}), 400
     
     try:
-        items = import_material_request_from_excel(file)
-        return jsonify({'success': True, 'items': items})
+        report = {}
+        engine = request.form.get('engine') or current_app.config.get('EXCEL_IMPORT_ENGINE')
+        items = import_material_request_from_excel(file, report=report, engine=engine)
+        return jsonify({'success': True, 'items': items, 'invalid_cells': report})
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
@@ -436,17 +439,18 @@ def export_material_return_excel(id):
 @forms_bp.route('/material-returns/<int:id>/export/pdf')
 @login_required
 def export_material_return_pdf(id):
-    """Export material return to PDF"""
+    """Export material return to PDF (generated by a background job)"""
     material_return = MaterialReturn.query.get_or_404(id)
     
-    output = generate_material_return_pdf(material_return)
-    
-    return send_file(
-        output,
-        mimetype='application/pdf',
-        as_attachment=True,
-        download_name=f'material_return_{material_return.return_number}.pdf'
+    job = job_queue.enqueue(
+        'forms.material_return_pdf', f'ملف PDF لمرتجع المواد {material_return.return_number}',
+        current_user.id, material_return_id=material_return.id
     )
+    response = job_queue.inline_file_response(job)
+    if response is not None:
+        return response
+    flash('جاري تجهيز ملف PDF، يمكنك تحميله من صفحة المهمة عند اكتماله', 'info')
+    return redirect(url_for('jobs.show', job_id=job.id))
 
 
 @forms_bp.route('/material-returns/templates/download')
@@ -1,5 +1,5 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, abort
-from sqlalchemy import func, or_, desc, cast, Integer
+from flask import Blueprint, render_template, request, redirect, url_for, flash, abort, jsonify
+from sqlalchemy import or_, desc
 import datetime
 import re
 from app.models.project import Project
@@ -9,16 +9,29 @@ from app.models.invoice import Invoice
 from app.models.invoice_item import InvoiceItem
 from app.models.payment import Payment
 from app.models.cost_detail import CostDetail
-from app.models.payment_distribution import PaymentDistribution
 from app.extensions import db
 from flask_login import login_required, current_user
 from app.utils import check_project_permission, sanitize_input
 from app.forms import InvoiceForm
+from app.services import payment_allocation_service
 from app import constants
-from sqlalchemy.orm import undefer # <<< إضافة: استيراد دالة التحميل الصريح
+from sqlalchemy.orm import undefer, selectinload # <<< إضافة: استيراد دالة التحميل الصريح
 
 invoice_bp = Blueprint("invoice", __name__, url_prefix='/invoices')
 
+
+def _invoice_with_items_query():
+    """Loads the invoice totals and all its lines (with their paid amounts) in a fixed number of queries."""
+    return Invoice.query.options(
+        undefer(Invoice.total_amount),
+        undefer(Invoice.paid_amount),
+        selectinload(Invoice.items).options(
+            undefer(InvoiceItem.paid_amount),
+            selectinload(InvoiceItem.distributions)
+        )
+    )
+
+
 # --- START: THE FIX (Performance Optimization) ---
 @invoice_bp.route("/project/<int:project_id>")
 @login_required
@@ -56,7 +69,7 @@ def get_invoices_by_project(project_id):
             flash("تنسيق التاريخ المدخل غير صحيح. يرجى استخدام صيغة YYYY-MM-DD.", "warning")
             
     if sort_by == 'invoice_number':
-        order_column = Invoice.invoice_number
+        order_column = Invoice.invoice_number_sort_key
     else:
         order_column = Invoice.invoice_date
 
@@ -97,7 +110,8 @@ def new_invoice(project_id):
     next_invoice_number = "001" 
 
     if request.method == "GET":
-        last_invoice_tuple = db.session.query(Invoice.invoice_number).filter_by(project_id=project_id).order_by(cast(func.regexp_replace(Invoice.invoice_number, '[^0-9]', '', 'g'), Integer).desc()).first()
+        # Index range scan on (project_id, invoice_number_sort_key)
+        last_invoice_tuple = db.session.query(Invoice.invoice_number).filter_by(project_id=project_id).order_by(Invoice.invoice_number_sort_key.desc()).first()
         
         if last_invoice_tuple and last_invoice_tuple[0]:
             last_invoice_number = last_invoice_tuple[0]
@@ -146,70 +160,68 @@ def delete_invoice(invoice_id):
     flash(f"تم حذف المستخلص رقم '{invoice.invoice_number}' وكل ما يتعلق به بنجاح.", "success")
     return redirect(url_for("invoice.get_invoices_by_project", project_id=project_id))
 
-@invoice_bp.route("/<int:invoice_id>")
-@login_required
-def show_invoice(invoice_id):
-    invoice = Invoice.query.get_or_404(invoice_id)
-    check_project_permission(invoice.project)
-    # Compute availability based on remaining quantities across ALL invoices
-    # 1) Main items: show as long as remaining > 0 (actual_quantity - sum(invoiced qty))
-    candidate_items = Item.query.filter(
+# Tolerance for float quantities: a line is available while remaining > this
+REMAINING_QUANTITY_EPSILON = 0.0001
+
+
+def _available_items(invoice):
+    """
+    Main items of the invoice's project and contractor that still have quantity
+    to invoice (actual_quantity - quantity already invoiced on ALL invoices),
+    with only the columns the picker shows.
+    """
+    return db.session.query(
+        Item.id, Item.item_number, Item.description
+    ).filter(
         Item.project_id == invoice.project_id,
-        Item.contractor_id == invoice.contractor_id
-    ).order_by(Item.item_number).all()
-
-    if candidate_items:
-        item_ids = [it.id for it in candidate_items]
-        invoiced_qty_rows = db.session.query(
-            InvoiceItem.item_id,
-            func.coalesce(func.sum(InvoiceItem.quantity), 0.0)
-        ).filter(
-            InvoiceItem.cost_detail_id.is_(None),
-            InvoiceItem.item_id.in_(item_ids)
-        ).group_by(InvoiceItem.item_id).all()
-        invoiced_qty_map = {row[0]: float(row[1] or 0.0) for row in invoiced_qty_rows}
-    else:
-        invoiced_qty_map = {}
-
-    available_items = []
-    for it in candidate_items:
-        actual_qty = float(it.actual_quantity or 0.0)
-        if actual_qty <= 0:
-            continue
-        already_invoiced = invoiced_qty_map.get(it.id, 0.0)
-        remaining = actual_qty - already_invoiced
-        if remaining > 0.0001:
-            available_items.append(it)
-
-    # 2) Cost details: show as long as remaining > 0 (detail.quantity - sum(invoiced qty for that detail))
-    candidate_details = CostDetail.query.filter(
+        Item.contractor_id == invoice.contractor_id,
+        Item.actual_quantity > 0,
+        Item.actual_quantity - Item.invoiced_quantity > REMAINING_QUANTITY_EPSILON
+    ).order_by(Item.item_number_sort_key, Item.id).all()
+
+
+def _available_cost_details(invoice):
+    """
+    Cost details assigned to the invoice's contractor in its project that still
+    have quantity to invoice, with the item number of their main item.
+    """
+    return db.session.query(
+        CostDetail.id, CostDetail.description, Item.item_number
+    ).join(
+        Item, Item.id == CostDetail.item_id
+    ).filter(
         CostDetail.contractor_id == invoice.contractor_id,
-        CostDetail.item.has(project_id=invoice.project_id)
+        Item.project_id == invoice.project_id,
+        CostDetail.quantity - CostDetail.invoiced_quantity > REMAINING_QUANTITY_EPSILON
     ).order_by(CostDetail.id).all()
 
-    if candidate_details:
-        detail_ids = [d.id for d in candidate_details]
-        detail_invoiced_rows = db.session.query(
-            InvoiceItem.cost_detail_id,
-            func.coalesce(func.sum(InvoiceItem.quantity), 0.0)
-        ).filter(
-            InvoiceItem.cost_detail_id.in_(detail_ids)
-        ).group_by(InvoiceItem.cost_detail_id).all()
-        detail_invoiced_map = {row[0]: float(row[1] or 0.0) for row in detail_invoiced_rows}
-    else:
-        detail_invoiced_map = {}
-
-    available_cost_details = []
-    for d in candidate_details:
-        max_qty = float(d.quantity or 0.0)
-        already = detail_invoiced_map.get(d.id, 0.0)
-        if (max_qty - already) > 0.0001:
-            available_cost_details.append(d)
+
+def _lock_for_invoicing(model, object_id):
+    """
+    Loads an Item or CostDetail with a row lock held until commit, so two
+    requests invoicing the same line cannot both pass the quantity cap
+    (no-op on SQLite, which serializes writers anyway).
+    """
+    obj = model.query.filter_by(id=object_id).with_for_update().populate_existing().first()
+    if obj is None:
+        abort(404)
+    return obj
+
+
+@invoice_bp.route("/<int:invoice_id>")
+@login_required
+def show_invoice(invoice_id):
+    invoice = _invoice_with_items_query().get_or_404(invoice_id)
+    check_project_permission(invoice.project)
+    # Only lines with a remaining quantity left to invoice, across ALL invoices
+    available_items = _available_items(invoice)
+    available_cost_details = _available_cost_details(invoice)
     return render_template(
         "invoices/show.html", 
         invoice=invoice, 
         available_items=available_items, 
-        available_cost_details=available_cost_details
+        available_cost_details=available_cost_details,
+        allocation_strategies=payment_allocation_service.STRATEGIES
     )
 
 @invoice_bp.route("/<int:invoice_id>/add_item", methods=["POST"])
@@ -233,13 +245,13 @@ def add_item_to_invoice(invoice_id):
         return redirect(url_for('invoice.show_invoice', invoice_id=invoice_id))
     if selected_id_str.startswith('item_'):
         item_id = int(selected_id_str.split('_')[1])
-        item = Item.query.get_or_404(item_id)
+        item = _lock_for_invoicing(Item, item_id)
         max_quantity = item.actual_quantity
         if max_quantity is None or max_quantity <= 0:
             # UX IMPROVEMENT: Clearer message
             flash(f"لا يمكن فوترة البند '{item.item_number}' لعدم وجود 'كمية فعلية متاحة للفوترة' مسجلة له.", "danger")
             return redirect(url_for('invoice.show_invoice', invoice_id=invoice_id))
-        previously_invoiced_qty = db.session.query(func.sum(InvoiceItem.quantity)).filter(InvoiceItem.item_id == item.id, InvoiceItem.cost_detail_id.is_(None)).scalar() or 0.0
+        previously_invoiced_qty = item.invoiced_quantity or 0.0
         if (previously_invoiced_qty + new_quantity) > max_quantity:
             remaining_qty = max_quantity - previously_invoiced_qty
             # UX IMPROVEMENT: Show remaining qty
@@ -249,9 +261,9 @@ def add_item_to_invoice(invoice_id):
         flash_message = f"تمت إضافة البند الرئيسي '{item.item_number}' للمستخلص."
     elif selected_id_str.startswith('detail_'):
         detail_id = int(selected_id_str.split('_')[1])
-        cost_detail = CostDetail.query.get_or_404(detail_id)
+        cost_detail = _lock_for_invoicing(CostDetail, detail_id)
         max_quantity = cost_detail.quantity
-        previously_invoiced_qty = db.session.query(func.sum(InvoiceItem.quantity)).filter(InvoiceItem.cost_detail_id == detail_id).scalar() or 0.0
+        previously_invoiced_qty = cost_detail.invoiced_quantity or 0.0
         if (previously_invoiced_qty + new_quantity) > max_quantity:
             remaining_qty = max_quantity - previously_invoiced_qty
             # UX IMPROVEMENT: Show remaining qty
@@ -288,129 +300,82 @@ def add_payment_to_invoice(invoice_id):
         flash("صيغة التاريخ المدخلة غير صالحة. يرجى استخدام صيغة YYYY-MM-DD.", "danger")
         return redirect(url_for('invoice.show_invoice', invoice_id=invoice_id))
 
-    distributions = []
-    total_payment_amount = 0.0
-
-    for key, value in request.form.items():
-        if key.startswith("dist_item_"):
-            try:
-                invoice_item_id = int(key.split("_")[-1])
-                amount = float(value) if value else 0.0
-
-                if amount > 0:
-                    invoice_item = InvoiceItem.query.get(invoice_item_id)
-                    if not invoice_item or invoice_item.invoice_id != invoice_id:
-                        # UX IMPROVEMENT: Clearer message
-                        flash(f"تم العثور على بند غير صالح في الدفعة (ID: {invoice_item_id}).", "danger")
-                        return redirect(url_for('invoice.show_invoice', invoice_id=invoice_id))
-
-                    if amount > round(invoice_item.remaining_amount, 2) + 0.001:
-                        # UX IMPROVEMENT: Clearer message and show limit
-                        flash(f"المبلغ المدفوع للبند '{invoice_item.description[:30]}...' يتجاوز المبلغ المتبقي (الحد الأقصى المتبقي: {invoice_item.remaining_amount:.2f} ر.س).", "danger")
-                        return redirect(url_for('invoice.show_invoice', invoice_id=invoice_id))
-
-                    distributions.append({'invoice_item': invoice_item, 'amount': amount})
-                    total_payment_amount += amount
-            
-            except (ValueError, TypeError):
-                # UX IMPROVEMENT: Clarify error
-                flash("تم إدخال قيمة غير صالحة لأحد البنود. يجب إدخال أرقام فقط.", "danger")
-                return redirect(url_for('invoice.show_invoice', invoice_id=invoice_id))
-
-    if not distributions:
-        flash("الرجاء إدخال مبلغ لدفعه لبند واحد على الأقل.", "warning")
-        return redirect(url_for('invoice.show_invoice', invoice_id=invoice_id))
-
     try:
-        new_payment = Payment(
-            invoice_id=invoice.id,
-            amount=total_payment_amount,
-            payment_date=payment_date,
-            description=description
+        payment_allocation_service.create_payment(
+            invoice, payment_allocation_service.parse_distribution_form(request.form),
+            payment_date=payment_date, description=description
         )
-        db.session.add(new_payment)
-        db.session.flush()
-
-        for dist_data in distributions:
-            new_distribution = PaymentDistribution(
-                payment_id=new_payment.id,
-                invoice_item_id=dist_data['invoice_item'].id,
-                amount=dist_data['amount']
-            )
-            db.session.add(new_distribution)
-
         db.session.commit()
         flash("تم تسجيل الدفعة وتوزيعها بنجاح.", "success")
-
+    except payment_allocation_service.AllocationError as e:
+        db.session.rollback()
+        flash(str(e), "danger")
     except Exception as e:
         db.session.rollback()
         flash(f"حدث خطأ أثناء حفظ الدفعة: {e}", "danger")
 
     return redirect(url_for('invoice.show_invoice', invoice_id=invoice_id))
 
+@invoice_bp.route("/<int:invoice_id>/allocation_preview")
+@login_required
+def allocation_preview(invoice_id):
+    """
+    JSON preview of how a lump-sum payment would be split over the invoice's lines,
+    used to pre-fill the dist_item_* fields of the payment form. Nothing is saved.
+    """
+    invoice = Invoice.query.get_or_404(invoice_id)
+    check_project_permission(invoice.project)
+
+    amount = request.args.get('amount', type=float)
+    strategy = request.args.get('strategy', payment_allocation_service.STRATEGY_PRO_RATA)
+    # When editing a payment, what it already allocated is available again
+    payment_id = request.args.get('payment_id', type=int)
+    if payment_id is not None and not Payment.query.filter_by(id=payment_id, invoice_id=invoice.id).first():
+        abort(404)
+    if amount is None:
+        return jsonify({'error': "الرجاء إدخال مبلغ الدفعة."}), 400
+
+    try:
+        allocation = payment_allocation_service.allocate(
+            invoice.id, amount, strategy=strategy, exclude_payment_id=payment_id
+        )
+    except payment_allocation_service.AllocationError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'strategy': strategy,
+        'amount': round(sum(allocation.values()), 2),
+        'distributions': [
+            {'invoice_item_id': invoice_item_id, 'amount': allocated}
+            for invoice_item_id, allocated in allocation.items()
+        ],
+    })
+
 @invoice_bp.route("/payments/<int:payment_id>/edit", methods=["GET", "POST"])
 @login_required
 def edit_payment(payment_id):
     payment = Payment.query.get_or_404(payment_id)
-    invoice = payment.invoice
-    check_project_permission(invoice.project)
+    check_project_permission(payment.invoice.project)
 
     if request.method == "POST":
         try:
             payment.payment_date = datetime.datetime.strptime(request.form.get("payment_date"), "%Y-%m-%d").date()
             payment.description = sanitize_input(request.form.get("description"))
-            
-            new_total_amount = 0.0
-            distributions_from_form = {} 
-
-            for key, value in request.form.items():
-                if key.startswith("dist_item_"):
-                    invoice_item_id = int(key.split("_")[-1])
-                    amount = float(value) if value else 0.0
-                    
-                    if amount < 0:
-                        flash("لا يمكن إدخال مبلغ سالب.", "danger")
-                        return redirect(url_for('invoice.edit_payment', payment_id=payment_id))
-                    
-                    invoice_item = InvoiceItem.query.get(invoice_item_id)
-                    current_dist = next((d for d in payment.distributions if d.invoice_item_id == invoice_item_id), None)
-                    old_amount_for_item = current_dist.amount if current_dist else 0
-                    
-                    max_allowed = invoice_item.remaining_amount + old_amount_for_item
-                    
-                    if amount > round(max_allowed, 2) + 0.001:
-                        # UX IMPROVEMENT: Clearer message and show limit
-                        flash(f"المبلغ للبند '{invoice_item.description[:30]}...' يتجاوز الحد الأقصى المسموح ({max_allowed:.2f} ر.س).", "danger")
-                        dists_dict = {dist.invoice_item_id: dist.amount for dist in payment.distributions}
-                        return render_template("invoices/edit_payment.html", payment=payment, invoice=invoice, dists=dists_dict)
-
-                    if amount > 0:
-                        distributions_from_form[invoice_item_id] = amount
-                        new_total_amount += amount
-
-            payment.amount = new_total_amount
-
-            existing_dists_map = {d.invoice_item_id: d for d in payment.distributions}
-
-            for item_id, amount in distributions_from_form.items():
-                if item_id in existing_dists_map:
-                    existing_dists_map[item_id].amount = amount
-                else:
-                    new_dist = PaymentDistribution(payment_id=payment.id, invoice_item_id=item_id, amount=amount)
-                    db.session.add(new_dist)
-
-            for item_id, dist in existing_dists_map.items():
-                if item_id not in distributions_from_form:
-                    db.session.delete(dist)
-            
+            payment_allocation_service.update_payment(
+                payment, payment_allocation_service.parse_distribution_form(request.form)
+            )
             db.session.commit()
             flash("تم تحديث الدفعة بنجاح.", "success")
-            return redirect(url_for('invoice.show_invoice', invoice_id=invoice.id))
-
+            return redirect(url_for('invoice.show_invoice', invoice_id=payment.invoice_id))
+        except payment_allocation_service.AllocationError as e:
+            db.session.rollback()
+            flash(str(e), "danger")
         except (ValueError, TypeError) as e:
+            db.session.rollback()
             # UX IMPROVEMENT: Clarify error
             flash(f"البيانات المدخلة غير صالحة. يرجى التأكد من إدخال قيم رقمية صحيحة.", "danger")
-    
+
+    invoice = _invoice_with_items_query().filter(Invoice.id == payment.invoice_id).one()
     dists_dict = {dist.invoice_item_id: dist.amount for dist in payment.distributions}
     return render_template("invoices/edit_payment.html", payment=payment, invoice=invoice, dists=dists_dict)
 
@@ -463,6 +428,18 @@ def edit_item_from_invoice(invoice_item_id):
                 flash("يجب أن تكون الكمية أكبر من صفر.", "danger")
                 return redirect(url_for('invoice.edit_item_from_invoice', invoice_item_id=invoice_item.id))
             
+            # The other lines of the same item/detail keep their quantities: check the cap without this line
+            if invoice_item.cost_detail_id is not None:
+                target = _lock_for_invoicing(CostDetail, invoice_item.cost_detail_id)
+                max_quantity = target.quantity or 0.0
+            else:
+                target = _lock_for_invoicing(Item, invoice_item.item_id)
+                max_quantity = target.actual_quantity or 0.0
+            remaining_qty = max_quantity - ((target.invoiced_quantity or 0.0) - invoice_item.quantity)
+            if quantity > remaining_qty + REMAINING_QUANTITY_EPSILON:
+                flash(f"الكمية تتجاوز الحد المسموح. الكمية المتاحة لهذا البند: {remaining_qty:.2f}", "danger")
+                return redirect(url_for('invoice.edit_item_from_invoice', invoice_item_id=invoice_item.id))
+
             invoice_item.quantity = quantity
             invoice_item.total_price = quantity * invoice_item.unit_price
             
@@ -1,19 +1,25 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, abort
-from sqlalchemy import cast, Integer, func
+from sqlalchemy import and_, or_, func, insert, literal, select, union_all
+import base64
+import json
 from app.models.item import Item
 from app.models.project import Project
 from app.models.audit_log import AuditLog
 from app.models.contractor import Contractor
 from app.models.cost_detail import CostDetail 
+from app.models.project_financials import ProjectFinancials
 from app.extensions import db
 from flask_login import login_required, current_user
-from app.utils import sanitize_input
-#from app.utils import check_project_permission, sanitize_input
+from app.utils import check_project_permission, sanitize_input, natural_sort_key
 from app.forms import ItemForm
-from sqlalchemy.orm import undefer # <<< إضافة: استيراد دالة التحميل الصريح
+from sqlalchemy.orm import undefer, selectinload # <<< إضافة: استيراد دالة التحميل الصريح
 
 item_bp = Blueprint("item", __name__)
 
+# Number of rows per page for the items table (further pages load on scroll)
+ITEMS_PAGE_SIZE = 100
+ITEMS_MAX_PAGE_SIZE = 500
+
 def log_item_change(item, action, changes_details=""):
     details = ""
     if action == 'create':
@@ -35,50 +41,123 @@ def log_item_change(item, action, changes_details=""):
     )
     db.session.add(log_entry)
 
-@item_bp.route("/projects/<int:project_id>/items")
-@login_required
-def get_items_by_project(project_id):
-    project = Project.query.get_or_404(project_id)
-    check_project_permission(project)
-
+# --- START: Keyset pagination for the items table ---
+def _items_filters_from_request():
     # قراءة جميع الفلاتر من الرابط
-    search_number = request.args.get('search_number', '')
-    search_description = request.args.get('search_description', '')
-    status = request.args.get('status', '')
-    contractor_search = request.args.get('contractor', '')
+    return {
+        'search_number': request.args.get('search_number', ''),
+        'search_description': request.args.get('search_description', ''),
+        'status': request.args.get('status', ''),
+        'contractor': request.args.get('contractor', '')
+    }
+
 
+def _filtered_items_query(project_id, filters):
     query = Item.query.filter_by(project_id=project_id)
 
     # تطبيق الفلاتر على الاستعلام
-    if search_number:
-        query = query.filter(Item.item_number.ilike(f"%{search_number}%"))
-    if search_description:
-        query = query.filter(Item.description.ilike(f"%{search_description}%"))
-    if status:
-        query = query.filter(Item.status == status)
-    if contractor_search:
+    if filters['search_number']:
+        query = query.filter(Item.item_number.ilike(f"%{filters['search_number']}%"))
+    if filters['search_description']:
+        query = query.filter(Item.description.ilike(f"%{filters['search_description']}%"))
+    if filters['status']:
+        query = query.filter(Item.status == filters['status'])
+    if filters['contractor']:
         # الانضمام إلى جدول المقاولين للبحث بالاسم
-        query = query.join(Item.contractor).filter(Contractor.name.ilike(f"%{contractor_search}%"))
-
-    # إنشاء قاموس الفلاتر لإرساله للقالب
-    filters = {
-        'search_number': search_number,
-        'search_description': search_description,
-        'status': status,
-        'contractor': contractor_search
-    }
+        query = query.join(Item.contractor).filter(Contractor.name.ilike(f"%{filters['contractor']}%"))
+    return query
+
+
+def _encode_items_cursor(item):
+    raw = json.dumps([item.item_number_sort_key, item.id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def _decode_items_cursor(cursor):
+    try:
+        sort_key, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return str(sort_key), int(item_id)
+    except (ValueError, TypeError, UnicodeError):
+        abort(400)
+
+
+def _items_page(query, cursor=None, limit=ITEMS_PAGE_SIZE):
+    """
+    Returns one page of items ordered by (item_number_sort_key, id) plus the cursor
+    of the next page. Seeks past the cursor instead of using OFFSET, so every page is
+    an index range scan on idx_item_project_sort_key.
+    """
+    if cursor:
+        last_key, last_id = _decode_items_cursor(cursor)
+        query = query.filter(or_(
+            Item.item_number_sort_key > last_key,
+            and_(Item.item_number_sort_key == last_key, Item.id > last_id)
+        ))
 
-    # Use substring to extract leading numbers for a safe numerical sort
-    numeric_part = func.substring(Item.item_number, '^[0-9]+')
-    
     # <<< New performance optimization line: explicitly load paid_amount and actual_details_cost
-    items = query.options(
-        undefer(Item.paid_amount), 
-        undefer(Item.actual_details_cost)
-    ).order_by(cast(numeric_part, Integer), Item.item_number).all()
-    
+    rows = query.options(
+        undefer(Item.paid_amount),
+        undefer(Item.actual_details_cost),
+        selectinload(Item.invoice_items)  # used by the payments modal of each row
+    ).order_by(Item.item_number_sort_key, Item.id).limit(limit + 1).all()
+
+    items = rows[:limit]
+    next_cursor = _encode_items_cursor(items[-1]) if len(rows) > limit else None
+    return items, next_cursor
+
+
+@item_bp.route("/projects/<int:project_id>/items")
+@login_required
+def get_items_by_project(project_id):
+    project = Project.query.get_or_404(project_id)
+    check_project_permission(project)
+
+    filters = _items_filters_from_request()
+    query = _filtered_items_query(project_id, filters)
+
+    total_count = query.order_by(None).count()
+    items, next_cursor = _items_page(query)
+
     # إرسال قاموس "filters" بدلاً من "search_query"
-    return render_template("items/index.html", items=items, project=project, filters=filters)
+    return render_template("items/index.html", items=items, project=project, filters=filters,
+                           total_count=total_count, next_cursor=next_cursor)
+
+
+@item_bp.route("/projects/<int:project_id>/items.json")
+@login_required
+def get_items_by_project_json(project_id):
+    """JSON page of the items table, used by the infinite scroll on items/index.html."""
+    project = Project.query.get_or_404(project_id)
+    check_project_permission(project)
+
+    filters = _items_filters_from_request()
+    limit = min(max(request.args.get('limit', ITEMS_PAGE_SIZE, type=int), 1), ITEMS_MAX_PAGE_SIZE)
+    items, next_cursor = _items_page(
+        _filtered_items_query(project_id, filters),
+        cursor=request.args.get('cursor'),
+        limit=limit
+    )
+
+    data = {
+        'items': [{
+            'id': item.id,
+            'item_number': item.item_number,
+            'description': item.description,
+            'unit': item.unit,
+            'status': item.status,
+            'contract_total_cost': item.contract_total_cost,
+            'actual_total_cost': item.actual_total_cost,
+            'paid_amount': item.paid_amount,
+            'remaining_amount': item.remaining_amount,
+        } for item in items],
+        'next_cursor': next_cursor,
+    }
+    # The project dashboard only needs the data; skip rendering the table fragments
+    if request.args.get('html', '1') != '0':
+        data['rows_html'] = render_template("items/_item_rows.html", items=items)
+        data['modals_html'] = render_template("items/_item_modals.html", items=items)
+    return jsonify(data)
+# --- END: Keyset pagination for the items table ---
 
 @item_bp.route("/projects/<int:project_id>/items/bulk_add", methods=['GET', 'POST'])
 @login_required
@@ -134,47 +213,84 @@ def bulk_update_items(project_id):
             flash('لا توجد بيانات لتحديثها. يرجى لصق البيانات في الحقل المخصص.', 'warning')
             return redirect(url_for('item.bulk_update_items', project_id=project_id))
 
-        lines = items_data.strip().split('\n')
-        updated_count = 0
-        for line in lines:
+        # --- START: Bulk update (one keyed fetch, diffs in memory, batched writes) ---
+        fields_to_update = [
+            ('actual_quantity', 'الكمية المتاحة للفوترة'),
+            ('actual_unit_cost', 'تكلفة الوحدة للمستخلص'),
+        ]
+
+        parsed_lines = []
+        invalid_numbers = []
+        for line in items_data.strip().split('\n'):
             parts = line.strip().split('\t')
             # Check for at least item_number, actual_quantity, and actual_unit_cost (3 parts)
-            if len(parts) >= 3:
-                item_number = sanitize_input(parts[0])
-                item = Item.query.filter_by(project_id=project_id, item_number=item_number).first()
-                if item:
-                    try:
-                        changes = []
-                        
-                        # --- START: Streamlined Update Logic ---
-                        fields_to_update = [
-                            ('actual_quantity', parts[1].strip(), 'الكمية المتاحة للفوترة'),
-                            ('actual_unit_cost', parts[2].strip(), 'تكلفة الوحدة للمستخلص'),
-                        ]
-
-                        for field_name, new_value_str, display_name in fields_to_update:
-                            if new_value_str:
-                                # Get the original value and safely parse the new value
-                                original_value = getattr(item, field_name)
-                                new_value = float(new_value_str)
-
-                                # Compare (using tolerance for floats and checking for None)
-                                if (original_value is None or abs(new_value - original_value) > 0.001):
-                                    setattr(item, field_name, new_value)
-                                    original_display = f"'{original_value}'" if original_value is not None else "'لا شيء'"
-                                    changes.append(f"{display_name}: من {original_display} إلى '{new_value}'")
-
-                        # --- END: Streamlined Update Logic ---
-                        
-                        if changes:
-                            log_item_change(item, 'update', "\n".join(changes))
-                            updated_count += 1
-
-                    except (ValueError, IndexError):
-                        # UX IMPROVEMENT: Clearer error message
-                        flash(f'بيانات غير صالحة للكمية الفعلية أو تكلفة الوحدة الفعلية للبند {item_number}. يجب أن تكون أرقامًا.', 'danger')
-                        continue
-        
+            if len(parts) < 3:
+                continue
+            item_number = sanitize_input(parts[0])
+            try:
+                new_values = {
+                    field_name: float(value_str.strip())
+                    for (field_name, _), value_str in zip(fields_to_update, parts[1:3])
+                    if value_str.strip()
+                }
+            except ValueError:
+                invalid_numbers.append(item_number)
+                continue
+            parsed_lines.append((item_number, new_values))
+
+        # Current values of every referenced item in one query (the first item wins on duplicate numbers)
+        current_values = {}
+        referenced_numbers = {item_number for item_number, _ in parsed_lines}
+        if referenced_numbers:
+            rows = db.session.query(
+                Item.id, Item.item_number, Item.actual_quantity, Item.actual_unit_cost
+            ).filter(
+                Item.project_id == project_id,
+                Item.item_number.in_(referenced_numbers)
+            ).order_by(Item.id.desc()).all()
+            current_values = {
+                row.item_number: {'id': row.id, 'actual_quantity': row.actual_quantity, 'actual_unit_cost': row.actual_unit_cost}
+                for row in rows
+            }
+
+        updates = {}
+        audit_logs = []
+        for item_number, new_values in parsed_lines:
+            current = current_values.get(item_number)
+            if current is None:
+                continue
+            changes = []
+            for field_name, display_name in fields_to_update:
+                if field_name not in new_values:
+                    continue
+                original_value = current[field_name]
+                new_value = new_values[field_name]
+                # Compare (using tolerance for floats and checking for None)
+                if original_value is None or abs(new_value - original_value) > 0.001:
+                    current[field_name] = new_value
+                    updates.setdefault(current['id'], {'id': current['id']})[field_name] = new_value
+                    original_display = f"'{original_value}'" if original_value is not None else "'لا شيء'"
+                    changes.append(f"{display_name}: من {original_display} إلى '{new_value}'")
+            if changes:
+                audit_logs.append({
+                    'item_id': current['id'],
+                    'user_id': current_user.id,
+                    'action': 'update',
+                    'details': f"تم تحديث البند '{item_number}':\n" + "\n".join(changes),
+                })
+
+        if invalid_numbers:
+            # UX IMPROVEMENT: Clearer error message
+            flash(f"بيانات غير صالحة للكمية الفعلية أو تكلفة الوحدة الفعلية للبنود: {', '.join(invalid_numbers[:20])}. يجب أن تكون أرقامًا.", 'danger')
+
+        # actual_quantity / actual_unit_cost do not feed the project rollup, so the
+        # bulk writes (which skip flush hooks) need no rollup refresh here.
+        if updates:
+            db.session.bulk_update_mappings(Item, list(updates.values()))
+            db.session.bulk_insert_mappings(AuditLog, audit_logs)
+        updated_count = len(updates)
+        # --- END: Bulk update ---
+
         if updated_count > 0:
             db.session.commit()
             # UX Improvement: Confirm that changes were logged
@@ -345,6 +461,100 @@ def delete_item(item_id):
     flash("تم حذف البند وكل ما يتعلق به بنجاح.", "success")
     return redirect(url_for("item.get_items_by_project", project_id=project_id))
     
+# --- START: Set-based duplication ---
+DUPLICATE_SUFFIX = '-نسخة'
+DUPLICATE_COUNT_CHUNK = 400
+
+
+def _prefix_upper_bound(prefix):
+    """Smallest string above every string starting with prefix (under C collation)."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _existing_copy_counts(project_id, base_numbers):
+    """
+    Counts the existing copies of each base number ('<item_number>-نسخة...') in one
+    query. Each base number becomes its own branch with the prefix as a literal
+    range (key >= prefix AND key < next prefix) on item_number_sort_key, which the
+    C-collated (project_id, item_number_sort_key) index serves as a range scan.
+    """
+    base_numbers = sorted(base_numbers)
+    counts = {}
+    # Chunked only to stay under SQLite's compound SELECT limit
+    for start in range(0, len(base_numbers), DUPLICATE_COUNT_CHUNK):
+        branches = []
+        for base in base_numbers[start:start + DUPLICATE_COUNT_CHUNK]:
+            prefix = natural_sort_key(base)
+            branches.append(
+                select(literal(base).label('base_number'), func.count(Item.id).label('copies'))
+                .where(
+                    Item.project_id == project_id,
+                    Item.item_number_sort_key >= prefix,
+                    Item.item_number_sort_key < _prefix_upper_bound(prefix)
+                )
+            )
+        counts.update((base, copies) for base, copies in db.session.execute(union_all(*branches)) if copies)
+    return counts
+
+
+def _duplicate_items(project_id, item_ids, include_cost_details=False):
+    """
+    Clones the given items of a project (and optionally their cost details) with one
+    IN query for the originals, one grouped count for the copy suffixes and one bulk
+    INSERT per table. Returns the number of clones created.
+    """
+    originals = Item.query.filter(
+        Item.id.in_(item_ids),
+        Item.project_id == project_id
+    ).order_by(Item.id).all()
+    if not originals:
+        return 0
+
+    base_numbers = {f"{item.item_number}{DUPLICATE_SUFFIX}" for item in originals}
+    copy_counts = _existing_copy_counts(project_id, base_numbers)
+
+    copied_columns = [
+        'description', 'unit', 'contract_quantity', 'contract_unit_cost', 'actual_quantity',
+        'actual_unit_cost', 'status', 'notes', 'purchase_order_number',
+        'disbursement_order_number', 'contractor_id'
+    ]
+    clone_rows = []
+    for original in originals:
+        base_number = f"{original.item_number}{DUPLICATE_SUFFIX}"
+        copy_counts[base_number] = copy_counts.get(base_number, 0) + 1
+        new_item_number = f"{base_number}-{copy_counts[base_number]}"
+        row = {column: getattr(original, column) for column in copied_columns}
+        # Bulk INSERT skips the validators, so the sort key is set here
+        row.update(
+            project_id=project_id,
+            item_number=new_item_number,
+            item_number_sort_key=natural_sort_key(new_item_number)
+        )
+        clone_rows.append(row)
+
+    new_ids = db.session.scalars(
+        insert(Item).returning(Item.id, sort_by_parameter_order=True), clone_rows
+    ).all()
+
+    if include_cost_details:
+        clone_of = {original.id: new_id for original, new_id in zip(originals, new_ids)}
+        details = CostDetail.query.filter(CostDetail.item_id.in_(clone_of)).order_by(CostDetail.id).all()
+        detail_columns = [
+            'description', 'unit', 'quantity', 'unit_cost', 'vat_percent',
+            'purchase_order_number', 'disbursement_order_number', 'contractor_id'
+        ]
+        detail_rows = [
+            dict({column: getattr(detail, column) for column in detail_columns}, item_id=clone_of[detail.item_id])
+            for detail in details
+        ]
+        if detail_rows:
+            db.session.execute(insert(CostDetail), detail_rows)
+
+    # Bulk statements bypass the flush hook that maintains the project rollup
+    ProjectFinancials.refresh(db.session.connection(), [project_id])
+    return len(new_ids)
+# --- END: Set-based duplication ---
+
 @item_bp.route("/projects/<int:project_id>/items/bulk_duplicate", methods=['POST'])
 @login_required
 def bulk_duplicate_items(project_id):
@@ -356,38 +566,14 @@ def bulk_duplicate_items(project_id):
         flash('الرجاء تحديد بند واحد على الأقل لتكراره.', 'warning')
         return redirect(url_for('item.get_items_by_project', project_id=project_id))
 
-    duplicated_count = 0
-    for item_id in item_ids:
-        original_item = Item.query.get(item_id)
-        if original_item:
-            
-            # Step 1: Prepare the new item number BEFORE creating the object
-            base_number = f"{original_item.item_number}-نسخة"
-            existing_copies_count = Item.query.filter(
-                Item.project_id == int(project_id), 
-                Item.item_number.like(f"{base_number}%")
-            ).count()
-            new_item_number = f"{base_number}-{existing_copies_count + 1}"
-
-            # Step 2: Create the new item object with the prepared number
-            new_item = Item(
-                project_id=original_item.project_id,
-                item_number=new_item_number,
-                description=original_item.description,
-                unit=original_item.unit,
-                contract_quantity=original_item.contract_quantity,
-                contract_unit_cost=original_item.contract_unit_cost,
-                actual_quantity=original_item.actual_quantity,
-                actual_unit_cost=original_item.actual_unit_cost,
-                status=original_item.status,
-                notes=original_item.notes,
-                purchase_order_number=original_item.purchase_order_number,
-                disbursement_order_number=original_item.disbursement_order_number,
-                contractor_id=original_item.contractor_id
-            )
-            db.session.add(new_item)
-            duplicated_count += 1
-    
+    try:
+        item_ids = sorted({int(item_id) for item_id in item_ids})
+    except ValueError:
+        abort(400)
+    include_cost_details = request.form.get('include_cost_details') == '1'
+
+    duplicated_count = _duplicate_items(int(project_id), item_ids, include_cost_details)
+
     if duplicated_count > 0:
         db.session.commit()
         # UX IMPROVEMENT: Clearer success message
@@ -0,0 +1,74 @@
+import os
+from flask import Blueprint, render_template, send_file, jsonify, abort, flash, redirect, url_for
+from flask_login import login_required, current_user
+from sqlalchemy.orm import joinedload
+from app.models.background_job import BackgroundJob
+from app.services import job_queue
+
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/jobs')
+
+JOBS_PER_PAGE = 50
+# Same roles as the BOQ import jobs (boq_routes._get_import_job_or_404)
+JOB_ADMIN_ROLES = ['admin', 'sub-admin']
+
+
+def _get_job_or_404(job_id):
+    job = BackgroundJob.query.get_or_404(job_id)
+    if job.user_id != current_user.id and current_user.role not in JOB_ADMIN_ROLES:
+        abort(403)
+    return job
+
+
+@jobs_bp.route('/')
+@login_required
+def index():
+    """Latest background jobs of the current user (all users for admins and sub-admins)"""
+    query = BackgroundJob.query
+    if current_user.role in JOB_ADMIN_ROLES:
+        query = query.options(joinedload(BackgroundJob.user))
+    else:
+        query = query.filter_by(user_id=current_user.id)
+    jobs = query.order_by(BackgroundJob.id.desc()).limit(JOBS_PER_PAGE).all()
+    return render_template('jobs/index.html', jobs=jobs, show_users=current_user.role in JOB_ADMIN_ROLES)
+
+
+@jobs_bp.route('/<int:job_id>')
+@login_required
+def show(job_id):
+    """Job page: polls the status until the job is finished, then offers the result"""
+    job = _get_job_or_404(job_id)
+    return render_template('jobs/show.html', job=job)
+
+
+@jobs_bp.route('/<int:job_id>/status')
+@login_required
+def status(job_id):
+    """Current status of a job"""
+    job = _get_job_or_404(job_id)
+    data = job.to_dict()
+    if job.has_file:
+        data['download_url'] = url_for('jobs.download', job_id=job.id)
+    return jsonify(data)
+
+
+@jobs_bp.route('/<int:job_id>/download')
+@login_required
+def download(job_id):
+    """Download the file produced by a finished job"""
+    job = _get_job_or_404(job_id)
+    if not job.has_file:
+        flash('الملف غير جاهز بعد', 'warning')
+        return redirect(url_for('jobs.show', job_id=job.id))
+
+    path = job_queue.result_file_path(job)
+    if not os.path.exists(path):
+        flash('لم يعد الملف متاحاً. يرجى تشغيل المهمة من جديد.', 'warning')
+        return redirect(url_for('jobs.show', job_id=job.id))
+
+    # Streamed from disk in chunks
+    return send_file(
+        path,
+        mimetype=job.result_mimetype or 'application/octet-stream',
+        as_attachment=True,
+        download_name=job.result_filename
+    )
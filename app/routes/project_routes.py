@@ -1,14 +1,12 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, abort
 from sqlalchemy.orm import joinedload
-from sqlalchemy import func
 from app.models.project import Project
-from app.models.item import Item
 from app.models.user import User
+from app.services.project_dashboard_service import get_project_dashboard, portfolio_summary
 from app.extensions import db
 from flask_login import login_required, current_user
-#from app.utils import check_project_permission
+from app.utils import check_project_permission
 from app.forms import ProjectForm
-from sqlalchemy.orm import selectinload, undefer
 
 
 project_bp = Blueprint("project", __name__)
@@ -29,39 +27,24 @@ def get_projects():
     else:
         query = query.filter(Project.is_archived == False)
     
-    # <<< التعديل الأول: تحميل total_actual_cost و total_paid_amount مسبقًا لتحسين أداء قائمة المشاريع
-    projects = query.options(
-        selectinload(Project.items), 
-        undefer(Project.total_actual_cost),
-        undefer(Project.total_paid_amount)
-    ).all()    
+    # Financial columns come from the project_financials rollup (one joined row per project)
+    projects = query.options(joinedload(Project.financials)).all()
+
     return render_template("projects/index.html", projects=projects, show_archived=show_archived)
 
 
 @project_bp.route("/projects/<int:project_id>")
 @login_required
 def get_project(project_id):
-    # Eagerly load items and their cost details to optimize performance
-    project = Project.query.options(
-        joinedload(Project.items).joinedload(Item.cost_details)
-    ).get_or_404(project_id)
-    
+    project = Project.query.get_or_404(project_id)
+
     check_project_permission(project)
-    
-    # The cost properties are now accessed directly from the project object
-    # These calculations are specific to the view and can remain here
-    if not project.items:
-        project.completion_percentage = 0.0
-    else:
-        completed_items = sum(1 for item in project.items if item.status == 'مكتمل')
-        project.completion_percentage = (completed_items / len(project.items)) * 100 if project.items else 0.0
 
-    if project.total_actual_cost == 0:
-        project.financial_completion_percentage = 0.0
-    else:
-        project.financial_completion_percentage = (project.total_paid_amount / project.total_actual_cost) * 100
+    # Counts and totals are aggregated in the database; the page fetches item rows
+    # on demand from the paginated items.json endpoint
+    dashboard = get_project_dashboard(project.id)
 
-    return render_template("projects/show.html", project=project)
+    return render_template("projects/show.html", project=project, dashboard=dashboard)
 
 
 @project_bp.route("/projects/new", methods=["GET", "POST"])
@@ -186,18 +169,7 @@ def projects_summary():
     if current_user.role not in ['admin', 'sub-admin']:
         abort(403)
 
-    # Eagerly load the calculated column for better performance on summary page
-    projects = Project.query.filter_by(is_archived=False).options(
-        # <<< التعديل الثاني: إضافة total_actual_cost لضمان تحميل جميع الحقول المحسوبة
-        undefer(Project.total_paid_amount),
-        undefer(Project.total_actual_cost) 
-    ).all()
-    
-    grand_totals = {
-        'contract_cost': sum(p.total_contract_cost for p in projects),
-        'actual_cost': sum(p.total_actual_cost for p in projects),
-        'paid_amount': sum(p.total_paid_amount for p in projects),
-        'remaining_amount': sum(p.total_remaining_amount for p in projects),
-    }
+    # Per-project rows and grand totals come from one query over the project_financials rollup
+    projects, grand_totals = portfolio_summary()
 
     return render_template("projects/summary.html", projects=projects, totals=grand_totals)
\ No newline at end of file
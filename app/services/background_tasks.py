@@ -0,0 +1,157 @@
+"""
+Handlers of the background jobs enqueued by the routes (see job_queue).
+
+Each handler re-loads what it needs from the database, because it runs in a
+worker after the request that enqueued it has finished. Expected failures are
+raised as JobError with the message the user should see.
+"""
+from app.extensions import db
+from app.models.boq_item import BOQItem
+from app.models.boq_import_job import BOQImportJob
+from app.models.material_request import MaterialRequest
+from app.models.material_return import MaterialReturn
+from app.models.project import Project
+from app.services import boq_import_service, item_import_service, project_dashboard_service, sheet_sync_service
+from app.services.google_sheets_service import GoogleSheetsService
+from app.services.job_queue import JobError, TaskResult, task
+from app.utils.excel_utils import export_boq_to_excel, format_import_report
+from app.utils.pdf_utils import generate_material_request_pdf, generate_material_return_pdf
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+PDF_MIMETYPE = 'application/pdf'
+
+BOQ_EXPORT_BATCH_SIZE = 1000
+
+
+def _get_or_fail(model, object_id, message):
+    obj = db.session.get(model, object_id)
+    if obj is None:
+        raise JobError(message)
+    return obj
+
+
+def _sheets_service(project):
+    if not project.spreadsheet_id:
+        raise JobError("لا يوجد معرّف Google Sheets مرتبط بهذا المشروع. يرجى تعديل المشروع وربطه بالملف.")
+    return GoogleSheetsService(project.spreadsheet_id)
+
+
+def _write_sheet(service, sheet_name, data):
+    success, error_message = service.write_data(sheet_name, data)
+    if not success:
+        raise JobError(f"حدث خطأ أثناء التصدير إلى Google Sheets: {error_message}. يرجى مراجعة إعدادات الصلاحية.")
+
+
+# --- START: Google Sheets ---
+@task('sheets.export_items')
+def export_items_to_sheets(job, project_id):
+    project = _get_or_fail(Project, project_id, "المشروع غير موجود.")
+    service = _sheets_service(project)
+    data = [sheet_sync_service.ITEM_EXPORT_HEADERS]
+    data.extend(values for _, values in sheet_sync_service.project_item_rows(project.id))
+
+    _write_sheet(service, "تفاصيل بنود المشروع", data)
+    return TaskResult(message="تم تصدير جميع بنود المشروع إلى ورقة عمل جديدة في Google Sheets بنجاح!")
+
+
+@task('sheets.sync_items')
+def sync_items_to_sheets(job, project_id, full=False):
+    project = _get_or_fail(Project, project_id, "المشروع غير موجود.")
+    result = sheet_sync_service.sync_project_items(project, service=_sheets_service(project), full=full)
+    return TaskResult(message=result.message)
+
+
+@task('sheets.export_summary')
+def export_summary_to_sheets(job, project_id):
+    project = _get_or_fail(Project, project_id, "المشروع غير موجود.")
+    service = _sheets_service(project)
+
+    # Same aggregates as the project page
+    dashboard = project_dashboard_service.get_project_dashboard(project.id)
+
+    summary_data = [
+        ["ملخص المشروع: " + project.name, ""],
+        ["الحقل", "القيمة"],
+        ["إجمالي التكلفة التعاقدية", dashboard.total_contract_cost],
+        ["إجمالي الوفر / الزيادة", dashboard.total_savings],
+        ["إجمالي التكلفة الفعلية", dashboard.total_actual_cost],
+        ["إجمالي المبلغ المدفوع", dashboard.total_paid_amount],
+        ["إجمالي المبلغ المتبقي", dashboard.total_remaining_amount],
+        [f"نسبة إنجاز البنود (كمي)", f"{dashboard.completion_percentage:.2f}%"],
+        [f"نسبة الإنجاز المالي", f"{dashboard.financial_completion_percentage:.2f}%"]
+    ]
+
+    _write_sheet(service, "ملخص المشروع", summary_data)
+    return TaskResult(message="تم تصدير الملخص المالي للمشروع إلى ورقة عمل جديدة بنجاح!")
+
+
+@task('sheets.import_items')
+def import_items_from_sheets(job, project_id, sheet_name):
+    project = _get_or_fail(Project, project_id, "المشروع غير موجود.")
+    service = _sheets_service(project)
+    data = service.read_data(sheet_name)
+    if not data or len(data) < 2:
+        raise JobError(f"لا توجد بيانات كافية في ورقة العمل '{sheet_name}'. تأكد من وجود صفوف بيانات بعد العناوين.")
+
+    try:
+        result = item_import_service.import_sheet_data(project.id, data)
+    except ValueError as e:
+        raise JobError(f"لم يتم العثور على الأعمدة الإلزامية المطلوبة. يرجى التأكد من وجود أعمدة تعبر عن: {e}.")
+    db.session.commit()
+
+    return TaskResult(
+        message=f"تمت عملية الاستيراد بنجاح! ({result.created} بنود جديدة مضافة و {result.updated} بند محدث و {result.skipped} صف متخطى).",
+        # Row-level notes are listed in one table on the job page
+        details=result.to_dict() if result.diagnostics else None
+    )
+# --- END: Google Sheets ---
+
+
+# --- START: BOQ ---
+@task('boq.export_excel')
+def export_boq_excel(job, project_id=None):
+    query = BOQItem.query
+    if project_id:
+        project = _get_or_fail(Project, project_id, "المشروع غير موجود.")
+        query = query.filter_by(project_id=project_id)
+        filename = f'boq_{project.name}.xlsx'
+    else:
+        filename = 'boq_all.xlsx'
+
+    items = query.order_by(BOQItem.project_id, BOQItem.id).yield_per(BOQ_EXPORT_BATCH_SIZE)
+    # The temporary workbook is copied to the results directory in chunks (and closed) by run_job
+    output = export_boq_to_excel(items)
+    return TaskResult(message=f"تم تجهيز ملف {filename}.", file=output, filename=filename, mimetype=XLSX_MIMETYPE)
+
+
+@task('boq.import')
+def import_boq_excel(job, import_job_id):
+    import_job = _get_or_fail(BOQImportJob, import_job_id, "مهمة الاستيراد غير موجودة.")
+    # A worker has no request timeout to respect: import every remaining chunk in one go
+    import_job = boq_import_service.run_job(import_job, time_budget=float('inf'))
+    if import_job.status == BOQImportJob.STATUS_FAILED:
+        raise JobError(import_job.error_message)
+
+    message = f"تم استيراد {import_job.processed_rows} بند من الملف {import_job.filename}."
+    if import_job.invalid_cells:
+        message += " " + format_import_report(import_job.invalid_cells)
+    return TaskResult(message=message)
+# --- END: BOQ ---
+
+
+# --- START: Forms (PDF) ---
+@task('forms.material_request_pdf')
+def material_request_pdf(job, material_request_id):
+    material_request = _get_or_fail(MaterialRequest, material_request_id, "طلب المواد غير موجود.")
+    output = generate_material_request_pdf(material_request)
+    filename = f'material_request_{material_request.request_number}.pdf'
+    return TaskResult(message=f"تم تجهيز ملف {filename}.", data=output.getvalue(), filename=filename, mimetype=PDF_MIMETYPE)
+
+
+@task('forms.material_return_pdf')
+def material_return_pdf(job, material_return_id):
+    material_return = _get_or_fail(MaterialReturn, material_return_id, "مرتجع المواد غير موجود.")
+    output = generate_material_return_pdf(material_return)
+    filename = f'material_return_{material_return.return_number}.pdf'
+    return TaskResult(message=f"تم تجهيز ملف {filename}.", data=output.getvalue(), filename=filename, mimetype=PDF_MIMETYPE)
+# --- END: Forms (PDF) ---
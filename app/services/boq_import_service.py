@@ -0,0 +1,181 @@
+"""
+Chunked, resumable BOQ imports.
+
+An upload becomes a BOQImportJob holding the file and its SHA-256. Uploading
+the same file again for the same project resumes the unfinished job instead
+of starting over. run_job() inserts the rows in chunks of
+BOQ_IMPORT_CHUNK_SIZE. Each chunk is committed with the checkpoint
+(job.processed_rows). The call stops when the time budget runs out, so a
+request never comes close to the gunicorn timeout. The import page calls it
+repeatedly until the job is completed.
+
+The parsed rows of the running imports are cached in the process, so those
+repeated calls do not re-read the file. The file itself is dropped from the job
+once the import is completed; purge_stale_files() (flask purge-jobs) drops it
+from jobs left unfinished, and uploading the same file again re-attaches it.
+"""
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import or_, select, update
+
+from app.extensions import db
+from app.models.boq_item import BOQItem
+from app.models.boq_import_job import BOQImportJob
+from app.utils.excel_utils import import_boq_from_excel
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_TIME_BUDGET = 20  # seconds of work per run_job() call
+PARSED_ROWS_CACHE_SIZE = 4  # imports whose parsed rows are kept in memory per process
+
+_parsed_rows = OrderedDict()  # (job id, file hash) -> (rows, invalid cells report)
+_parsed_rows_lock = threading.Lock()
+
+
+def create_or_resume_job(project_id, user_id, filename, file_data, engine=None):
+    """
+    Returns the unfinished job of this project for the same file (by SHA-256),
+    or a new pending job. Does not commit.
+    """
+    file_hash = hashlib.sha256(file_data).hexdigest()
+    job = BOQImportJob.query.filter(
+        BOQImportJob.project_id == project_id,
+        BOQImportJob.file_hash == file_hash,
+        BOQImportJob.status != BOQImportJob.STATUS_COMPLETED
+    ).order_by(BOQImportJob.id.desc()).first()
+    if job:
+        # Its file was dropped by purge_stale_files(): the upload has the same content
+        if db.session.scalar(select(BOQImportJob.file_data.is_(None)).where(BOQImportJob.id == job.id)):
+            job.file_data = file_data
+        return job, True
+
+    job = BOQImportJob(
+        project_id=project_id,
+        user_id=user_id,
+        filename=filename,
+        file_hash=file_hash,
+        file_data=file_data,
+        engine=engine,
+        status=BOQImportJob.STATUS_PENDING,
+        processed_rows=0
+    )
+    db.session.add(job)
+    return job, False
+
+
+def _row_mappings(project_id, items_data):
+    rows = []
+    for item_data in items_data:
+        # حساب القيمة الإجمالية أثناء الاستيراد (مُضافة للإصلاح)
+        total_price = item_data.get('quantity', 0) * item_data.get('unit_price', 0)
+        rows.append(dict(item_data, project_id=project_id, total_price=total_price))
+    return rows
+
+
+def _parsed_job_rows(job):
+    """(rows, report) of the job's file, parsed once and then served from the cache."""
+    key = (job.id, job.file_hash)
+    with _parsed_rows_lock:
+        if key in _parsed_rows:
+            _parsed_rows.move_to_end(key)
+            return _parsed_rows[key]
+
+    if job.file_data is None:
+        raise ValueError("لم يعد ملف الاستيراد محفوظاً. الرجاء رفع الملف مرة أخرى لاستكمال الاستيراد.")
+    report = {}
+    # The same file and engine always give the same rows, so processed_rows is a stable checkpoint
+    items_data = import_boq_from_excel(io.BytesIO(job.file_data), report=report, engine=job.engine)
+    parsed = (_row_mappings(job.project_id, items_data), report)
+    with _parsed_rows_lock:
+        _parsed_rows[key] = parsed
+        while len(_parsed_rows) > PARSED_ROWS_CACHE_SIZE:
+            _parsed_rows.popitem(last=False)
+    return parsed
+
+
+def _forget_parsed_rows(job_id):
+    with _parsed_rows_lock:
+        for key in [key for key in _parsed_rows if key[0] == job_id]:
+            del _parsed_rows[key]
+
+
+def run_job(job, chunk_size=None, time_budget=None):
+    """
+    Imports the next chunks of the job until it is completed or the time budget
+    is spent. Every chunk is committed together with the new checkpoint; on an
+    error the current chunk is rolled back and the job is marked failed, keeping
+    its checkpoint so it can be resumed.
+    """
+    if job.is_finished:
+        return job
+    chunk_size = chunk_size or current_app.config.get('BOQ_IMPORT_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+    time_budget = time_budget or current_app.config.get('BOQ_IMPORT_TIME_BUDGET', DEFAULT_TIME_BUDGET)
+    deadline = time.monotonic() + time_budget
+    job_id = job.id
+
+    try:
+        rows, report = _parsed_job_rows(job)
+        job.total_rows = len(rows)
+        job.invalid_cells = report or None
+        job.status = BOQImportJob.STATUS_RUNNING
+        job.error_message = None
+        db.session.commit()
+
+        while job.processed_rows < len(rows):
+            start = job.processed_rows
+            chunk = rows[start:start + chunk_size]
+            db.session.bulk_insert_mappings(BOQItem, chunk)
+            # Compare-and-set on the checkpoint: if another runner (second tab,
+            # worker) already committed this chunk, drop ours and stop
+            claimed = db.session.execute(
+                update(BOQImportJob)
+                .where(BOQImportJob.id == job_id, BOQImportJob.processed_rows == start)
+                .values(processed_rows=start + len(chunk), updated_at=datetime.utcnow())
+            ).rowcount
+            if claimed != 1:
+                db.session.rollback()
+                return db.session.get(BOQImportJob, job_id)
+            db.session.commit()
+            if time.monotonic() >= deadline:
+                return job
+
+        job.status = BOQImportJob.STATUS_COMPLETED
+        job.finished_at = datetime.utcnow()
+        # Nothing left to resume: the file is not needed anymore
+        job.file_data = None
+        db.session.commit()
+        _forget_parsed_rows(job_id)
+    except Exception as e:
+        db.session.rollback()
+        # The file is kept so the job can be resumed; only the cached rows go
+        _forget_parsed_rows(job_id)
+        job = db.session.get(BOQImportJob, job_id)
+        job.status = BOQImportJob.STATUS_FAILED
+        job.error_message = str(e)
+        db.session.commit()
+    return job
+
+
+def purge_stale_files(days):
+    """
+    Drops the stored file of import jobs not touched for `days` days (and of
+    completed jobs still holding one) and returns how many were cleared. Their
+    checkpoint is kept: uploading the same file again resumes where they stopped.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    cleared = db.session.execute(
+        update(BOQImportJob)
+        .where(
+            BOQImportJob.file_data.isnot(None),
+            or_(BOQImportJob.status == BOQImportJob.STATUS_COMPLETED, BOQImportJob.updated_at < cutoff)
+        )
+        .values(file_data=None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return cleared
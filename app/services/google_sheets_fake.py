@@ -0,0 +1,180 @@
+"""
+In-memory stand-in for the Google Sheets API, used to run the Sheets code offline.
+
+FakeSheetsHttp has the httplib2.Http request() interface, so it can be passed
+wherever GoogleSheetsService executes requests. It understands the calls the
+service makes: spreadsheet metadata, values().get and batchUpdate with
+addSheet / updateCells / repeatCell / autoResizeDimensions. Spreadsheets are
+created on first use. Every call is recorded in `calls`, and fail_next() makes
+the next calls answer with an error (e.g. 429 quota exceeded) to exercise the
+retry logic.
+
+Set GOOGLE_SHEETS_FAKE=true to route the whole app through one shared fake.
+"""
+import json
+import threading
+from urllib.parse import unquote, urlparse
+
+import httplib2
+
+_ERROR_STATUSES = {
+    400: 'INVALID_ARGUMENT',
+    403: 'PERMISSION_DENIED',
+    404: 'NOT_FOUND',
+    429: 'RESOURCE_EXHAUSTED',
+    500: 'INTERNAL',
+    503: 'UNAVAILABLE',
+}
+
+
+class FakeSheetsHttp:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spreadsheets = {}  # spreadsheet id -> list of sheets {'properties': {...}, 'rows': [[...]]}
+        self.calls = []  # (method, path, decoded body)
+        self._failures = []  # queued (status, message, applied) answers
+
+    def fail_next(self, status=429, message='Quota exceeded for quota metric', times=1, applied=False):
+        """
+        Answers the next `times` calls with an API error. With applied=True the
+        call is carried out first, like a request whose response was lost.
+        """
+        self._failures.extend([(status, message, applied)] * times)
+
+    # --- httplib2.Http interface ---
+    def request(self, uri, method='GET', body=None, headers=None, redirections=None, connection_type=None):
+        with self._lock:
+            parsed = urlparse(uri)
+            path = unquote(parsed.path)
+            payload = json.loads(body) if body else None
+            self.calls.append((method, path, payload))
+
+            if self._failures:
+                status, message, applied = self._failures.pop(0)
+                if applied:
+                    try:
+                        self._dispatch(method, path, payload)
+                    except (KeyError, ValueError):
+                        pass
+                return self._error(status, message)
+            try:
+                return self._response(200, self._dispatch(method, path, payload))
+            except KeyError as e:
+                return self._error(404, f'Not found: {e}')
+            except ValueError as e:
+                return self._error(400, str(e))
+
+    def close(self):
+        pass
+
+    # --- Responses ---
+    @staticmethod
+    def _response(status, data):
+        return httplib2.Response({'status': str(status), 'content-type': 'application/json'}), \
+            json.dumps(data).encode('utf-8')
+
+    def _error(self, status, message):
+        return self._response(status, {'error': {
+            'code': status,
+            'message': message,
+            'status': _ERROR_STATUSES.get(status, 'UNKNOWN'),
+        }})
+
+    # --- API emulation ---
+    def _dispatch(self, method, path, payload):
+        # Paths look like /v4/spreadsheets/<id>, /v4/spreadsheets/<id>:batchUpdate, /v4/spreadsheets/<id>/values/<range>
+        rest = path.split('/v4/spreadsheets/', 1)[1]
+        if method == 'POST' and rest.endswith(':batchUpdate'):
+            return self._batch_update(rest[:-len(':batchUpdate')], payload)
+        if method == 'GET' and '/values/' in rest:
+            spreadsheet_id, range_name = rest.split('/values/', 1)
+            return self._get_values(spreadsheet_id, range_name)
+        if method == 'GET':
+            return self._get_spreadsheet(rest)
+        raise ValueError(f'Unsupported call: {method} {path}')
+
+    def _sheets(self, spreadsheet_id):
+        return self.spreadsheets.setdefault(spreadsheet_id, [])
+
+    def _sheet(self, spreadsheet_id, sheet_id=None, title=None):
+        for sheet in self._sheets(spreadsheet_id):
+            properties = sheet['properties']
+            if properties['sheetId'] == sheet_id or properties['title'] == title:
+                return sheet
+        raise KeyError(sheet_id if title is None else title)
+
+    def _get_spreadsheet(self, spreadsheet_id):
+        return {
+            'spreadsheetId': spreadsheet_id,
+            'sheets': [{'properties': sheet['properties']} for sheet in self._sheets(spreadsheet_id)],
+        }
+
+    def _get_values(self, spreadsheet_id, range_name):
+        sheet = self._sheet(spreadsheet_id, title=range_name.split('!', 1)[0].strip("'"))
+        rows = [[_formatted(value) for value in row] for row in sheet['rows']]
+        # Like the API: trailing empty cells and rows are omitted
+        rows = [row[:max((i + 1 for i, v in enumerate(row) if v != ''), default=0)] for row in rows]
+        while rows and not rows[-1]:
+            rows.pop()
+        return {'range': range_name, 'majorDimension': 'ROWS', 'values': rows}
+
+    def _batch_update(self, spreadsheet_id, payload):
+        replies = []
+        sheets = self._sheets(spreadsheet_id)
+        for request in payload.get('requests', []):
+            if 'addSheet' in request:
+                properties = dict(request['addSheet'].get('properties', {}))
+                if any(sheet['properties']['title'] == properties.get('title') for sheet in sheets):
+                    raise ValueError(f"A sheet with the name \"{properties.get('title')}\" already exists.")
+                properties.setdefault('sheetId', len(sheets) + 1)
+                properties.setdefault('index', len(sheets))
+                sheets.append({'properties': properties, 'rows': []})
+                replies.append({'addSheet': {'properties': properties}})
+            elif 'updateCells' in request:
+                update = request['updateCells']
+                start = update['start']
+                sheet = self._sheet(spreadsheet_id, sheet_id=start['sheetId'])
+                for offset, row in enumerate(update.get('rows', [])):
+                    self._write_row(sheet, start.get('rowIndex', 0) + offset, start.get('columnIndex', 0), row)
+                replies.append({})
+            elif any(key in request for key in ('repeatCell', 'autoResizeDimensions', 'updateSheetProperties')):
+                replies.append({})
+            else:
+                raise ValueError(f'Unsupported request: {sorted(request)}')
+        return {'spreadsheetId': spreadsheet_id, 'replies': replies}
+
+    @staticmethod
+    def _write_row(sheet, row_index, column_index, row_data):
+        rows = sheet['rows']
+        while len(rows) <= row_index:
+            rows.append([])
+        row = rows[row_index]
+        for offset, cell in enumerate(row_data.get('values', [])):
+            while len(row) <= column_index + offset:
+                row.append(None)
+            entered = cell.get('userEnteredValue', {})
+            row[column_index + offset] = next(iter(entered.values()), None)
+
+
+def _formatted(value):
+    """Cell value as the API's FORMATTED_VALUE string."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+_shared_transport = None
+_shared_lock = threading.Lock()
+
+
+def shared_transport():
+    """The process-wide fake used when GOOGLE_SHEETS_FAKE is enabled."""
+    global _shared_transport
+    with _shared_lock:
+        if _shared_transport is None:
+            _shared_transport = FakeSheetsHttp()
+        return _shared_transport
@@ -1,34 +1,173 @@
 import os
 import json
+import math
+import time
+import random
+import numbers
+import hashlib
+import threading
+import httplib2
+import google_auth_httplib2
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from datetime import datetime
 
 # نطاق الصلاحيات المطلوبة للوصول إلى Google Sheets
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 
-class GoogleSheetsService:
-    def __init__(self, spreadsheet_id):
-        self.spreadsheet_id = spreadsheet_id
-        self.service = self._authenticate()
+HTTP_TIMEOUT = 60  # seconds per Sheets API call
 
-    def _authenticate(self):
-        """
-        يصادق على الخدمة باستخدام بيانات الاعتماد من متغيرات البيئة.
-        """
+# batchUpdate bodies are kept below this size; larger writes are split into several calls
+MAX_BATCH_BYTES = 2 * 1024 * 1024
+# Room kept in every batch for the sheet creation and formatting requests
+BATCH_OVERHEAD_BYTES = 64 * 1024
+
+# Retries with exponential backoff (and jitter) on quota and transient server errors
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0  # seconds
+BACKOFF_MAX = 32.0  # seconds
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded', 'quotaExceeded', 'RESOURCE_EXHAUSTED')
+
+HEADER_FORMAT = {
+    'textFormat': {'bold': True},
+    'backgroundColor': {'red': 0.9, 'green': 0.9, 'blue': 0.9},
+}
+
+
+class SheetsClientFactory:
+    """
+    Process-wide cache of the Sheets API client.
+
+    The service-account credentials and the discovery-built service are created
+    once per process (from the static discovery document bundled with
+    googleapiclient) and rebuilt only when GOOGLE_CREDENTIALS_JSON changes.
+    httplib2 connections are not thread-safe, so every thread gets its own
+    authorized transport, reused across calls to keep connections alive.
+    Access tokens are refreshed lazily by the transport when they expire.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None  # (credentials key, credentials, service)
+        self._local = threading.local()
+
+    def _current_state(self):
         creds_json_str = os.environ.get('GOOGLE_CREDENTIALS_JSON')
-        
+
         if not creds_json_str:
             raise Exception("متغير البيئة GOOGLE_CREDENTIALS_JSON غير موجود.")
 
-        creds_info = json.loads(creds_json_str)
-        
-        credentials = service_account.Credentials.from_service_account_info(
-            creds_info, scopes=SCOPES
-        )
-        
-        service = build("sheets", "v4", credentials=credentials)
-        return service
+        key = hashlib.sha256(creds_json_str.encode('utf-8')).hexdigest()
+        state = self._state
+        if state is not None and state[0] == key:
+            return state
+
+        with self._lock:
+            state = self._state
+            if state is None or state[0] != key:
+                creds_info = json.loads(creds_json_str)
+                credentials = service_account.Credentials.from_service_account_info(
+                    creds_info, scopes=SCOPES
+                )
+                service = build("sheets", "v4", credentials=credentials,
+                                static_discovery=True, cache_discovery=False)
+                state = self._state = (key, credentials, service)
+        return state
+
+    def service(self):
+        """The shared discovery-built Sheets service."""
+        return self._current_state()[2]
+
+    def http(self):
+        """The authorized HTTP transport of the calling thread."""
+        key, credentials, _ = self._current_state()
+        local = self._local
+        if getattr(local, 'key', None) != key:
+            local.http = google_auth_httplib2.AuthorizedHttp(
+                credentials, http=httplib2.Http(timeout=HTTP_TIMEOUT)
+            )
+            local.key = key
+        return local.http
+
+    def offline_service(self):
+        """A Sheets service without credentials, for requests executed on a fake transport."""
+        with self._lock:
+            if getattr(self, '_offline_service', None) is None:
+                self._offline_service = build("sheets", "v4", http=httplib2.Http(),
+                                              static_discovery=True, cache_discovery=False)
+            return self._offline_service
+
+    def reset(self):
+        """Drops the cached client (e.g. after rotating the service-account key)."""
+        with self._lock:
+            self._state = None
+
+
+client_factory = SheetsClientFactory()
+
+
+def _is_retryable(error):
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        if status in RETRYABLE_STATUSES:
+            return True
+        content = error.content.decode('utf-8', 'replace') if isinstance(error.content, bytes) else str(error.content)
+        return status == 403 and any(reason in content for reason in RATE_LIMIT_REASONS)
+    return isinstance(error, (TimeoutError, ConnectionError))
+
+
+def _cell_data(value):
+    """CellData for one value, written as entered (like valueInputOption=RAW)."""
+    if value is None or value == '':
+        return {}
+    if isinstance(value, bool):
+        return {'userEnteredValue': {'boolValue': value}}
+    if isinstance(value, numbers.Number) and math.isfinite(value):
+        return {'userEnteredValue': {'numberValue': float(value)}}
+    return {'userEnteredValue': {'stringValue': str(value)}}
+
+
+def _json_size(data):
+    return len(json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+
+class GoogleSheetsService:
+    def __init__(self, spreadsheet_id, http=None, sleep=time.sleep):
+        """
+        http: optional transport to execute the requests on (e.g. FakeSheetsHttp
+        for offline runs); GOOGLE_SHEETS_FAKE=true uses a shared fake.
+        """
+        self.spreadsheet_id = spreadsheet_id
+        self._sleep = sleep
+        if http is None and os.environ.get('GOOGLE_SHEETS_FAKE', 'false').lower() == 'true':
+            from app.services.google_sheets_fake import shared_transport
+            http = shared_transport()
+        if http is not None:
+            self.service = client_factory.offline_service()
+            self._http = http
+        else:
+            # Shared per process; requests are executed on this thread's own transport
+            self.service = client_factory.service()
+            self._http = client_factory.http()
+
+    def _execute(self, request, already_applied=None):
+        """
+        Executes an API request, retrying quota and transient errors with exponential backoff.
+        already_applied, when given, is checked before each retry: a failed attempt may
+        still have been applied (e.g. the response was lost), and a non-idempotent
+        request must not be sent twice.
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            if attempt and already_applied is not None and already_applied():
+                return None
+            try:
+                return request.execute(http=self._http)
+            except Exception as e:
+                if attempt == MAX_RETRIES or not _is_retryable(e):
+                    raise
+            self._sleep(min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0))
 
     # --- START: الدالة الجديدة لجلب أسماء الشيتات ---
     def get_sheet_names(self):
@@ -36,7 +175,7 @@ class GoogleSheetsService:
         يجلب قائمة بأسماء جميع الأوراق (الشيتات) في ملف Google Sheets المحدد.
         """
         try:
-            spreadsheet_metadata = self.service.spreadsheets().get(spreadsheetId=self.spreadsheet_id).execute()
+            spreadsheet_metadata = self._execute(self.service.spreadsheets().get(spreadsheetId=self.spreadsheet_id))
             sheets = spreadsheet_metadata.get('sheets', [])
             sheet_names = [sheet.get('properties', {}).get('title', '') for sheet in sheets]
             return sheet_names, None # Success
@@ -48,40 +187,161 @@ class GoogleSheetsService:
         """
         يقرأ البيانات من ورقة عمل محددة.
         """
-        result = self.service.spreadsheets().values().get(
-            spreadsheetId=self.spreadsheet_id, range=range_name).execute()
+        result = self._execute(self.service.spreadsheets().values().get(
+            spreadsheetId=self.spreadsheet_id, range=range_name))
         return result.get("values", [])
 
     def write_data(self, base_sheet_name, values):
         """
         ينشئ ورقة عمل جديدة بتاريخ اليوم ويكتب البيانات فيها.
         """
+        return self.write_sheets([(base_sheet_name, values)])
+
+    def write_sheets(self, sheets, header_rows=1):
+        """
+        ينشئ ورقة عمل جديدة بتاريخ اليوم لكل (اسم، بيانات) ويكتب البيانات فيها.
+
+        Sheet creation, values and header formatting of all sheets go in a
+        single batchUpdate; payloads above MAX_BATCH_BYTES are split into
+        several calls. Returns (success, error_message).
+        """
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M")
-        new_sheet_name = f"{base_sheet_name} - {timestamp}"
 
         try:
-            requests = {
-                'requests': [{
-                    'addSheet': {
-                        'properties': {
-                            'title': new_sheet_name,
-                            'rightToLeft': True
-                        }
-                    }
-                }]
-            }
-            self.service.spreadsheets().batchUpdate(
-                spreadsheetId=self.spreadsheet_id, body=requests).execute()
-
-            body = {"values": values}
-            self.service.spreadsheets().values().update(
-                spreadsheetId=self.spreadsheet_id, 
-                range=new_sheet_name,
-                valueInputOption="RAW", 
-                body=body
-            ).execute()
-            
+            requests = []
+            for base_sheet_name, values in sheets:
+                requests.extend(self._new_sheet_requests(f"{base_sheet_name} - {timestamp}", values, header_rows)[1])
+            self._run_batches(requests)
             return True, None
-        
+
         except Exception as e:
-            return False, str(e)
\ No newline at end of file
+            return False, str(e)
+
+    def create_sheet(self, base_sheet_name, values, header_rows=1):
+        """
+        Creates a dated sheet holding the values. Returns (sheet_id, title);
+        raises on API errors.
+        """
+        title = f"{base_sheet_name} - {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+        sheet_id, requests = self._new_sheet_requests(title, values, header_rows)
+        self._run_batches(requests)
+        return sheet_id, title
+
+    def update_rows(self, sheet_id, rows, row_count=None):
+        """
+        Overwrites the given rows of an existing sheet; rows is a list of
+        (row_index, values), an empty value clears its cell. row_count grows
+        the sheet grid first when rows are appended. Raises on API errors.
+        """
+        requests = []
+        if row_count is not None:
+            requests.append(({
+                'updateSheetProperties': {
+                    'properties': {'sheetId': sheet_id, 'gridProperties': {'rowCount': row_count}},
+                    'fields': 'gridProperties.rowCount'
+                }
+            }, None))
+        requests.extend(self._row_requests(sheet_id, rows))
+        self._run_batches(requests)
+
+    # --- START: batchUpdate building ---
+    def _new_sheet_requests(self, title, values, header_rows):
+        """Requests creating a sheet with its values and header format, as (sheet_id, [(request, size)])."""
+        # The sheet id is chosen here so values and formatting can target it in the same call
+        sheet_id = random.randint(1, 2 ** 31 - 1)
+        column_count = max((len(row) for row in values), default=1) or 1
+        requests = [({
+            'addSheet': {
+                'properties': {
+                    'sheetId': sheet_id,
+                    'title': title,
+                    'rightToLeft': True,
+                    'gridProperties': {
+                        'rowCount': max(len(values), 1),
+                        'columnCount': column_count,
+                        'frozenRowCount': min(header_rows, len(values)),
+                    }
+                }
+            }
+        }, None)]
+        if header_rows and values:
+            requests.append(({
+                'repeatCell': {
+                    'range': {'sheetId': sheet_id, 'startRowIndex': 0, 'endRowIndex': min(header_rows, len(values))},
+                    'cell': {'userEnteredFormat': HEADER_FORMAT},
+                    'fields': 'userEnteredFormat(textFormat,backgroundColor)'
+                }
+            }, None))
+        requests.extend(self._row_requests(sheet_id, enumerate(values)))
+        requests.append(({
+            'autoResizeDimensions': {
+                'dimensions': {'sheetId': sheet_id, 'dimension': 'COLUMNS', 'startIndex': 0, 'endIndex': column_count}
+            }
+        }, None))
+        return sheet_id, requests
+
+    def _row_requests(self, sheet_id, rows):
+        """
+        updateCells requests for (row_index, values) pairs: one request per run of
+        consecutive rows, split so no request exceeds the batch size budget.
+        """
+        max_rows_bytes = MAX_BATCH_BYTES - BATCH_OVERHEAD_BYTES
+        requests = []
+        chunk, chunk_size, chunk_start, next_index = [], 0, None, None
+        for row_index, row in sorted(rows, key=lambda pair: pair[0]):
+            row_data = {'values': [_cell_data(value) for value in row]}
+            row_size = _json_size(row_data)
+            if chunk and (row_index != next_index or chunk_size + row_size > max_rows_bytes):
+                requests.append((self._update_cells(sheet_id, chunk_start, chunk), chunk_size))
+                chunk, chunk_size = [], 0
+            if not chunk:
+                chunk_start = row_index
+            chunk.append(row_data)
+            chunk_size += row_size
+            next_index = row_index + 1
+        if chunk:
+            requests.append((self._update_cells(sheet_id, chunk_start, chunk), chunk_size))
+        return requests
+
+    def _run_batches(self, requests):
+        """Packs (request, size) pairs into size-bounded batchUpdate calls and executes them."""
+        batch, size = [], 0
+        for request, request_size in requests:
+            # Row chunks carry their (already measured) size
+            request_size = request_size if request_size is not None else _json_size(request)
+            if batch and size + request_size > MAX_BATCH_BYTES:
+                self._batch_update(batch)
+                batch, size = [], 0
+            batch.append(request)
+            size += request_size
+        if batch:
+            self._batch_update(batch)
+
+    def _batch_update(self, requests):
+        # A batchUpdate is applied atomically, so if a sheet it adds already exists the
+        # whole batch went through; retrying it would fail on the duplicate title.
+        added_sheet_ids = {request['addSheet']['properties']['sheetId'] for request in requests if 'addSheet' in request}
+        already_applied = (lambda: self._has_sheets(added_sheet_ids)) if added_sheet_ids else None
+        return self._execute(self.service.spreadsheets().batchUpdate(
+            spreadsheetId=self.spreadsheet_id, body={'requests': requests}), already_applied=already_applied)
+
+    def has_sheet(self, sheet_id):
+        """Whether the spreadsheet still has a sheet with this id. Raises on API errors."""
+        return self._has_sheets({sheet_id})
+
+    def _has_sheets(self, sheet_ids):
+        metadata = self._execute(self.service.spreadsheets().get(
+            spreadsheetId=self.spreadsheet_id, fields='sheets.properties.sheetId'))
+        existing = {sheet.get('properties', {}).get('sheetId') for sheet in metadata.get('sheets', [])}
+        return bool(existing & sheet_ids)
+
+    @staticmethod
+    def _update_cells(sheet_id, start_row, rows):
+        return {
+            'updateCells': {
+                'start': {'sheetId': sheet_id, 'rowIndex': start_row, 'columnIndex': 0},
+                'rows': rows,
+                'fields': 'userEnteredValue'
+            }
+        }
+    # --- END: batchUpdate building ---
@@ -0,0 +1,203 @@
+"""
+Bulk upsert pipeline for contractual item imports (Google Sheets BOQ tables).
+
+The import runs in three steps:
+  1. map_headers()      -> finds the required columns in the header row
+  2. parse_rows()       -> converts sheet rows to item mappings, recording a
+                           diagnostic for every skipped or invalid row
+  3. upsert_items()     -> loads every existing item_number of the project in
+                           one query, then writes all new rows with
+                           bulk_insert_mappings and all existing rows with
+                           bulk_update_mappings
+
+Bulk mappings bypass ORM validators and flush events, so the natural sort key
+and the project financial rollup are maintained explicitly here.
+"""
+from sqlalchemy import select
+
+from app import constants
+from app.extensions import db
+from app.models.item import Item
+from app.models.project_financials import ProjectFinancials
+from app.utils import natural_sort_key, sanitize_input
+
+# Accepted header names per field (normalized the same way as the sheet headers)
+COLUMN_MAP = {
+    'item_number': ['رقم البند', 'الرقم التسلسلي', 'الرقم', 'رقم', 'مسلسل'],
+    'item_name': ['اسم البند'],
+    'description': ['الوصف', 'وصف البند', 'البيان'],
+    'unit': ['الوحدة', 'وحدة القياس'],
+    'quantity': ['الكمية', 'الكمية التعاقدية'],
+    'unit_cost': ['السعر الافرادى التعاقدي', 'التكلفة الإفرادية التعاقدية', 'السعر', 'السعر التعاقدي', 'التكلفة', 'التكلفة التعاقدية', 'تكلفة', 'سعر', 'سعر افرادى']
+}
+
+REQUIRED_KEYS = ['item_number', 'description', 'unit', 'quantity', 'unit_cost']
+
+# Columns written by the import (everything else on an existing item is left untouched)
+IMPORTED_FIELDS = [
+    'description', 'unit', 'contract_quantity', 'contract_unit_cost',
+    'actual_quantity', 'actual_unit_cost'
+]
+
+
+class ImportResult:
+    """Counts and per-row diagnostics of one import run."""
+
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.diagnostics = []
+
+    def add(self, row_number, level, message):
+        self.diagnostics.append({'row': row_number, 'level': level, 'message': message})
+
+    @property
+    def skipped(self):
+        return sum(1 for d in self.diagnostics if d['level'] in ('warning', 'error'))
+
+    @property
+    def has_errors(self):
+        return any(d['level'] == 'error' for d in self.diagnostics)
+
+    def to_dict(self):
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'skipped': self.skipped,
+            'diagnostics': self.diagnostics,
+        }
+
+
+def _normalize_header(text):
+    return str(text).strip().replace('ى', 'ي').replace('ه', 'ة')
+
+
+def map_headers(header_row):
+    """
+    Returns (header_indices, missing_keys) for the given header row.
+    """
+    headers = [_normalize_header(h) for h in header_row]
+    header_indices = {}
+    for key, possible_names in COLUMN_MAP.items():
+        for name in possible_names:
+            name = _normalize_header(name)
+            if name in headers:
+                header_indices[key] = headers.index(name)
+                break
+    missing_keys = [key for key in REQUIRED_KEYS if key not in header_indices]
+    return header_indices, missing_keys
+
+
+def _cell(row, index):
+    return str(row[index]).strip() if index < len(row) and row[index] is not None else ''
+
+
+def _to_float(text):
+    text = text.replace(',', '')
+    return float(text) if text else 0.0
+
+
+def parse_rows(data_rows, header_indices, result, first_row_number=2):
+    """
+    Converts raw sheet rows into item mappings keyed by item_number.
+    A repeated item_number keeps the last row, as the row-by-row import did.
+    """
+    parsed = {}
+    for row_number, row in enumerate(data_rows, start=first_row_number):
+        if not any(row):
+            continue
+        try:
+            item_number = sanitize_input(_cell(row, header_indices['item_number']))
+            description = sanitize_input(_cell(row, header_indices['description']))
+            unit = sanitize_input(_cell(row, header_indices['unit']))
+            contract_quantity = _to_float(_cell(row, header_indices['quantity']))
+            contract_unit_cost = _to_float(_cell(row, header_indices['unit_cost']))
+
+            if 'item_name' in header_indices:
+                item_name = sanitize_input(_cell(row, header_indices['item_name']))
+                if item_name:
+                    description = f"{item_name} - {description}"
+        except (ValueError, IndexError) as e:
+            result.add(row_number, 'error', f"قيمة غير صالحة للكمية أو السعر: {e}")
+            continue
+
+        if not item_number:
+            result.add(row_number, 'warning', "رقم البند فارغ.")
+            continue
+        if contract_quantity <= 0 or contract_unit_cost <= 0:
+            result.add(row_number, 'warning', "الكمية أو السعر التعاقدي يساوي صفر.")
+            continue
+
+        if item_number in parsed:
+            result.add(parsed[item_number]['row'], 'info', f"تم استبدال البند '{item_number}' بالصف رقم {row_number}.")
+
+        parsed[item_number] = {
+            'row': row_number,
+            'item_number': item_number,
+            'description': description,
+            'unit': unit,
+            'contract_quantity': contract_quantity,
+            'contract_unit_cost': contract_unit_cost,
+            # Default actual values based on contract
+            'actual_quantity': contract_quantity,
+            'actual_unit_cost': contract_unit_cost * constants.ACTUAL_UNIT_COST_DEFAULT_PERCENT,
+        }
+    return list(parsed.values())
+
+
+def existing_item_ids(project_id):
+    """Maps item_number -> id for every item of the project (lowest id wins on duplicates)."""
+    rows = db.session.execute(
+        select(Item.item_number, Item.id).where(Item.project_id == project_id).order_by(Item.id.desc())
+    ).all()
+    return {item_number: item_id for item_number, item_id in rows}
+
+
+def upsert_items(project_id, parsed_rows, result):
+    """
+    Inserts or updates the parsed rows of one project. Does not commit.
+    """
+    if not parsed_rows:
+        return result
+
+    existing = existing_item_ids(project_id)
+    inserts = []
+    updates = []
+    for row in parsed_rows:
+        values = {field: row[field] for field in IMPORTED_FIELDS}
+        item_id = existing.get(row['item_number'])
+        if item_id is not None:
+            values['id'] = item_id
+            updates.append(values)
+        else:
+            values.update(
+                project_id=project_id,
+                item_number=row['item_number'],
+                item_number_sort_key=natural_sort_key(row['item_number']),
+            )
+            inserts.append(values)
+
+    if inserts:
+        db.session.bulk_insert_mappings(Item, inserts)
+    if updates:
+        db.session.bulk_update_mappings(Item, updates)
+
+    ProjectFinancials.refresh(db.session.connection(), [project_id])
+
+    result.created += len(inserts)
+    result.updated += len(updates)
+    return result
+
+
+def import_sheet_data(project_id, data):
+    """
+    Runs the full pipeline over a sheet (header row + data rows).
+    Returns an ImportResult, or raises ValueError listing the missing columns.
+    """
+    header_indices, missing_keys = map_headers(data[0])
+    if missing_keys:
+        raise ValueError(', '.join(COLUMN_MAP[key][0] for key in missing_keys))
+
+    result = ImportResult()
+    parsed_rows = parse_rows(data[1:], header_indices, result)
+    return upsert_items(project_id, parsed_rows, result)
@@ -0,0 +1,451 @@
+"""
+In-app background job queue backed by the background_job table.
+
+Tasks are plain functions registered with @task('name'); they receive the job
+and its payload as keyword arguments and return a TaskResult (a message and,
+optionally, a generated file). enqueue() only stores a queued row, so a route
+returns right away instead of holding a gunicorn worker for the whole export.
+
+Workers claim the oldest queued job with a compare-and-set UPDATE (plus
+SELECT ... FOR UPDATE SKIP LOCKED on PostgreSQL), so any number of threads and
+processes can share the table. JOBS_EXECUTION decides who runs the jobs:
+
+  'worker'  -> a separate process only: flask run-worker --threads N (default)
+  'inline'  -> synchronously inside the request (serverless deployments); a
+               generated file is sent back with that request's response (see
+               inline_file_response), since serverless instances have no
+               writable, shared disk for the results directory
+  'thread'  -> daemon worker threads started inside each web process; only for
+               debug/testing, since a recycled gunicorn worker takes its running
+               jobs down with it
+
+While a task runs, a side thread refreshes the job's heartbeat_at. A running job
+whose heartbeat stopped (its worker died) is put back in the queue; a job that
+is only slow keeps beating and is left alone. The outcome is written only while
+the job is still claimed by the same worker, so a worker whose job was taken
+over cannot overwrite the result of the one that took it.
+"""
+import io
+import logging
+import os
+import shutil
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app, send_file
+from sqlalchemy import func, select, update
+
+from app.extensions import db
+from app.models.background_job import BackgroundJob
+
+logger = logging.getLogger(__name__)
+
+EXECUTION_MODES = ('thread', 'worker', 'inline')
+DEFAULT_EXECUTION_MODE = 'worker'
+DEFAULT_POLL_INTERVAL = 2  # seconds between polls of an idle worker
+DEFAULT_HEARTBEAT_INTERVAL = 30  # seconds between heartbeats of a running job
+DEFAULT_STALE_AFTER = 300  # running jobs without a heartbeat for this long are assumed dead
+DEFAULT_MAX_ATTEMPTS = 3
+RESULT_COPY_CHUNK_SIZE = 1024 * 1024
+
+_TASKS = {}
+
+_threads_lock = threading.Lock()
+_threads_pid = None  # pid of the process whose in-app worker threads are running
+
+
+class JobError(Exception):
+    """Expected task failure; the message is shown to the user as is."""
+
+
+class TaskResult:
+    """
+    What a task hands back: a message, optional details and an optional file,
+    given either as bytes (data) or as an open file positioned at its start
+    (file), which is copied to the results directory in chunks and then closed.
+    """
+
+    def __init__(self, message=None, details=None, data=None, filename=None, mimetype=None, file=None):
+        self.message = message
+        self.details = details
+        self.data = data
+        self.file = file
+        self.filename = filename
+        self.mimetype = mimetype
+
+    @property
+    def has_file(self):
+        return self.data is not None or self.file is not None
+
+
+def task(name):
+    """Registers a function as the handler of jobs of the given kind."""
+    def decorator(func):
+        _TASKS[name] = func
+        return func
+    return decorator
+
+
+def execution_mode(app=None):
+    mode = (app or current_app).config.get('JOBS_EXECUTION', DEFAULT_EXECUTION_MODE)
+    return mode if mode in EXECUTION_MODES else DEFAULT_EXECUTION_MODE
+
+
+def runs_in_background():
+    return execution_mode() != 'inline'
+
+
+def enqueue(kind, title, user_id, **payload):
+    """
+    Stores a queued job and commits it. In 'inline' mode the job is run before
+    returning; otherwise a worker picks it up.
+    """
+    if kind not in _TASKS:
+        raise KeyError(f"Unknown job kind: {kind}")
+    job = BackgroundJob(
+        kind=kind,
+        title=title,
+        user_id=user_id,
+        payload=payload,
+        status=BackgroundJob.STATUS_QUEUED,
+        attempts=0
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    mode = execution_mode()
+    if mode == 'inline':
+        worker_id = worker_name(f'inline-{threading.get_ident()}')
+        if claim_job(job.id, worker_id):
+            job = run_job(job.id, worker_id, keep_file=True)
+    elif mode == 'thread':
+        start_worker_threads(current_app._get_current_object())
+    return job
+
+
+# --- START: Result files ---
+def results_dir(app=None):
+    """Directory holding the files produced by jobs (shared by the web and worker processes)."""
+    app = app or current_app
+    path = app.config.get('JOBS_RESULTS_DIR') or os.path.join(app.instance_path, 'job_results')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def result_file_path(job):
+    """Absolute path of a job's result file, or None."""
+    if not job.result_path:
+        return None
+    return os.path.join(results_dir(), job.result_path)
+
+
+def _store_result_file(job, result):
+    """Writes the result file next to the others and returns its name (relative to results_dir)."""
+    extension = os.path.splitext(result.filename or '')[1]
+    name = f"{job.id}-{uuid.uuid4().hex}{extension}"
+    with open(os.path.join(results_dir(), name), 'wb') as target:
+        if result.file is not None:
+            shutil.copyfileobj(result.file, target, RESULT_COPY_CHUNK_SIZE)
+        else:
+            target.write(result.data)
+    return name
+
+
+def inline_file_response(job):
+    """
+    Download response for the file of a job that enqueue() has just run inline,
+    or None (no file, job failed, or the job runs in a worker). The file is not
+    kept: the job page of such a job has nothing to download afterwards.
+    """
+    result = getattr(job, 'inline_result', None)
+    if result is None or not result.has_file:
+        return None
+    return send_file(
+        result.file if result.file is not None else io.BytesIO(result.data),
+        mimetype=result.mimetype or 'application/octet-stream',
+        as_attachment=True,
+        download_name=result.filename
+    )
+
+
+def _remove_result_files(names):
+    directory = results_dir()
+    for name in names:
+        if not name:
+            continue
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+# --- END: Result files ---
+
+
+# --- START: Claiming and running ---
+def claim_job(job_id, worker_id):
+    """Marks a queued job as running; False when another worker got it first."""
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        update(BackgroundJob)
+        .where(BackgroundJob.id == job_id, BackgroundJob.status == BackgroundJob.STATUS_QUEUED)
+        .values(
+            status=BackgroundJob.STATUS_RUNNING,
+            worker_id=worker_id,
+            started_at=now,
+            heartbeat_at=now,
+            attempts=BackgroundJob.attempts + 1
+        )
+    ).rowcount
+    db.session.commit()
+    return claimed == 1
+
+
+def claim_next_job(worker_id):
+    """Claims the oldest queued job. Returns its id, or None when the queue is empty."""
+    query = (
+        select(BackgroundJob.id)
+        .where(BackgroundJob.status == BackgroundJob.STATUS_QUEUED)
+        .order_by(BackgroundJob.id)
+        .limit(1)
+    )
+    if db.session.get_bind().dialect.name == 'postgresql':
+        query = query.with_for_update(skip_locked=True)
+    while True:
+        job_id = db.session.execute(query).scalar()
+        if job_id is None:
+            db.session.rollback()
+            return None
+        if claim_job(job_id, worker_id):
+            return job_id
+        # Lost the race for this row (SQLite has no SKIP LOCKED); try the next one
+
+
+class _Heartbeat:
+    """Refreshes heartbeat_at of a running job from a side thread while its task runs."""
+
+    def __init__(self, app, job_id, worker_id):
+        self.app = app
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.interval = app.config.get('JOBS_HEARTBEAT_INTERVAL', DEFAULT_HEARTBEAT_INTERVAL)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"job-heartbeat-{job_id}", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            # Own app context, hence own session: the task's transaction is not touched
+            with self.app.app_context():
+                try:
+                    db.session.execute(
+                        update(BackgroundJob)
+                        .where(*_claimed_by(self.job_id, self.worker_id))
+                        .values(heartbeat_at=datetime.utcnow())
+                    )
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("Heartbeat of background job %s failed", self.job_id)
+
+
+def _claimed_by(job_id, worker_id):
+    return (
+        BackgroundJob.id == job_id,
+        BackgroundJob.worker_id == worker_id,
+        BackgroundJob.status == BackgroundJob.STATUS_RUNNING,
+    )
+
+
+def run_job(job_id, worker_id, keep_file=False):
+    """
+    Runs a job claimed by worker_id and stores its result or error. Returns the job.
+    With keep_file=True ('inline' mode) a generated file is not written to the
+    results directory but left open on job.inline_result for the current request.
+    """
+    job = db.session.get(BackgroundJob, job_id)
+    handler = _TASKS.get(job.kind)
+    result, result_path = None, None
+    try:
+        if handler is None:
+            raise JobError(f"نوع مهمة غير معروف: {job.kind}")
+        with _Heartbeat(current_app._get_current_object(), job_id, worker_id):
+            result = handler(job, **(job.payload or {})) or TaskResult()
+        if not keep_file:
+            try:
+                result_path = _store_result_file(job, result) if result.has_file else None
+            finally:
+                if result.file is not None:
+                    result.file.close()
+    except Exception as e:
+        db.session.rollback()
+        if not isinstance(e, JobError):
+            logger.exception("Background job %s (%s) failed", job_id, job.kind)
+        outcome = {'status': BackgroundJob.STATUS_FAILED, 'error_message': str(e)}
+        result = None
+    else:
+        outcome = {
+            'status': BackgroundJob.STATUS_SUCCEEDED,
+            'result_message': result.message,
+            'result_details': result.details,
+            'result_path': result_path,
+            'result_filename': result.filename,
+            'result_mimetype': result.mimetype,
+            'error_message': None,
+        }
+    outcome['finished_at'] = datetime.utcnow()
+    # Only while the job is still ours: a job requeued as stale may be running elsewhere
+    written = db.session.execute(
+        update(BackgroundJob).where(*_claimed_by(job_id, worker_id)).values(**outcome)
+    ).rowcount
+    db.session.commit()
+    if written != 1:
+        logger.warning("Background job %s is no longer claimed by %s; its outcome is dropped", job_id, worker_id)
+        _remove_result_files([result_path])
+        if result is not None and result.file is not None:
+            result.file.close()
+        result = None
+
+    job = db.session.get(BackgroundJob, job_id)
+    if keep_file and result is not None:
+        job.inline_result = result
+    return job
+
+
+def requeue_stale_jobs(stale_after=None, max_attempts=None):
+    """
+    Puts running jobs whose worker died (no heartbeat for stale_after seconds)
+    back in the queue, or fails them after max_attempts. Returns the number of
+    requeued jobs.
+    """
+    config = current_app.config
+    stale_after = stale_after or config.get('JOBS_STALE_AFTER', DEFAULT_STALE_AFTER)
+    max_attempts = max_attempts or config.get('JOBS_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+    now = datetime.utcnow()
+    stale = (
+        BackgroundJob.status == BackgroundJob.STATUS_RUNNING,
+        # Jobs claimed before heartbeats existed only have started_at
+        func.coalesce(BackgroundJob.heartbeat_at, BackgroundJob.started_at) < now - timedelta(seconds=stale_after),
+    )
+    db.session.execute(
+        update(BackgroundJob)
+        .where(*stale, BackgroundJob.attempts >= max_attempts)
+        .values(
+            status=BackgroundJob.STATUS_FAILED,
+            error_message='توقفت المهمة أكثر من مرة قبل اكتمالها.',
+            finished_at=now
+        )
+    )
+    requeued = db.session.execute(
+        update(BackgroundJob)
+        .where(*stale)
+        .values(status=BackgroundJob.STATUS_QUEUED, worker_id=None)
+    ).rowcount
+    db.session.commit()
+    return requeued
+
+
+def purge_finished_jobs(older_than_days):
+    """Deletes finished jobs (and their stored files) older than the given number of days."""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    finished = (
+        BackgroundJob.status.in_([BackgroundJob.STATUS_SUCCEEDED, BackgroundJob.STATUS_FAILED]),
+        BackgroundJob.finished_at < cutoff,
+    )
+    paths = db.session.execute(select(BackgroundJob.result_path).where(*finished)).scalars().all()
+    deleted = BackgroundJob.query.filter(*finished).delete(synchronize_session=False)
+    db.session.commit()
+    # Files go only once their rows are gone, so a failed commit leaves nothing dangling
+    _remove_result_files(paths)
+    return deleted
+# --- END: Claiming and running ---
+
+
+# --- START: Workers ---
+def worker_name(index):
+    return f"{socket.gethostname()}:{os.getpid()}:{index}"
+
+
+def work(app, worker_id, stop_event, poll_interval=None, burst=False):
+    """
+    Worker loop: claims and runs jobs until stop_event is set. With burst=True
+    the loop returns as soon as the queue is empty.
+    """
+    poll_interval = poll_interval or app.config.get('JOBS_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+    while not stop_event.is_set():
+        job_id = None
+        with app.app_context():
+            try:
+                job_id = claim_next_job(worker_id)
+                if job_id is not None:
+                    run_job(job_id, worker_id)
+            except Exception:
+                logger.exception("Background worker %s failed", worker_id)
+                db.session.rollback()
+        if job_id is None:
+            if burst:
+                return
+            stop_event.wait(poll_interval)
+
+
+def run_workers(app, threads=1, poll_interval=None, burst=False):
+    """Runs worker threads in the foreground until interrupted (flask run-worker)."""
+    with app.app_context():
+        requeue_stale_jobs()
+    stop_event = threading.Event()
+    workers = [
+        threading.Thread(target=work, args=(app, worker_name(i), stop_event, poll_interval, burst),
+                         name=f"job-worker-{i}", daemon=True)
+        for i in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(timeout=1)
+    except KeyboardInterrupt:
+        stop_event.set()
+        for worker in workers:
+            worker.join()
+
+
+def start_worker_threads(app):
+    """Starts the in-app worker threads of this process once ('thread' mode)."""
+    global _threads_pid
+    pid = os.getpid()
+    if _threads_pid == pid:
+        return
+    with _threads_lock:
+        if _threads_pid == pid:
+            return
+        _threads_pid = pid
+        with app.app_context():
+            requeue_stale_jobs()
+        for i in range(app.config.get('JOBS_WORKER_THREADS', 1)):
+            threading.Thread(target=work, args=(app, worker_name(i), threading.Event()),
+                             name=f"job-worker-{i}", daemon=True).start()
+# --- END: Workers ---
+
+
+def init_app(app):
+    """Registers the tasks and, in 'thread' mode, starts the workers on the first request."""
+    from app.services import background_tasks  # noqa: F401  (registers the @task handlers)
+
+    if execution_mode(app) == 'thread':
+        if not (app.debug or app.testing):
+            raise RuntimeError(
+                "JOBS_EXECUTION='thread' is only supported with debug or testing enabled; "
+                "use 'worker' (flask run-worker next to gunicorn) or 'inline'."
+            )
+
+        @app.before_request
+        def ensure_job_worker_threads():
+            start_worker_threads(app)
@@ -0,0 +1,243 @@
+"""
+Allocation of an invoice payment across the invoice's lines (توزيع الدفعات).
+
+A payment is entered as a vector of amounts, one per invoice line. Instead of
+loading each line and its paid total separately, the service:
+  1. locks the invoice row, so two payments on the same invoice are validated
+     one after the other,
+  2. loads every target line with its paid total in one grouped query,
+  3. validates the whole vector at once (unknown lines, negative amounts,
+     amounts above what is left to pay on the line),
+  4. writes the PaymentDistribution rows with bulk mappings.
+
+allocate() goes the other way: it splits a lump sum over the lines' remaining
+balances with one of the STRATEGIES, so the payment form can be pre-filled.
+
+Validation failures raise AllocationError with the message the user should see.
+"""
+import math
+
+from sqlalchemy import func, select
+
+from app.extensions import db
+from app.models.invoice import Invoice
+from app.models.invoice_item import InvoiceItem
+from app.models.payment import Payment
+from app.models.payment_distribution import PaymentDistribution
+
+FORM_FIELD_PREFIX = 'dist_item_'
+
+# Amounts are entered to the halala; allow for float noise above the rounded limit
+AMOUNT_TOLERANCE = 0.001
+
+STRATEGY_PRO_RATA = 'pro_rata'
+STRATEGY_OLDEST_FIRST = 'oldest_first'
+STRATEGY_LARGEST_FIRST = 'largest_first'
+
+STRATEGIES = {
+    STRATEGY_PRO_RATA: 'توزيع نسبي حسب المبلغ المتبقي',
+    STRATEGY_OLDEST_FIRST: 'الأقدم أولاً',
+    STRATEGY_LARGEST_FIRST: 'الأكبر متبقياً أولاً',
+}
+
+
+class AllocationError(ValueError):
+    pass
+
+
+class AllocationTarget:
+    """One invoice line with what is left to pay on it."""
+
+    def __init__(self, invoice_item_id, description, total_price, paid_amount):
+        self.invoice_item_id = invoice_item_id
+        self.description = description
+        self.total_price = total_price or 0.0
+        self.paid_amount = paid_amount or 0.0
+
+    @property
+    def remaining_amount(self):
+        return self.total_price - self.paid_amount
+
+
+def parse_distribution_form(form):
+    """{invoice_item_id: amount} from the dist_item_<id> fields of a payment form."""
+    amounts = {}
+    for key, value in form.items():
+        if not key.startswith(FORM_FIELD_PREFIX):
+            continue
+        try:
+            invoice_item_id = int(key[len(FORM_FIELD_PREFIX):])
+            amount = float(value) if value else 0.0
+        except (ValueError, TypeError):
+            raise AllocationError("تم إدخال قيمة غير صالحة لأحد البنود. يجب إدخال أرقام فقط.")
+        if amount < 0:
+            raise AllocationError("لا يمكن إدخال مبلغ سالب.")
+        amounts[invoice_item_id] = amount
+    return amounts
+
+
+def lock_invoice(invoice_id):
+    """Row lock on the invoice until commit (no-op on SQLite, which serializes writers anyway)."""
+    db.session.execute(select(Invoice.id).where(Invoice.id == invoice_id).with_for_update())
+
+
+def load_targets(invoice_id, invoice_item_ids=None, exclude_payment_id=None):
+    """
+    {invoice_item_id: AllocationTarget} for the lines of the invoice (or only the
+    given ones), in one query. The paid totals leave out exclude_payment_id, so
+    an edited payment can re-use what it had allocated itself.
+    """
+    paid = (
+        select(PaymentDistribution.invoice_item_id, func.sum(PaymentDistribution.amount).label('amount'))
+        .join(InvoiceItem, InvoiceItem.id == PaymentDistribution.invoice_item_id)
+        .where(InvoiceItem.invoice_id == invoice_id)
+    )
+    if exclude_payment_id is not None:
+        paid = paid.where(PaymentDistribution.payment_id != exclude_payment_id)
+    paid = paid.group_by(PaymentDistribution.invoice_item_id).subquery()
+
+    stmt = (
+        select(InvoiceItem.id, InvoiceItem.description, InvoiceItem.total_price,
+               func.coalesce(paid.c.amount, 0.0))
+        .outerjoin(paid, paid.c.invoice_item_id == InvoiceItem.id)
+        .where(InvoiceItem.invoice_id == invoice_id)
+        .order_by(InvoiceItem.id)
+    )
+    if invoice_item_ids is not None:
+        stmt = stmt.where(InvoiceItem.id.in_(list(invoice_item_ids)))
+    return {row[0]: AllocationTarget(*row) for row in db.session.execute(stmt)}
+
+
+def validate_allocation(invoice_id, amounts, exclude_payment_id=None):
+    """
+    Checks a whole distribution vector against the invoice's lines and returns
+    it without the zero amounts. Raises AllocationError on the first invalid line.
+    """
+    amounts = {invoice_item_id: amount for invoice_item_id, amount in amounts.items() if amount > 0}
+    if not amounts:
+        raise AllocationError("الرجاء إدخال مبلغ لدفعه لبند واحد على الأقل.")
+
+    targets = load_targets(invoice_id, amounts.keys(), exclude_payment_id=exclude_payment_id)
+    unknown = sorted(set(amounts) - set(targets))
+    if unknown:
+        raise AllocationError(f"تم العثور على بند غير صالح في الدفعة (ID: {unknown[0]}).")
+
+    for invoice_item_id, amount in sorted(amounts.items()):
+        target = targets[invoice_item_id]
+        if amount > round(target.remaining_amount, 2) + AMOUNT_TOLERANCE:
+            raise AllocationError(
+                f"المبلغ المدفوع للبند '{target.description[:30]}...' يتجاوز المبلغ المتبقي "
+                f"(الحد الأقصى المتبقي: {target.remaining_amount:.2f} ر.س)."
+            )
+    return amounts
+
+
+def _to_halalas(amount):
+    # nan/inf (e.g. ?amount=inf) would make int() raise ValueError/OverflowError
+    if not math.isfinite(amount):
+        raise AllocationError("مبلغ الدفعة غير صالح.")
+    return int(round(amount * 100))
+
+
+def allocate(invoice_id, amount, strategy=STRATEGY_PRO_RATA, exclude_payment_id=None):
+    """
+    Splits a lump sum over the invoice's lines and returns {invoice_item_id: amount}
+    for the lines that receive something.
+
+    Works in whole halalas in a single pass over the remaining balances, so every
+    amount is rounded to the halala and the amounts always add up to exactly the
+    lump sum. pro_rata hands the halalas left over by rounding down to the lines
+    with the largest fractional shares; the other strategies fill lines in full,
+    in line order (oldest_first) or by remaining balance (largest_first).
+    """
+    if strategy not in STRATEGIES:
+        raise AllocationError("طريقة التوزيع غير معروفة.")
+    lump_sum = _to_halalas(amount)
+    if lump_sum <= 0:
+        raise AllocationError("يجب أن يكون مبلغ الدفعة أكبر من صفر.")
+
+    targets = load_targets(invoice_id, exclude_payment_id=exclude_payment_id)
+    # [(invoice_item_id, remaining in halalas)] in line order
+    balances = [(target_id, _to_halalas(target.remaining_amount)) for target_id, target in targets.items()]
+    balances = [(target_id, remaining) for target_id, remaining in balances if remaining > 0]
+    total_remaining = sum(remaining for _, remaining in balances)
+    if lump_sum > total_remaining:
+        raise AllocationError(
+            f"مبلغ الدفعة يتجاوز إجمالي المبلغ المتبقي على بنود المستخلص ({total_remaining / 100:.2f} ر.س)."
+        )
+
+    shares = {}
+    if strategy == STRATEGY_PRO_RATA:
+        remainders = []
+        for target_id, remaining in balances:
+            shares[target_id], remainder = divmod(lump_sum * remaining, total_remaining)
+            remainders.append((-remainder, target_id))
+        leftover = lump_sum - sum(shares.values())
+        # Never more than one halala per line, and never above a line's balance:
+        # a line with a non-zero remainder got strictly less than its balance
+        for _, target_id in sorted(remainders)[:leftover]:
+            shares[target_id] += 1
+    else:
+        if strategy == STRATEGY_LARGEST_FIRST:
+            balances.sort(key=lambda balance: (-balance[1], balance[0]))
+        left = lump_sum
+        for target_id, remaining in balances:
+            if not left:
+                break
+            shares[target_id] = min(remaining, left)
+            left -= shares[target_id]
+
+    return {target_id: share / 100 for target_id, share in shares.items() if share}
+
+
+def create_payment(invoice, amounts, payment_date, description=None):
+    """Validates the distribution and adds the payment with its distributions (not committed)."""
+    lock_invoice(invoice.id)
+    amounts = validate_allocation(invoice.id, amounts)
+
+    payment = Payment(
+        invoice_id=invoice.id,
+        amount=sum(amounts.values()),
+        payment_date=payment_date,
+        description=description
+    )
+    db.session.add(payment)
+    db.session.flush()
+
+    db.session.bulk_insert_mappings(PaymentDistribution, [
+        {'payment_id': payment.id, 'invoice_item_id': invoice_item_id, 'amount': amount}
+        for invoice_item_id, amount in sorted(amounts.items())
+    ])
+    return payment
+
+
+def update_payment(payment, amounts):
+    """
+    Replaces the distribution of an existing payment (not committed): changed
+    amounts are updated, new lines inserted and lines left at zero deleted,
+    each as one bulk statement.
+    """
+    lock_invoice(payment.invoice_id)
+    amounts = validate_allocation(payment.invoice_id, amounts, exclude_payment_id=payment.id)
+
+    existing = dict(db.session.execute(
+        select(PaymentDistribution.invoice_item_id, PaymentDistribution.id)
+        .where(PaymentDistribution.payment_id == payment.id)
+    ).all())
+
+    db.session.bulk_update_mappings(PaymentDistribution, [
+        {'id': existing[invoice_item_id], 'amount': amount}
+        for invoice_item_id, amount in amounts.items() if invoice_item_id in existing
+    ])
+    db.session.bulk_insert_mappings(PaymentDistribution, [
+        {'payment_id': payment.id, 'invoice_item_id': invoice_item_id, 'amount': amount}
+        for invoice_item_id, amount in sorted(amounts.items()) if invoice_item_id not in existing
+    ])
+    removed = [distribution_id for invoice_item_id, distribution_id in existing.items() if invoice_item_id not in amounts]
+    if removed:
+        PaymentDistribution.query.filter(PaymentDistribution.id.in_(removed)).delete(synchronize_session=False)
+
+    payment.amount = sum(amounts.values())
+    # The loaded collection no longer matches the rows
+    db.session.expire(payment, ['distributions'])
+    return payment
@@ -0,0 +1,136 @@
+"""
+Figures of the project dashboard (صفحة المشروع), computed in the database.
+
+The page used to load every item with its cost details just to count items by
+status and derive the completion percentages. The counts now come from one
+grouped query and the money totals from the project_financials rollup row (or,
+when the rollup has not been built yet, from one aggregate query over the same
+expressions). Item rows themselves are fetched by the page on demand, one page
+at a time, from the items.json endpoint.
+
+portfolio_summary() does the same for the projects summary page: per-project
+and grand totals of every project in one query.
+"""
+from sqlalchemy import func, select
+
+from app import constants
+from app.extensions import db
+from app.models.item import Item
+from app.models.project import Project
+from app.models.project_financials import ProjectFinancials
+
+class ProjectDashboard:
+    def __init__(self, project_id, status_counts, total_contract_cost, total_actual_cost, total_paid_amount):
+        self.project_id = project_id
+        self.status_counts = status_counts  # status -> number of items
+        self.total_contract_cost = total_contract_cost or 0.0
+        self.total_actual_cost = total_actual_cost or 0.0
+        self.total_paid_amount = total_paid_amount or 0.0
+
+    @property
+    def item_count(self):
+        return sum(self.status_counts.values())
+
+    def count(self, status):
+        return self.status_counts.get(status, 0)
+
+    @property
+    def completed_count(self):
+        return self.count(constants.ITEM_STATUS_COMPLETED)
+
+    @property
+    def active_count(self):
+        return self.count(constants.ITEM_STATUS_ACTIVE)
+
+    @property
+    def pending_count(self):
+        return self.count(constants.ITEM_STATUS_ON_HOLD)
+
+    @property
+    def total_savings(self):
+        return self.total_contract_cost - self.total_actual_cost
+
+    @property
+    def total_remaining_amount(self):
+        return self.total_actual_cost - self.total_paid_amount
+
+    @property
+    def completion_percentage(self):
+        if not self.item_count:
+            return 0.0
+        return (self.completed_count / self.item_count) * 100
+
+    @property
+    def financial_completion_percentage(self):
+        if self.total_actual_cost == 0:
+            return 0.0
+        return (self.total_paid_amount / self.total_actual_cost) * 100
+
+
+def item_status_counts(project_id):
+    """Number of items of the project per status, in one grouped query."""
+    stmt = (
+        select(Item.status, func.count(Item.id))
+        .where(Item.project_id == project_id)
+        .group_by(Item.status)
+    )
+    return {status: count for status, count in db.session.execute(stmt)}
+
+
+def project_totals(project_id):
+    """(contract, actual, paid) totals of the project."""
+    financials = db.session.get(ProjectFinancials, project_id)
+    if financials is not None:
+        return financials.total_contract_cost, financials.total_actual_cost, financials.total_paid_amount
+
+    # Rollup row not built yet (e.g. before `flask rebuild-rollups`): aggregate live
+    aggregates = ProjectFinancials.aggregate_columns()
+    stmt = select(
+        aggregates['total_contract_cost'], aggregates['total_actual_cost'], aggregates['total_paid_amount']
+    ).where(Project.id == project_id)
+    return tuple(db.session.execute(stmt).one())
+
+
+def get_project_dashboard(project_id):
+    return ProjectDashboard(project_id, item_status_counts(project_id), *project_totals(project_id))
+
+
+def portfolio_summary(archived=False):
+    """
+    (rows, totals) of the projects summary page, from a single query.
+
+    Each row carries id, name and the project's contract/actual/paid/remaining
+    totals, read from its project_financials rollup row (or aggregated live when
+    that row is missing). The grand totals are window sums over the same rows,
+    so the query count does not grow with the number of projects.
+    """
+    aggregates = ProjectFinancials.aggregate_columns()
+    contract = func.coalesce(ProjectFinancials.total_contract_cost, aggregates['total_contract_cost'])
+    actual = func.coalesce(ProjectFinancials.total_actual_cost, aggregates['total_actual_cost'])
+    paid = func.coalesce(ProjectFinancials.total_paid_amount, aggregates['total_paid_amount'])
+
+    stmt = (
+        select(
+            Project.id, Project.name,
+            contract.label('total_contract_cost'),
+            actual.label('total_actual_cost'),
+            paid.label('total_paid_amount'),
+            (actual - paid).label('total_remaining_amount'),
+            func.sum(contract).over().label('grand_contract_cost'),
+            func.sum(actual).over().label('grand_actual_cost'),
+            func.sum(paid).over().label('grand_paid_amount'),
+        )
+        .outerjoin(ProjectFinancials, ProjectFinancials.project_id == Project.id)
+        .where(Project.is_archived == archived)
+        .order_by(Project.id)
+    )
+    rows = db.session.execute(stmt).all()
+
+    first = rows[0] if rows else None
+    totals = {
+        'contract_cost': first.grand_contract_cost if first else 0.0,
+        'actual_cost': first.grand_actual_cost if first else 0.0,
+        'paid_amount': first.grand_paid_amount if first else 0.0,
+    }
+    totals['remaining_amount'] = totals['actual_cost'] - totals['paid_amount']
+    return rows, totals
@@ -0,0 +1,237 @@
+"""
+Incremental (delta) sync of a project's items to one Google Sheets sheet.
+
+The first sync creates the sheet and stores a SheetSyncState (sheet id, rows
+in use, last_synced_at watermark) plus one SheetSyncRow per item: the grid row
+it was written to and a fingerprint of its values. Paid and remaining amounts
+or the contractor name change without touching the item row, so changes are
+detected by comparing fingerprints rather than item timestamps. Each later sync
+then sends only:
+
+  - changed items         -> rewritten in place
+  - new items             -> written to rows freed by deleted items, then appended
+  - deleted items         -> their rows are cleared
+
+as targeted updateCells ranges in size-bounded batchUpdate calls. When the
+synced sheet is gone (deleted or renamed in Google Sheets), or on request, a
+full sync starts a new sheet.
+"""
+import hashlib
+import json
+from datetime import datetime
+
+from googleapiclient.errors import HttpError
+from sqlalchemy import func, select
+
+from app.extensions import db
+from app.models.contractor import Contractor
+from app.models.cost_detail import CostDetail
+from app.models.invoice_item import InvoiceItem
+from app.models.item import Item
+from app.models.payment_distribution import PaymentDistribution
+from app.models.sheet_sync import SheetSyncState, SheetSyncRow
+from app.services.google_sheets_service import GoogleSheetsService
+
+SYNC_SHEET_NAME = "بنود المشروع (مزامنة)"
+# First key of the (namespace, project id) advisory lock held by a running sync
+SYNC_LOCK_NAMESPACE = 0x53594E43
+
+ITEM_EXPORT_HEADERS = [
+    "رقم البند", "الوصف", "الوحدة", "الكمية التعاقدية",
+    "التكلفة الإفرادية التعاقدية", "التكلفة الإجمالية التعاقدية",
+    "الكمية الفعلية", "التكلفة الإفرادية الفعلية", "التكلفة الإجمالية الفعلية",
+    "الحالة", "المقاول/المورد", "المبلغ المدفوع", "المبلغ المتبقي", "ملاحظات"
+]
+
+
+def project_item_rows(project_id):
+    """
+    (item_id, row values) for every item of the project, in sheet order and in
+    the order of ITEM_EXPORT_HEADERS.
+
+    One query selects exactly the exported columns: the contractor name comes
+    from an outer join, and the actual cost and paid amount from two subqueries
+    grouped once per item instead of correlated per row.
+    """
+    actual_cost = (
+        select(CostDetail.item_id, func.sum(CostDetail.quantity * CostDetail.unit_cost * (1 + CostDetail.vat_percent / 100)).label('total'))
+        .join(Item, Item.id == CostDetail.item_id)
+        .where(Item.project_id == project_id)
+        .group_by(CostDetail.item_id)
+        .subquery()
+    )
+    paid = (
+        select(InvoiceItem.item_id, func.sum(PaymentDistribution.amount).label('total'))
+        .join(PaymentDistribution, PaymentDistribution.invoice_item_id == InvoiceItem.id)
+        .join(Item, Item.id == InvoiceItem.item_id)
+        .where(Item.project_id == project_id)
+        .group_by(InvoiceItem.item_id)
+        .subquery()
+    )
+    stmt = (
+        select(
+            Item.id, Item.item_number, Item.description, Item.unit,
+            Item.contract_quantity, Item.contract_unit_cost,
+            Item.actual_quantity, Item.actual_unit_cost, Item.status, Item.notes,
+            Contractor.name.label('contractor_name'),
+            func.coalesce(actual_cost.c.total, 0.0).label('actual_total_cost'),
+            func.coalesce(paid.c.total, 0.0).label('paid_amount'),
+        )
+        .outerjoin(Contractor, Contractor.id == Item.contractor_id)
+        .outerjoin(actual_cost, actual_cost.c.item_id == Item.id)
+        .outerjoin(paid, paid.c.item_id == Item.id)
+        .where(Item.project_id == project_id)
+        .order_by(Item.item_number_sort_key, Item.id)
+    )
+
+    rows = []
+    for row in db.session.execute(stmt):
+        # Same values as Item.contract_total_cost / actual_total_cost / remaining_amount
+        if row.contract_quantity is not None and row.contract_unit_cost is not None:
+            contract_total_cost = row.contract_quantity * row.contract_unit_cost
+        else:
+            contract_total_cost = 0.0
+        rows.append((row.id, [
+            row.item_number, row.description, row.unit,
+            row.contract_quantity, row.contract_unit_cost, contract_total_cost,
+            # NOTE: The following two fields are deprecated in the new model structure, but kept for compatibility or manual input reference
+            row.actual_quantity, row.actual_unit_cost, row.actual_total_cost,
+            row.status,
+            row.contractor_name or "",
+            row.paid_amount, row.actual_total_cost - row.paid_amount, row.notes
+        ]))
+    return rows
+
+
+def row_hash(values):
+    return hashlib.md5(json.dumps(values, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+
+class SyncResult:
+    def __init__(self, full=False, updated=0, added=0, removed=0):
+        self.full = full
+        self.updated = updated
+        self.added = added
+        self.removed = removed
+
+    @property
+    def message(self):
+        if self.full:
+            return f"تمت مزامنة كاملة لبنود المشروع ({self.added} بند) في ورقة عمل جديدة."
+        if not (self.updated or self.added or self.removed):
+            return "لا توجد تغييرات منذ آخر مزامنة."
+        return f"تمت المزامنة: {self.updated} بند محدث و {self.added} بند مضاف و {self.removed} بند محذوف."
+
+
+def _lock_project_sync(project_id):
+    """
+    Serializes concurrent syncs of the same project until commit (PostgreSQL only).
+
+    A transaction-level advisory lock, taken by syncs only: it also covers the
+    first sync, before any SheetSyncState row exists to lock, and unlike a lock on
+    the project row it does not hold up the project's other writes (rollup
+    refresh) while the sync waits on the Sheets API.
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(select(func.pg_advisory_xact_lock(SYNC_LOCK_NAMESPACE, project_id)))
+
+
+def sync_project_items(project, service=None, full=False):
+    """
+    Brings the project's synced sheet up to date and commits the new sync state.
+    Raises on API errors, except when the synced sheet turns out to be gone,
+    which triggers a full sync.
+    """
+    service = service or GoogleSheetsService(project.spreadsheet_id)
+    _lock_project_sync(project.id)
+    # Read after the lock, so a state created by the sync we waited for is seen
+    state = SheetSyncState.query.filter_by(project_id=project.id).populate_existing().first()
+    rows = project_item_rows(project.id)
+
+    if state is None or full or state.spreadsheet_id != project.spreadsheet_id:
+        return _full_sync(project, service, state, rows)
+    try:
+        return _incremental_sync(project, service, state, rows)
+    except HttpError as e:
+        # A deleted sheet shows up as a 400 (unknown sheetId), but so does a bad
+        # payload: only start a new sheet once the old one is confirmed gone
+        if e.resp.status not in (400, 404) or service.has_sheet(state.sheet_id):
+            raise
+        return _full_sync(project, service, state, rows)
+
+
+def _full_sync(project, service, state, rows):
+    sheet_id, title = service.create_sheet(SYNC_SHEET_NAME, [ITEM_EXPORT_HEADERS] + [values for _, values in rows])
+
+    if state is None:
+        state = SheetSyncState(project_id=project.id)
+        db.session.add(state)
+    else:
+        SheetSyncRow.query.filter_by(project_id=project.id).delete(synchronize_session=False)
+    state.spreadsheet_id = project.spreadsheet_id
+    state.sheet_id = sheet_id
+    state.sheet_title = title
+    state.row_count = len(rows) + 1
+    state.last_synced_at = datetime.utcnow()
+    db.session.flush()
+
+    db.session.bulk_insert_mappings(SheetSyncRow, [
+        {'project_id': project.id, 'item_id': item_id, 'row_index': row_index, 'row_hash': row_hash(values)}
+        for row_index, (item_id, values) in enumerate(rows, start=1)
+    ])
+    db.session.commit()
+    return SyncResult(full=True, added=len(rows))
+
+
+def _incremental_sync(project, service, state, rows):
+    mapped = {row.item_id: row for row in SheetSyncRow.query.filter_by(project_id=project.id)}
+    current_ids = {item_id for item_id, _ in rows}
+
+    updates = []  # (row_index, values) sent to the sheet
+    hash_updates = []
+    new_rows = []
+    for item_id, values in rows:
+        fingerprint = row_hash(values)
+        synced = mapped.get(item_id)
+        if synced is None:
+            new_rows.append((item_id, values, fingerprint))
+        elif synced.row_hash != fingerprint:
+            updates.append((synced.row_index, values))
+            hash_updates.append({'project_id': project.id, 'item_id': item_id, 'row_hash': fingerprint})
+
+    removed = [row for item_id, row in mapped.items() if item_id not in current_ids]
+    kept_rows = {row.row_index for item_id, row in mapped.items() if item_id in current_ids}
+    # Rows of deleted items (and rows left empty by earlier syncs) are reused before appending
+    free_rows = sorted(set(range(1, state.row_count)) - kept_rows)
+
+    row_count = state.row_count
+    inserts = []
+    for item_id, values, fingerprint in new_rows:
+        if free_rows:
+            row_index = free_rows.pop(0)
+        else:
+            row_index = row_count
+            row_count += 1
+        updates.append((row_index, values))
+        inserts.append({'project_id': project.id, 'item_id': item_id, 'row_index': row_index, 'row_hash': fingerprint})
+
+    reused = {mapping['row_index'] for mapping in inserts}
+    blank = [''] * len(ITEM_EXPORT_HEADERS)
+    updates.extend((row.row_index, blank) for row in removed if row.row_index not in reused)
+
+    if updates:
+        service.update_rows(state.sheet_id, updates, row_count=row_count if row_count > state.row_count else None)
+
+    if removed:
+        SheetSyncRow.query.filter(
+            SheetSyncRow.project_id == project.id,
+            SheetSyncRow.item_id.in_([row.item_id for row in removed])
+        ).delete(synchronize_session=False)
+    if hash_updates:
+        db.session.bulk_update_mappings(SheetSyncRow, hash_updates)
+    if inserts:
+        db.session.bulk_insert_mappings(SheetSyncRow, inserts)
+    state.row_count = row_count
+    state.last_synced_at = datetime.utcnow()
+    db.session.commit()
+    return SyncResult(updated=len(hash_updates), added=len(inserts), removed=len(removed))
@@ -0,0 +1,235 @@
+"""
+Cached data layer for the sidebar lists injected into every template.
+
+The sidebar only needs the id and name of each project / contractor, so the
+cache stores plain dicts (JSON-serialisable) keyed by role or by user id.
+Entries live in process memory and, when REDIS_URL is configured and the
+``redis`` package is installed, in a shared Redis backend so that all
+gunicorn workers see the same data and the same invalidations.
+
+Any committed write to Project, Contractor, Invoice, User or the user_project
+association bumps a global version, which invalidates every entry. The version
+is kept in Redis or, without Redis, in a small file in the instance folder
+(SIDEBAR_CACHE_VERSION_FILE) that every worker on the host reads, so a bump made
+by one worker reaches the others on their next request. Deployments running on
+several hosts without a shared disk need Redis for that.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+
+CACHE_KEY_PREFIX = 'sidebar'
+SESSION_DIRTY_FLAG = 'sidebar_cache_dirty'
+
+
+class SidebarCache:
+    def __init__(self, ttl=300, redis_url=None, version_file=None):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._version = 0
+        self._redis = self._connect_redis(redis_url) if redis_url else None
+        self._version_file = version_file if self._redis is None else None
+
+    @staticmethod
+    def _connect_redis(redis_url):
+        # redis is optional: fall back silently to the in-process cache
+        try:
+            import redis
+        except ImportError:
+            return None
+        try:
+            client = redis.Redis.from_url(redis_url, socket_timeout=0.5)
+            client.ping()
+            return client
+        except Exception:
+            return None
+
+    def _current_version(self):
+        if self._redis is not None:
+            try:
+                return int(self._redis.get(f"{CACHE_KEY_PREFIX}:version") or 0)
+            except Exception:
+                pass
+        if self._version_file is not None:
+            try:
+                with open(self._version_file) as f:
+                    return f.read()
+            except FileNotFoundError:
+                return ''
+            except OSError:
+                pass
+        return self._version
+
+    def get(self, key):
+        version = self._current_version()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry[0] == version and entry[1] > time.monotonic():
+            return entry[2]
+
+        if self._redis is not None:
+            try:
+                raw = self._redis.get(f"{CACHE_KEY_PREFIX}:{version}:{key}")
+                if raw:
+                    value = json.loads(raw)
+                    self._store_local(key, version, value)
+                    return value
+            except Exception:
+                pass
+        return None
+
+    def set(self, key, value):
+        version = self._current_version()
+        self._store_local(key, version, value)
+        if self._redis is not None:
+            try:
+                self._redis.setex(f"{CACHE_KEY_PREFIX}:{version}:{key}", self.ttl, json.dumps(value))
+            except Exception:
+                pass
+
+    def _store_local(self, key, version, value):
+        with self._lock:
+            self._entries[key] = (version, time.monotonic() + self.ttl, value)
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+        if self._redis is not None:
+            try:
+                self._redis.incr(f"{CACHE_KEY_PREFIX}:version")
+            except Exception:
+                pass
+        if self._version_file is not None:
+            self._write_version_file()
+
+    def _write_version_file(self):
+        # Written to a temporary file and renamed, so readers never see a partial token
+        tmp_path = f"{self._version_file}.{os.getpid()}.{threading.get_ident()}"
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(uuid.uuid4().hex)
+            os.replace(tmp_path, self._version_file)
+        except OSError:
+            # Read-only instance folder (e.g. serverless): only this process is invalidated
+            pass
+
+
+def cache_key_for(user):
+    """Admins and sub-admins all see the same lists; regular users get their own entry."""
+    if user.role in ['admin', 'sub-admin']:
+        return 'role:admin'
+    return f'user:{user.id}'
+
+
+def load_sidebar_data(user):
+    """Runs the sidebar queries and returns JSON-serialisable lists."""
+    from app.models.project import Project
+    from app.models.contractor import Contractor
+    from app.models.invoice import Invoice
+    from app.models.user import User
+
+    projects_query = db.session.query(Project.id, Project.name).filter(Project.is_archived == False)
+    if user.role in ['admin', 'sub-admin']:
+        projects = projects_query.order_by(Project.name).all()
+        contractors = db.session.query(Contractor.id, Contractor.name).order_by(Contractor.name).all()
+    else:
+        projects = projects_query.join(Project.users).filter(User.id == user.id).order_by(Project.name).all()
+        contractors = []
+        if projects:
+            project_ids = [p.id for p in projects]
+            contractors = db.session.query(Contractor.id, Contractor.name).join(Invoice).filter(
+                Invoice.project_id.in_(project_ids)
+            ).distinct().order_by(Contractor.name).all()
+
+    return {
+        'projects': [{'id': p.id, 'name': p.name} for p in projects],
+        'contractors': [{'id': c.id, 'name': c.name} for c in contractors],
+    }
+
+
+def get_sidebar_data(user):
+    cache = _get_cache()
+    key = cache_key_for(user)
+    data = cache.get(key) if cache else None
+    if data is None:
+        data = load_sidebar_data(user)
+        if cache:
+            cache.set(key, data)
+    return data
+
+
+def _get_cache():
+    return current_app.extensions.get('sidebar_cache')
+
+
+# --- START: Write-driven invalidation ---
+# Mapper events only flag the session; the cache is cleared after the commit so
+# a concurrent request cannot re-populate it with pre-commit data.
+
+def _mark_session_dirty(mapper, connection, target):
+    session = inspect(target).session
+    if session is not None:
+        session.info[SESSION_DIRTY_FLAG] = True
+
+
+def _invalidate_after_commit(session):
+    if session.info.pop(SESSION_DIRTY_FLAG, False):
+        cache = _get_cache() if has_app_context() else None
+        if cache:
+            cache.invalidate()
+
+
+def _reset_after_rollback(session):
+    session.info.pop(SESSION_DIRTY_FLAG, None)
+
+
+def _listen_once(target, event_name, fn):
+    if not event.contains(target, event_name, fn):
+        event.listen(target, event_name, fn)
+
+
+def _register_listeners():
+    from app.models.project import Project
+    from app.models.contractor import Contractor
+    from app.models.invoice import Invoice
+    from app.models.user import User
+
+    # user_project is a plain association table with no mapper of its own; changing
+    # User.projects / Project.users marks the owning object dirty, so its
+    # after_update fires during the same flush that writes the association rows.
+    for model in (Project, Contractor, Invoice, User):
+        for event_name in ('after_insert', 'after_update', 'after_delete'):
+            _listen_once(model, event_name, _mark_session_dirty)
+
+    _listen_once(Session, 'after_commit', _invalidate_after_commit)
+    _listen_once(Session, 'after_rollback', _reset_after_rollback)
+# --- END: Write-driven invalidation ---
+
+
+def init_app(app):
+    """Creates the sidebar cache for this app and wires the invalidation listeners."""
+    version_file = app.config.get('SIDEBAR_CACHE_VERSION_FILE')
+    if not version_file:
+        version_file = os.path.join(app.instance_path, 'sidebar_cache.version')
+        try:
+            os.makedirs(app.instance_path, exist_ok=True)
+        except OSError:
+            pass
+    cache = SidebarCache(
+        ttl=app.config.get('SIDEBAR_CACHE_TTL', 300),
+        redis_url=app.config.get('SIDEBAR_CACHE_REDIS_URL'),
+        version_file=version_file,
+    )
+    app.extensions['sidebar_cache'] = cache
+    _register_listeners()
+    return cache
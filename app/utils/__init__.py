@@ -7,13 +7,14 @@ from functools import wraps
 import re
 
 
-def check_project_permission(project):
+def check_project_permission(project, require_admin=False):
     """
     التحقق من صلاحية المستخدم للوصول للمشروع
     Check if current user has permission to access the project
     
     Args:
         project: Project object to check permission for
+        require_admin: Restrict the action to admins/sub-admins
         
     Returns:
         bool: True if user has permission
@@ -24,6 +25,9 @@ def check_project_permission(project):
     """
     if not current_user.is_authenticated:
         abort(401)  # Unauthorized
+
+    if require_admin and current_user.role not in ['admin', 'sub-admin']:
+        abort(403)
     
     # يمكنك إضافة منطق الصلاحيات هنا
     # مثلاً: التحقق من أن المستخدم مالك المشروع أو عضو فيه
@@ -160,6 +164,36 @@ def validate_file_extension(filename, allowed_extensions=None):
     return extension in allowed_extensions
 
 
+NATURAL_SORT_KEY_DIGITS = 12
+
+
+def natural_sort_key(value, max_length=255):
+    """
+    مفتاح ترتيب طبيعي للأرقام المختلطة بالنصوص
+    Build a sortable string key where each run of digits is zero-padded,
+    so that '2' < '10' and '1.2' < '1.10' under plain string ordering.
+
+    Args:
+        value: Text to build the key for (e.g. an item or invoice number)
+        max_length: Maximum length of the stored key
+
+    Returns:
+        str: Sort key, or None if value is None
+    """
+    if value is None:
+        return None
+
+    text = str(value).strip().lower()
+    parts = re.split(r'(\d+)', text)
+    # int() also normalizes Arabic-Indic digits to ASCII before padding; isdecimal()
+    # (not isdigit()) so a lone superscript such as '²' is kept as text instead of failing int()
+    key = ''.join(
+        str(int(part)).zfill(NATURAL_SORT_KEY_DIGITS) if part.isdecimal() else part
+        for part in parts
+    )
+    return key[:max_length]
+
+
 def truncate_text(text, length=50, suffix='...'):
     """
     اختصار النص
@@ -192,5 +226,6 @@ __all__ = [
     'calculate_percentage',
     'validate_file_extension',
     'truncate_text',
+    'natural_sort_key',
 ]
 
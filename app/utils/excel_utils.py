@@ -7,7 +7,6 @@ from datetime import datetime
 from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
 from openpyxl.utils import get_column_letter
-import pandas as pd
 
 
 def export_material_request_to_excel(material_request):
@@ -256,71 +255,253 @@ def export_material_return_to_excel(material_return):
     return output
 
 
-def import_material_request_from_excel(file):
+# --- START: Excel import engines ---
+# Every importer is described by a column spec (header row, the column that
+# marks a non-empty row, and (key, header, kind) per column) and can be read
+# by either engine:
+#   'pandas'   -> pandas.read_excel + column-wise vectorized coercion
+#   'openpyxl' -> openpyxl read-only workbook streamed row by row, without
+#                 pandas/numpy and without building a DataFrame
+# Both apply the same coercion rules and fill the same columnar report of bad
+# cells: {column header: [Excel row numbers]}. A row with a bad cell is skipped.
+# Compare them with: flask benchmark-excel-import
+
+EXCEL_IMPORT_ENGINES = ('pandas', 'openpyxl')
+DEFAULT_EXCEL_IMPORT_ENGINE = 'pandas'
+
+MATERIAL_REQUEST_IMPORT_SPEC = {
+    'header_row': 5,  # Data starts at row 6 (0-indexed: 5)
+    'required': 'اسم المادة والوصف',
+    'columns': [
+        ('boq_item_number', 'رقم البند (B.O.Q)', 'text'),
+        ('material_name', 'اسم المادة والوصف', 'text'),
+        ('unit', 'الوحدة', 'text'),
+        ('quantity_available', 'الكمية المتاحة', 'number'),
+        ('quantity_requested', 'الكمية المطلوبة', 'number'),
+        ('required_date', 'تاريخ التوريد المطلوب', 'date'),
+    ],
+}
+
+MATERIAL_RETURN_IMPORT_SPEC = {
+    'header_row': 5,  # Data starts at row 6 (0-indexed: 5)
+    'required': 'اسم المادة والوصف',
+    'columns': [
+        ('boq_item_number', 'رقم البند (B.O.Q)', 'text'),
+        ('material_name', 'اسم المادة والوصف', 'text'),
+        ('unit', 'الوحدة', 'text'),
+        ('quantity', 'الكمية', 'number'),
+        ('notes', 'الملاحظات', 'text'),
+    ],
+}
+
+BOQ_IMPORT_SPEC = {
+    'header_row': 0,
+    'required': 'رقم البند',
+    'columns': [
+        ('item_number', 'رقم البند', 'text'),
+        ('description', 'الوصف', 'text'),
+        ('unit', 'الوحدة', 'text'),
+        ('quantity', 'الكمية المخططة', 'number'),
+        ('unit_price', 'سعر الوحدة', 'number'),
+        ('total_price', 'القيمة الإجمالية', 'number'),
+        ('category', 'التصنيف', 'text'),
+    ],
+}
+
+
+def format_import_report(report, max_rows=10):
+    """One-line summary of an import report, e.g. for a flash message."""
+    parts = []
+    for column, rows in report.items():
+        shown = ', '.join(str(row) for row in rows[:max_rows])
+        if len(rows) > max_rows:
+            shown += f" (+{len(rows) - max_rows})"
+        parts.append(f"{column}: الصفوف {shown}")
+    return "تم تخطي صفوف تحتوي على قيم غير صالحة - " + " | ".join(parts)
+
+
+def _import_excel(file, spec, report=None, engine=None):
+    """Reads an uploaded sheet with the chosen engine and maps it with the given spec."""
+    report = {} if report is None else report
+    engine = engine or DEFAULT_EXCEL_IMPORT_ENGINE
+    if engine not in EXCEL_IMPORT_ENGINES:
+        raise ValueError(f"محرك استيراد غير معروف: {engine}")
+    try:
+        if engine == 'openpyxl':
+            return _map_rows_openpyxl(file, spec, report)
+        return _map_frame_pandas(file, spec, report)
+    except Exception as e:
+        raise ValueError(f"خطأ في قراءة ملف Excel: {str(e)}")
+
+
+# --- pandas engine (vectorized) ---
+
+def _text_column(df, name):
+    import pandas as pd
+    if name not in df:
+        return pd.Series('', index=df.index, dtype=object)
+    column = df[name]
+    return column.where(column.notna(), '').astype(str).str.strip()
+
+
+def _excel_rows(mask, header_row):
+    """Excel row numbers (1-based) of the data rows selected by a boolean mask."""
+    return (mask[mask].index + header_row + 2).tolist()
+
+
+def _numeric_column(df, name, report, header_row):
+    """
+    Coerces a whole column to float: strips thousands separators, treats blanks
+    as 0 and records the cells that are not numbers. Returns (values, bad_mask).
+    """
+    import pandas as pd
+    if name not in df:
+        return pd.Series(0.0, index=df.index), pd.Series(False, index=df.index)
+    cleaned = _text_column(df, name).str.replace(',', '', regex=False)
+    values = pd.to_numeric(cleaned.where(cleaned != '', '0'), errors='coerce')
+    bad = values.isna()
+    if bad.any():
+        report.setdefault(name, []).extend(_excel_rows(bad, header_row))
+    return values.fillna(0.0).astype(float), bad
+
+
+def _date_column(df, name, report, header_row):
+    """Coerces a whole column to dates (None for blanks). Returns (values, bad_mask)."""
+    import pandas as pd
+    if name not in df:
+        return pd.Series(None, index=df.index, dtype=object), pd.Series(False, index=df.index)
+    parsed = pd.to_datetime(df[name], errors='coerce')
+    bad = parsed.isna() & (_text_column(df, name) != '')
+    if bad.any():
+        report.setdefault(name, []).extend(_excel_rows(bad, header_row))
+    dates = pd.Series(parsed.dt.date, index=df.index, dtype=object)
+    return dates.where(parsed.notna(), None), bad
+
+
+def _map_frame_pandas(file, spec, report):
+    import pandas as pd
+    header_row = spec['header_row']
+    # dtype=object keeps the raw cell values (no float upcasting of item numbers);
+    # only empty cells are NA, so texts like 'NA' are read as the openpyxl engine reads them
+    df = pd.read_excel(file, header=header_row, dtype=object, keep_default_na=False, na_values=[''])
+
+    columns = {}
+    bad_any = pd.Series(False, index=df.index)
+    for key, header, kind in spec['columns']:
+        if kind == 'number':
+            columns[key], bad = _numeric_column(df, header, report, header_row)
+            bad_any |= bad
+        elif kind == 'date':
+            columns[key], bad = _date_column(df, header, report, header_row)
+            bad_any |= bad
+        else:
+            columns[key] = _text_column(df, header)
+
+    keep = (_text_column(df, spec['required']) != '') & ~bad_any
+    if not keep.any():
+        return []
+    return pd.DataFrame(columns)[keep].to_dict('records')
+
+
+# --- openpyxl engine (streaming, no pandas) ---
+
+def _cell_text(value):
+    return '' if value is None else str(value).strip()
+
+
+def _cell_number(value):
+    """Same rules as _numeric_column; raises ValueError for a bad cell."""
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if isinstance(value, (int, float)):
+        number = float(value)
+    else:
+        text = _cell_text(value).replace(',', '')
+        number = float(text) if text else 0.0
+    if number != number:  # NaN
+        raise ValueError(value)
+    return number
+
+
+def _cell_date(value):
+    """Same rules as _date_column (ISO strings); raises ValueError for a bad cell."""
+    if value is None or _cell_text(value) == '':
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if hasattr(value, 'year') and hasattr(value, 'day'):
+        return value
+    return datetime.fromisoformat(_cell_text(value)).date()
+
+
+def _map_rows_openpyxl(file, spec, report):
+    header_row = spec['header_row']
+    converters = {'number': _cell_number, 'date': _cell_date}
+
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        for _ in range(header_row):
+            next(rows, None)
+        headers = [_cell_text(h) for h in (next(rows, None) or ())]
+        index_of = {}
+        for position, header in enumerate(headers):
+            index_of.setdefault(header, position)
+
+        columns = [(key, header, kind, index_of.get(header)) for key, header, kind in spec['columns']]
+        required_index = index_of.get(spec['required'])
+
+        records = []
+        for row_number, row in enumerate(rows, start=header_row + 2):
+            record = {}
+            row_ok = True
+            for key, header, kind, position in columns:
+                value = row[position] if position is not None and position < len(row) else None
+                if kind == 'text':
+                    record[key] = _cell_text(value)
+                    continue
+                try:
+                    record[key] = converters[kind](value)
+                except (ValueError, TypeError):
+                    report.setdefault(header, []).append(row_number)
+                    row_ok = False
+            required = row[required_index] if required_index is not None and required_index < len(row) else None
+            if row_ok and _cell_text(required) != '':
+                records.append(record)
+        return records
+    finally:
+        wb.close()
+# --- END: Excel import engines ---
+
+
+def import_material_request_from_excel(file, report=None, engine=None):
     """
     Import Material Request items from Excel file
     
     Args:
         file: FileStorage object from Flask request
+        report: Optional dict filled with {column: [Excel row numbers]} of invalid cells
+        engine: 'pandas' (default) or 'openpyxl'
         
     Returns:
         list: List of dictionaries containing item data
     """
-    try:
-        df = pd.read_excel(file, header=5)  # Data starts at row 6 (0-indexed: 5)
-        
-        items = []
-        for _, row in df.iterrows():
-            # Skip empty rows
-            if pd.isna(row.get('اسم المادة والوصف')):
-                continue
-            
-            item = {
-                'boq_item_number': row.get('رقم البند (B.O.Q)', ''),
-                'material_name': row.get('اسم المادة والوصف', ''),
-                'unit': row.get('الوحدة', ''),
-                'quantity_available': float(row.get('الكمية المتاحة', 0) or 0),
-                'quantity_requested': float(row.get('الكمية المطلوبة', 0) or 0),
-                'required_date': pd.to_datetime(row.get('تاريخ التوريد المطلوب')).date() if pd.notna(row.get('تاريخ التوريد المطلوب')) else None
-            }
-            items.append(item)
-        
-        return items
-    except Exception as e:
-        raise ValueError(f"خطأ في قراءة ملف Excel: {str(e)}")
+    return _import_excel(file, MATERIAL_REQUEST_IMPORT_SPEC, report, engine)
 
 
-def import_material_return_from_excel(file):
+def import_material_return_from_excel(file, report=None, engine=None):
     """
     Import Material Return items from Excel file
     
     Args:
         file: FileStorage object from Flask request
+        report: Optional dict filled with {column: [Excel row numbers]} of invalid cells
+        engine: 'pandas' (default) or 'openpyxl'
         
     Returns:
         list: List of dictionaries containing item data
     """
-    try:
-        df = pd.read_excel(file, header=5)  # Data starts at row 6 (0-indexed: 5)
-        
-        items = []
-        for _, row in df.iterrows():
-            # Skip empty rows
-            if pd.isna(row.get('اسم المادة والوصف')):
-                continue
-            
-            item = {
-                'boq_item_number': row.get('رقم البند (B.O.Q)', ''),
-                'material_name': row.get('اسم المادة والوصف', ''),
-                'unit': row.get('الوحدة', ''),
-                'quantity': float(row.get('الكمية', 0) or 0),
-                'notes': row.get('الملاحظات', '')
-            }
-            items.append(item)
-        
-        return items
-    except Exception as e:
-        raise ValueError(f"خطأ في قراءة ملف Excel: {str(e)}")
+    return _import_excel(file, MATERIAL_RETURN_IMPORT_SPEC, report, engine)
 
 
 def download_material_request_template():
@@ -516,88 +697,77 @@ def download_material_return_template():
 # --- START: الدوال المفقودة التي تسببت في خطأ BOQ ImportError ---
 # يجب أن تكون هذه الدوال موجودة في ملف excel_utils.py لتتمكن ملفات الـ routes من استيرادها.
 
+BOQ_EXPORT_HEADERS = [
+    'رقم البند', 'الوصف', 'الوحدة', 'الكمية المخططة', 'الكمية المنفذة',
+    'سعر الوحدة', 'القيمة الإجمالية', 'نسبة الإنجاز (%)', 'التصنيف'
+]
+
+
 def export_boq_to_excel(items):
     """
-    Generate BOQ Excel for export.
+    Generate BOQ Excel for export (streaming).
+
+    Rows are written with xlsxwriter in constant_memory mode, so each row is
+    flushed to disk as soon as it is written and memory stays flat whatever
+    the row count. `items` can be any iterable, e.g. a query with yield_per().
+
+    Args:
+        items: Iterable of BOQItem objects
+
+    Returns:
+        file: Temporary file positioned at the start (deleted when closed)
     """
-    # يجب استيراد هذه الدوال داخل نطاق الدالة لتفادي مشكلة numpy/pandas
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment
-    from openpyxl.utils import get_column_letter
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "جدول الكميات"
-    
+    # يجب استيراد هذه المكتبة داخل نطاق الدالة لتفادي مشكلة numpy/pandas
+    import tempfile
+    import xlsxwriter
+
+    output = tempfile.TemporaryFile()
+    wb = xlsxwriter.Workbook(output, {'constant_memory': True, 'in_memory': False})
+    ws = wb.add_worksheet("جدول الكميات")
+
     # Styling
-    header_fill = PatternFill(start_color="047857", end_color="047857", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF")
-    
+    header_format = wb.add_format({
+        'bold': True, 'font_color': '#FFFFFF', 'bg_color': '#047857',
+        'align': 'center', 'valign': 'vcenter'
+    })
+    # Column widths must be set before any row is written in constant_memory mode
+    ws.set_column(0, len(BOQ_EXPORT_HEADERS) - 1, 20)
+
     # Headers
-    headers = [
-        'رقم البند', 'الوصف', 'الوحدة', 'الكمية المخططة', 'الكمية المنفذة', 
-        'سعر الوحدة', 'القيمة الإجمالية', 'نسبة الإنجاز (%)', 'التصنيف'
-    ]
-    
-    row = 1
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=row, column=col, value=header)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        
+    ws.write_row(0, 0, BOQ_EXPORT_HEADERS, header_format)
+
     # Data rows
-    row = 2
-    for item in items:
+    for row, item in enumerate(items, 1):
         # التأكد من أن الـ properties موجودة قبل الوصول إليها
-        ws.cell(row=row, column=1, value=getattr(item, 'item_number', ''))
-        ws.cell(row=row, column=2, value=getattr(item, 'description', ''))
-        ws.cell(row=row, column=3, value=getattr(item, 'unit', ''))
-        ws.cell(row=row, column=4, value=getattr(item, 'quantity', 0.0))
-        ws.cell(row=row, column=5, value=getattr(item, 'executed_quantity', 0.0))
-        ws.cell(row=row, column=6, value=getattr(item, 'unit_price', 0.0))
-        ws.cell(row=row, column=7, value=getattr(item, 'total_price', 0.0))
-        ws.cell(row=row, column=8, value=f"{getattr(item, 'completion_percentage', 0.0):.2f}%")
-        ws.cell(row=row, column=9, value=getattr(item, 'category', ''))
-        row += 1
-    
-    # Auto-fit columns
-    for column in ws.columns:
-        ws.column_dimensions[get_column_letter(column[0].column)].width = 20
-    
-    output = io.BytesIO()
-    wb.save(output)
+        ws.write_row(row, 0, [
+            getattr(item, 'item_number', ''),
+            getattr(item, 'description', ''),
+            getattr(item, 'unit', ''),
+            getattr(item, 'quantity', 0.0),
+            getattr(item, 'executed_quantity', 0.0),
+            getattr(item, 'unit_price', 0.0),
+            getattr(item, 'total_price', 0.0),
+            f"{getattr(item, 'completion_percentage', 0.0) or 0.0:.2f}%",
+            getattr(item, 'category', ''),
+        ])
+
+    wb.close()
     output.seek(0)
     return output
 
 
-def import_boq_from_excel(file):
+def import_boq_from_excel(file, report=None, engine=None):
     """
-    Import BOQ items from Excel file. (Simplified implementation)
+    Import BOQ items from Excel file.
+
+    Args:
+        file: FileStorage object from Flask request
+        report: Optional dict filled with {column: [Excel row numbers]} of invalid cells
+        engine: 'pandas' (default) or 'openpyxl'
+
+    Returns:
+        list: List of dictionaries containing item data
     """
-    import pandas as pd
-    
-    try:
-        df = pd.read_excel(file, header=0) 
-        
-        items = []
-        for _, row in df.iterrows():
-            if pd.isna(row.get('رقم البند')):
-                continue
-                
-            items.append({
-                'item_number': str(row.get('رقم البند', '')),
-                'description': str(row.get('الوصف', '')),
-                'unit': str(row.get('الوحدة', '')),
-                'quantity': float(row.get('الكمية المخططة', 0) or 0),
-                'unit_price': float(row.get('سعر الوحدة', 0) or 0),
-                'total_price': float(row.get('القيمة الإجمالية', 0) or 0),
-                'category': str(row.get('التصنيف', '')),
-            })
-        
-        return items
-    except Exception as e:
-        # استخدام ValueError لسهولة التعامل مع الـ traceback
-        raise ValueError(f"خطأ في قراءة ملف Excel: {str(e)}")
+    return _import_excel(file, BOQ_IMPORT_SPEC, report, engine)
 
 # --- END: الدوال المفقودة ---
\ No newline at end of file
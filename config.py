@@ -12,6 +12,36 @@ class Config:
         "pool_pre_ping": True,
     }
 
+    # Sidebar cache: in-process by default, shared through Redis when REDIS_URL is set
+    SIDEBAR_CACHE_TTL = int(os.environ.get('SIDEBAR_CACHE_TTL', 300))
+    SIDEBAR_CACHE_REDIS_URL = os.environ.get('REDIS_URL')
+    # Without Redis, invalidations reach the other workers of the host through this file.
+    # Defaults to <instance>/sidebar_cache.version
+    SIDEBAR_CACHE_VERSION_FILE = os.environ.get('SIDEBAR_CACHE_VERSION_FILE')
+
+    # Excel import engine: 'pandas' (vectorized DataFrame) or 'openpyxl' (streaming read-only)
+    EXCEL_IMPORT_ENGINE = os.environ.get('EXCEL_IMPORT_ENGINE', 'pandas')
+
+    # BOQ imports run as resumable jobs: rows committed per chunk, seconds of work per request
+    BOQ_IMPORT_CHUNK_SIZE = int(os.environ.get('BOQ_IMPORT_CHUNK_SIZE', 500))
+    BOQ_IMPORT_TIME_BUDGET = int(os.environ.get('BOQ_IMPORT_TIME_BUDGET', 20))
+
+    # Background jobs (exports, imports, PDFs): 'worker' = separate `flask run-worker` process
+    # (started next to gunicorn by the Dockerfile), 'inline' = run inside the request (serverless,
+    # the default on Vercel), 'thread' = worker threads in the web process (debug/testing only:
+    # jobs die with the process when gunicorn recycles a worker)
+    JOBS_EXECUTION = os.environ.get('JOBS_EXECUTION', 'inline' if os.environ.get('VERCEL') else 'worker')
+    JOBS_WORKER_THREADS = int(os.environ.get('JOBS_WORKER_THREADS', 1))
+    JOBS_POLL_INTERVAL = int(os.environ.get('JOBS_POLL_INTERVAL', 2))
+    # A running job refreshes its heartbeat every JOBS_HEARTBEAT_INTERVAL seconds; one without a
+    # heartbeat for JOBS_STALE_AFTER seconds is assumed dead and requeued
+    JOBS_HEARTBEAT_INTERVAL = int(os.environ.get('JOBS_HEARTBEAT_INTERVAL', 30))
+    JOBS_STALE_AFTER = int(os.environ.get('JOBS_STALE_AFTER', 300))
+    # Files produced by jobs (exports, PDFs); must be shared by the web and worker processes.
+    # Defaults to <instance>/job_results. Not used in 'inline' mode: the file is sent back with
+    # the request that produced it
+    JOBS_RESULTS_DIR = os.environ.get('JOBS_RESULTS_DIR')
+
     # Cookie/session hardening
     SESSION_COOKIE_HTTPONLY = True
     REMEMBER_COOKIE_HTTPONLY = True
@@ -0,0 +1,45 @@
+#!/bin/bash
+# نقطة تشغيل الحاوية. الدور يُمرَّر كوسيط (CMD):
+#   web     -> gunicorn فقط (شغّل العامل كخدمة/حاوية مستقلة بسياسة إعادة تشغيل)
+#   worker  -> عامل المهام الخلفية فقط: flask run-worker
+#   all     -> الاثنان معاً (الافتراضي). إذا توقفت أي عملية تُوقَف الأخرى وتخرج الحاوية
+#              بخطأ، فتعيد سياسة إعادة التشغيل (Cloud Run / docker --restart) تشغيلهما معاً
+#              بدلاً من بقاء gunicorn يضيف مهاماً لا ينفذها أحد.
+set -euo pipefail
+
+GUNICORN=(gunicorn --bind ":${PORT:-8080}" --workers "${WEB_CONCURRENCY:-4}" --timeout 120 index:app)
+WORKER=(flask run-worker --threads "${JOBS_WORKER_THREADS:-1}")
+
+role="${1:-all}"
+case "$role" in
+    web)
+        exec "${GUNICORN[@]}"
+        ;;
+    worker)
+        exec "${WORKER[@]}"
+        ;;
+    all)
+        "${WORKER[@]}" &
+        worker_pid=$!
+        "${GUNICORN[@]}" &
+        web_pid=$!
+
+        stopping=0
+        trap 'stopping=1; kill -TERM "$worker_pid" "$web_pid" 2>/dev/null || true' TERM INT
+
+        set +e
+        wait -n "$worker_pid" "$web_pid"
+        status=$?
+        kill -TERM "$worker_pid" "$web_pid" 2>/dev/null
+        wait
+        if [ "$stopping" = 0 ]; then
+            echo "docker-entrypoint: a process exited (status $status), stopping the container" >&2
+            # Never exit 0 here: an on-failure restart policy must bring both processes back
+            [ "$status" = 0 ] && status=1
+        fi
+        exit "$status"
+        ;;
+    *)
+        exec "$@"
+        ;;
+esac
@@ -0,0 +1,52 @@
+"""add project_financials rollup table
+
+Revision ID: 004_add_project_financials
+Revises: ca08b07f2401
+Create Date: 2026-10-18 10:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '004_add_project_financials'
+down_revision = 'ca08b07f2401'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('project_financials',
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('total_contract_cost', sa.Float(), server_default='0', nullable=False),
+    sa.Column('total_actual_cost', sa.Float(), server_default='0', nullable=False),
+    sa.Column('total_invoiced_amount', sa.Float(), server_default='0', nullable=False),
+    sa.Column('total_paid_amount', sa.Float(), server_default='0', nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['project_id'], ['project.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('project_id')
+    )
+
+    # Backfill the rollup for existing projects (same figures as `flask rebuild-rollups`)
+    op.execute("""
+        INSERT INTO project_financials
+            (project_id, total_contract_cost, total_actual_cost, total_invoiced_amount, total_paid_amount, updated_at)
+        SELECT p.id,
+            COALESCE((SELECT SUM(i.contract_quantity * i.contract_unit_cost)
+                      FROM item i WHERE i.project_id = p.id), 0),
+            COALESCE((SELECT SUM(cd.quantity * cd.unit_cost * (1 + cd.vat_percent / 100))
+                      FROM cost_detail cd JOIN item i ON i.id = cd.item_id
+                      WHERE i.project_id = p.id), 0),
+            COALESCE((SELECT SUM(ii.total_price)
+                      FROM invoice_item ii JOIN invoice inv ON inv.id = ii.invoice_id
+                      WHERE inv.project_id = p.id), 0),
+            COALESCE((SELECT SUM(pay.amount)
+                      FROM payment pay JOIN invoice inv ON inv.id = pay.invoice_id
+                      WHERE inv.project_id = p.id), 0),
+            CURRENT_TIMESTAMP
+        FROM project p
+    """)
+
+
+def downgrade():
+    op.drop_table('project_financials')
@@ -0,0 +1,51 @@
+"""add natural sort key to item.item_number
+
+Revision ID: 005_add_item_number_sort_key
+Revises: 004_add_project_financials
+Create Date: 2026-10-18 11:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.utils import natural_sort_key
+
+
+revision = '005_add_item_number_sort_key'
+down_revision = '004_add_project_financials'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def _sort_key_type():
+    return sa.String(length=255).with_variant(sa.String(length=255, collation='C'), 'postgresql')
+
+
+def upgrade():
+    with op.batch_alter_table('item', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('item_number_sort_key', _sort_key_type(), nullable=True))
+
+    # Backfill existing rows in batches
+    bind = op.get_bind()
+    item = sa.table('item', sa.column('id', sa.Integer), sa.column('item_number', sa.String),
+                    sa.column('item_number_sort_key', sa.String))
+    rows = bind.execute(sa.select(item.c.id, item.c.item_number)).all()
+    update_stmt = item.update().where(item.c.id == sa.bindparam('row_id')).values(
+        item_number_sort_key=sa.bindparam('sort_key')
+    )
+    for start in range(0, len(rows), BATCH_SIZE):
+        batch = rows[start:start + BATCH_SIZE]
+        bind.execute(update_stmt, [
+            {'row_id': row.id, 'sort_key': natural_sort_key(row.item_number)} for row in batch
+        ])
+
+    with op.batch_alter_table('item', schema=None) as batch_op:
+        batch_op.create_index('idx_item_project_sort_key', ['project_id', 'item_number_sort_key', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('item', schema=None) as batch_op:
+        batch_op.drop_index('idx_item_project_sort_key')
+        batch_op.drop_column('item_number_sort_key')
@@ -0,0 +1,51 @@
+"""add natural sort key to invoice.invoice_number
+
+Revision ID: 006_add_invoice_number_sort_key
+Revises: 005_add_item_number_sort_key
+Create Date: 2026-10-18 12:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.utils import natural_sort_key
+
+
+revision = '006_add_invoice_number_sort_key'
+down_revision = '005_add_item_number_sort_key'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def _sort_key_type():
+    return sa.String(length=255).with_variant(sa.String(length=255, collation='C'), 'postgresql')
+
+
+def upgrade():
+    with op.batch_alter_table('invoice', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('invoice_number_sort_key', _sort_key_type(), nullable=True))
+
+    # Backfill existing rows in batches
+    bind = op.get_bind()
+    invoice = sa.table('invoice', sa.column('id', sa.Integer), sa.column('invoice_number', sa.String),
+                       sa.column('invoice_number_sort_key', sa.String))
+    rows = bind.execute(sa.select(invoice.c.id, invoice.c.invoice_number)).all()
+    update_stmt = invoice.update().where(invoice.c.id == sa.bindparam('row_id')).values(
+        invoice_number_sort_key=sa.bindparam('sort_key')
+    )
+    for start in range(0, len(rows), BATCH_SIZE):
+        batch = rows[start:start + BATCH_SIZE]
+        bind.execute(update_stmt, [
+            {'row_id': row.id, 'sort_key': natural_sort_key(row.invoice_number)} for row in batch
+        ])
+
+    with op.batch_alter_table('invoice', schema=None) as batch_op:
+        batch_op.create_index('idx_invoice_project_sort_key', ['project_id', 'invoice_number_sort_key'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('invoice', schema=None) as batch_op:
+        batch_op.drop_index('idx_invoice_project_sort_key')
+        batch_op.drop_column('invoice_number_sort_key')
@@ -0,0 +1,46 @@
+"""add boq_import_job table for chunked, resumable BOQ imports
+
+Revision ID: 007_add_boq_import_job
+Revises: 006_add_invoice_number_sort_key
+Create Date: 2026-10-18 13:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '007_add_boq_import_job'
+down_revision = '006_add_invoice_number_sort_key'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('boq_import_job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('filename', sa.String(length=255), nullable=False),
+    sa.Column('file_hash', sa.String(length=64), nullable=False),
+    sa.Column('file_data', sa.LargeBinary(), nullable=False),
+    sa.Column('engine', sa.String(length=20), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('total_rows', sa.Integer(), nullable=True),
+    sa.Column('processed_rows', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('invalid_cells', sa.JSON(), nullable=True),
+    sa.Column('error_message', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['project_id'], ['project.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('boq_import_job', schema=None) as batch_op:
+        batch_op.create_index('idx_boq_import_job_checkpoint', ['project_id', 'file_hash'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('boq_import_job', schema=None) as batch_op:
+        batch_op.drop_index('idx_boq_import_job_checkpoint')
+    op.drop_table('boq_import_job')
@@ -0,0 +1,42 @@
+"""add sheet_sync_state / sheet_sync_row for incremental Google Sheets sync
+
+Revision ID: 009_add_sheet_sync
+Revises: 008_add_background_job
+Create Date: 2026-10-18 15:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '009_add_sheet_sync'
+down_revision = '008_add_background_job'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sheet_sync_state',
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('spreadsheet_id', sa.String(length=255), nullable=False),
+    sa.Column('sheet_id', sa.Integer(), nullable=False),
+    sa.Column('sheet_title', sa.String(length=255), nullable=False),
+    sa.Column('row_count', sa.Integer(), nullable=False, server_default='1'),
+    sa.Column('last_synced_at', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['project_id'], ['project.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('project_id')
+    )
+    op.create_table('sheet_sync_row',
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('item_id', sa.Integer(), nullable=False),
+    sa.Column('row_index', sa.Integer(), nullable=False),
+    sa.Column('row_hash', sa.String(length=32), nullable=False),
+    sa.ForeignKeyConstraint(['project_id'], ['sheet_sync_state.project_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('project_id', 'item_id')
+    )
+
+
+def downgrade():
+    op.drop_table('sheet_sync_row')
+    op.drop_table('sheet_sync_state')
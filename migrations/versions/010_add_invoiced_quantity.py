@@ -0,0 +1,41 @@
+"""add invoiced_quantity ledger columns to item and cost_detail
+
+Revision ID: 010_add_invoiced_quantity
+Revises: 009_add_sheet_sync
+Create Date: 2026-10-18 18:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '010_add_invoiced_quantity'
+down_revision = '009_add_sheet_sync'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('item', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('invoiced_quantity', sa.Float(), nullable=False, server_default='0'))
+    with op.batch_alter_table('cost_detail', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('invoiced_quantity', sa.Float(), nullable=False, server_default='0'))
+
+    # Backfill the counters from the existing invoice lines
+    op.execute(
+        "UPDATE item SET invoiced_quantity = COALESCE(("
+        "SELECT SUM(invoice_item.quantity) FROM invoice_item "
+        "WHERE invoice_item.item_id = item.id AND invoice_item.cost_detail_id IS NULL), 0)"
+    )
+    op.execute(
+        "UPDATE cost_detail SET invoiced_quantity = COALESCE(("
+        "SELECT SUM(invoice_item.quantity) FROM invoice_item "
+        "WHERE invoice_item.cost_detail_id = cost_detail.id), 0)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('cost_detail', schema=None) as batch_op:
+        batch_op.drop_column('invoiced_quantity')
+    with op.batch_alter_table('item', schema=None) as batch_op:
+        batch_op.drop_column('invoiced_quantity')
@@ -0,0 +1,28 @@
+"""store background job result files on disk instead of in background_job
+
+Revision ID: 011_job_result_files
+Revises: 010_add_invoiced_quantity
+Create Date: 2026-10-19 10:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '011_job_result_files'
+down_revision = '010_add_invoiced_quantity'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Files produced before the upgrade are not carried over: those jobs show as having no file
+    with op.batch_alter_table('background_job', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('result_path', sa.String(length=255), nullable=True))
+        batch_op.drop_column('result_data')
+
+
+def downgrade():
+    with op.batch_alter_table('background_job', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('result_data', sa.LargeBinary(), nullable=True))
+        batch_op.drop_column('result_path')
@@ -0,0 +1,30 @@
+"""allow boq_import_job.file_data to be dropped once the import is completed
+
+Revision ID: 012_boq_import_file_nullable
+Revises: 011_job_result_files
+Create Date: 2026-10-20 10:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '012_boq_import_file_nullable'
+down_revision = '011_job_result_files'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('boq_import_job', schema=None) as batch_op:
+        batch_op.alter_column('file_data', existing_type=sa.LargeBinary(), nullable=True)
+
+    # Completed imports never read their file again
+    op.execute("UPDATE boq_import_job SET file_data = NULL WHERE status = 'completed'")
+
+
+def downgrade():
+    # Jobs whose file was dropped cannot be resumed anyway: remove them before restoring NOT NULL
+    op.execute("DELETE FROM boq_import_job WHERE file_data IS NULL")
+    with op.batch_alter_table('boq_import_job', schema=None) as batch_op:
+        batch_op.alter_column('file_data', existing_type=sa.LargeBinary(), nullable=False)
@@ -0,0 +1,26 @@
+"""add background_job.heartbeat_at, refreshed while a job runs
+
+Revision ID: 013_background_job_heartbeat
+Revises: 012_boq_import_file_nullable
+Create Date: 2026-10-21 10:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '013_background_job_heartbeat'
+down_revision = '012_boq_import_file_nullable'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Left empty for existing rows: staleness falls back to started_at
+    with op.batch_alter_table('background_job', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('background_job', schema=None) as batch_op:
+        batch_op.drop_column('heartbeat_at')
@@ -318,7 +318,8 @@ function setupBulkActions() {
     
     if (bulkEditForm) {
         const selectAllCheckbox = document.getElementById('select-all');
-        const itemCheckboxes = document.querySelectorAll('.item-checkbox');
+        // Rows can be appended later by the infinite scroll, so checkboxes are looked up on demand
+        const getItemCheckboxes = () => bulkEditForm.querySelectorAll('.item-checkbox');
         const selectedCountDisplay = document.getElementById('selected-count-display');
         const bulkUpdateBtn = document.getElementById('bulk-update-btn');
         const bulkDeleteBtn = document.getElementById('bulk-delete-btn');
@@ -367,7 +368,7 @@ function setupBulkActions() {
             selectAllCheckbox.addEventListener('change', function() {
                 const isChecked = this.checked;
                 
-                itemCheckboxes.forEach(checkbox => {
+                getItemCheckboxes().forEach(checkbox => {
                     checkbox.checked = isChecked;
                     // Add visual feedback directly to the row for better clarity
                     const row = checkbox.closest('tr');
@@ -379,25 +380,24 @@ function setupBulkActions() {
                 updateSelectedState();
             });
 
-            // Individual checkbox functionality
-            itemCheckboxes.forEach(checkbox => {
-                checkbox.addEventListener('change', function() {
-                    if (!this.checked) {
-                        selectAllCheckbox.checked = false;
-                    } else if (document.querySelectorAll('.item-checkbox:checked').length === itemCheckboxes.length) {
-                        selectAllCheckbox.checked = true;
-                    }
-                    
-                    // Visual feedback
-                    const row = this.closest('tr');
-                    if (row) {
-                        row.style.backgroundColor = this.checked ? 'var(--bg-hover)' : '';
-                    }
-                    
-                    updateSelectedState();
-                });
+            // Individual checkbox functionality (delegated to the form)
+            bulkEditForm.addEventListener('change', function(event) {
+                const checkbox = event.target;
+                if (!checkbox.classList.contains('item-checkbox')) return;
+
+                if (!checkbox.checked) {
+                    selectAllCheckbox.checked = false;
+                } else if (document.querySelectorAll('.item-checkbox:checked').length === getItemCheckboxes().length) {
+                    selectAllCheckbox.checked = true;
+                }
                 
-                // Hover effects (removed for table rows as it's already handled by CSS)
+                // Visual feedback
+                const row = checkbox.closest('tr');
+                if (row) {
+                    row.style.backgroundColor = checkbox.checked ? 'var(--bg-hover)' : '';
+                }
+                
+                updateSelectedState();
             });
         }
 